@@ -0,0 +1,79 @@
+# coding=utf8
+"""
+启动耗时测试: 导入 ui_auto.android_ui、创建 AndroidBaseUI、执行第一条ADB命令、首次连接 airtest 设备及首次截图
+
+    python benchmarks/bench_startup.py                     # 只测试导入
+    python benchmarks/bench_startup.py -s <设备号> [-b pure]  # 连接设备测试
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = '''
+import sys, time
+t = time.perf_counter()
+import ui_auto.android_ui
+print(time.perf_counter() - t, 'airtest' in sys.modules, 'cv2' in sys.modules)
+'''
+
+
+def bench_import(repeat: int):
+    # 每次都在新的进程中导入，避免模块缓存的影响
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(x for x in (ROOT, os.environ.get('PYTHONPATH')) if x))
+    costs = []
+    for _ in range(repeat):
+        rs = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], env=env, check=True, capture_output=True, text=True)
+        cost, airtest_loaded, cv2_loaded = rs.stdout.split()
+        costs.append(float(cost))
+    costs.sort()
+    print(f'import ui_auto.android_ui: min {costs[0] * 1000:.1f} ms, median {costs[len(costs) // 2] * 1000:.1f} ms, '
+          f'airtest loaded: {airtest_loaded}, cv2 loaded: {cv2_loaded}')
+
+
+def create_adb(serial: str, backend: str):
+    if backend == 'pure':
+        from ui_auto.pure_adb import PureAdb
+        return PureAdb(serial)
+    from ui_auto.py_adb import PyAdb
+    return PyAdb(serial)
+
+
+def bench_device(serial: str, backend: str):
+    sys.path.insert(0, ROOT)
+    from ui_auto.my_adb import AdbProxy
+    from ui_auto.android_ui import AndroidBaseUI
+
+    def step(name, func):
+        t = time.perf_counter()
+        rs = func()
+        print(f'{name}: {(time.perf_counter() - t) * 1000:.1f} ms')
+        return rs
+
+    adb = step('connect adb', lambda: AdbProxy(create_adb(serial, backend)))
+    ui = step('create AndroidBaseUI', lambda: AndroidBaseUI(adb))
+    step('first adb command', lambda: adb.run_shell('echo', True))
+    step('device info', lambda: ui.device_info)
+    # 创建 AndroidBaseUI 时不会连接 airtest 设备，首次访问设备时才连接
+    step('init airtest device', lambda: ui.device)
+    step('resolution', lambda: ui.resolution)
+    step('first snapshot', lambda: ui.snapshot(refresh=True))
+    ui.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--serial', help='设备号，为空时只测试导入耗时')
+    parser.add_argument('-b', '--backend', choices=('py', 'pure'), default='py', help='ADB实现: py_adb 或 pure_adb')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='导入测试的次数')
+    args = parser.parse_args()
+    bench_import(args.repeat)
+    if args.serial:
+        bench_device(args.serial, args.backend)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# coding=utf8
+import asyncio
+import struct
+
+
+class FakeAdbServer:
+    """
+    本地模拟的 adb server(smart socket 协议)，用于测试 AsyncAdb
+    shell 命令的输出由 shell_outputs 指定，按 chunk_size 分块发送；sync 推送的文件保存在 files 中
+    """
+
+    def __init__(self, serials=('dev1',), shell_outputs: dict = None, chunk_size: int = 7):
+        self.serials = list(serials)
+        self.shell_outputs = dict(shell_outputs or {})
+        self.chunk_size = chunk_size
+        self.files = {}
+        self.commands = []
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> 'FakeAdbServer':
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    def _fail(writer, msg: str):
+        data = msg.encode('utf-8')
+        writer.write(b'FAIL' + b'%04x' % len(data) + data)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                n = int(await reader.readexactly(4), 16)
+                msg = (await reader.readexactly(n)).decode('utf-8')
+                if msg == 'host:devices':
+                    data = ''.join(f'{x}\tdevice\n' for x in self.serials).encode('utf-8')
+                    writer.write(b'OKAY' + b'%04x' % len(data) + data)
+                    break
+                if msg.startswith('host:transport:'):
+                    if msg[len('host:transport:'):] not in self.serials:
+                        self._fail(writer, 'device not found')
+                        break
+                    writer.write(b'OKAY')
+                    continue
+                if msg.startswith('shell:'):
+                    await self._shell(writer, msg[len('shell:'):])
+                    break
+                if msg == 'sync:':
+                    writer.write(b'OKAY')
+                    await self._sync(reader, writer)
+                    break
+                self._fail(writer, f'unknown service {msg}')
+                break
+            await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def _shell(self, writer, cmd: str):
+        self.commands.append(cmd)
+        writer.write(b'OKAY')
+        out = self.shell_outputs.get(cmd, b'')
+        if isinstance(out, str):
+            out = out.encode('utf-8')
+        for i in range(0, len(out), self.chunk_size):
+            writer.write(out[i:i + self.chunk_size])
+            await writer.drain()
+            # 让客户端分多次读到数据
+            await asyncio.sleep(0)
+
+    async def _sync(self, reader, writer):
+        cmd, n = struct.unpack('<4sI', await reader.readexactly(8))
+        arg = (await reader.readexactly(n)).decode('utf-8')
+        if cmd == b'SEND':
+            path = arg.rsplit(',', 1)[0]
+            data = b''
+            while True:
+                c, n = struct.unpack('<4sI', await reader.readexactly(8))
+                if c == b'DONE':
+                    break
+                data += await reader.readexactly(n)
+            self.files[path] = data
+            writer.write(b'OKAY' + struct.pack('<I', 0))
+        elif cmd == b'RECV':
+            if arg not in self.files:
+                msg = b'No such file or directory'
+                writer.write(b'FAIL' + struct.pack('<I', len(msg)) + msg)
+                return
+            data = self.files[arg]
+            for i in range(0, len(data), 64 * 1024):
+                d = data[i:i + 64 * 1024]
+                writer.write(b'DATA' + struct.pack('<I', len(d)) + d)
+            writer.write(b'DONE' + struct.pack('<I', 0))
@@ -0,0 +1,194 @@
+# coding=utf8
+import struct
+import threading
+import time
+
+from adb import usb_exceptions
+from adb.adb_protocol import AdbMessage
+import usb1
+
+
+class FakeAdbdHandle:
+    """
+    模拟USB连接另一端的 adbd(数据包协议，带流量控制)，用于测试 PyAdb 的多路复用
+    shell 命令的输出由 shell_outputs 指定，值为字符串或 func(stream)；`shell:logcat` 持续输出直到被关闭；
+    sync 推送的文件保存在 files 中
+    """
+
+    def __init__(self, shell_outputs: dict = None, files: dict = None):
+        self.shell_outputs = dict(shell_outputs or {})
+        self.files = dict(files or {})
+        self.commands = []
+        self.broken = False
+        self._out = bytearray()
+        self._cond = threading.Condition()
+        self._pending = None
+        self._streams = {}
+        self._next_id = 100
+
+    def restart(self) -> 'FakeAdbdHandle':
+        """
+        :return: 重新连接后的设备端，共用命令输出、文件及命令记录
+        """
+        h = FakeAdbdHandle(self.shell_outputs, self.files)
+        h.commands = self.commands
+        return h
+
+    def break_connection(self):
+        with self._cond:
+            self.broken = True
+            self._cond.notify_all()
+
+    def _emit(self, cmd: bytes, arg0: int, arg1: int, data: bytes = b''):
+        m = AdbMessage(cmd, arg0, arg1, data)
+        with self._cond:
+            self._out += m.Pack() + data
+            self._cond.notify_all()
+
+    def BulkWrite(self, data, timeout=None):
+        if self.broken:
+            raise usb_exceptions.WriteFailedError('device gone', usb1.USBError())
+        # AdbMessage.Send 依次写入头部和数据(数据可能为空)
+        if self._pending is None:
+            cmd, arg0, arg1, _, _ = AdbMessage.Unpack(bytes(data))
+            self._pending = (AdbMessage.constants[cmd], arg0, arg1)
+            return
+        cmd, arg0, arg1 = self._pending
+        self._pending = None
+        self._handle(cmd, arg0, arg1, bytes(data))
+
+    def BulkRead(self, length, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._out or self.broken, (timeout or 1000) / 1000):
+                raise usb_exceptions.ReadFailedError('timeout', usb1.USBErrorTimeout())
+            if self.broken:
+                raise usb_exceptions.ReadFailedError('device gone', usb1.USBError())
+            data = bytes(self._out[:length])
+            del self._out[:length]
+            return bytearray(data)
+
+    def _handle(self, cmd: bytes, local_id: int, remote_id: int, data: bytes):
+        if cmd == b'OPEN':
+            stream = _FakeStream(self, self._next_id, local_id)
+            self._next_id += 1
+            self._streams[stream.id] = stream
+            self._emit(b'OKAY', stream.id, local_id)
+            threading.Thread(target=self._serve, args=(stream, data.rstrip(b'\0').decode('utf-8')),
+                             daemon=True).start()
+            return
+        stream = self._streams.get(remote_id)
+        if stream is None:
+            return
+        if cmd == b'OKAY':
+            stream.acked.set()
+        elif cmd == b'WRTE':
+            self._emit(b'OKAY', stream.id, local_id)
+            stream.feed(data)
+        elif cmd == b'CLSE':
+            self._streams.pop(stream.id, None)
+            stream.close()
+            self._emit(b'CLSE', stream.id, local_id)
+
+    def _serve(self, stream: '_FakeStream', destination: str):
+        if destination == 'sync:':
+            self._sync(stream)
+        elif destination == 'shell:logcat':
+            i = 0
+            while stream.write(f'log line {i}\n'.encode('utf-8')):
+                i += 1
+                time.sleep(0.005)
+            return
+        else:
+            cmd = destination[len('shell:'):]
+            self.commands.append(cmd)
+            out = self.shell_outputs.get(cmd, f'out:{cmd}\n')
+            if callable(out):
+                out = out(stream)
+            if out is None:
+                return
+            for i in range(0, len(out), 7):
+                stream.write(out[i:i + 7].encode('utf-8'))
+        stream.finish()
+
+    def _sync(self, stream: '_FakeStream'):
+        cmd, n = struct.unpack('<4sI', stream.read(8))
+        arg = stream.read(n).decode('utf-8')
+        if cmd == b'SEND':
+            data = bytearray()
+            while True:
+                cmd, n = struct.unpack('<4sI', stream.read(8))
+                if cmd == b'DONE':
+                    break
+                data += stream.read(n)
+            self.files[arg.rsplit(',', 1)[0]] = bytes(data)
+            stream.write(b'OKAY' + struct.pack('<I', 0))
+        elif cmd == b'RECV':
+            data = self.files.get(arg)
+            if data is None:
+                msg = b'No such file or directory'
+                stream.write(b'FAIL' + struct.pack('<I', len(msg)) + msg)
+            else:
+                for i in range(0, len(data), 1000):
+                    d = data[i:i + 1000]
+                    stream.write(b'DATA' + struct.pack('<I', len(d)) + d)
+                stream.write(b'DONE' + struct.pack('<I', 0))
+        stream.read_until_closed()
+
+
+class _FakeStream:
+    def __init__(self, device: FakeAdbdHandle, stream_id: int, local_id: int):
+        self.device = device
+        self.id = stream_id
+        self.local_id = local_id
+        self.acked = threading.Event()
+        self.closed = False
+        self._inbox = bytearray()
+        self._cond = threading.Condition()
+
+    def feed(self, data: bytes):
+        with self._cond:
+            self._inbox += data
+            self._cond.notify_all()
+
+    def read(self, length: int) -> bytes:
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._inbox) >= length or self.closed, 5)
+            data = bytes(self._inbox[:length])
+            del self._inbox[:length]
+            return data
+
+    def read_until_closed(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.closed, 5)
+
+    def write(self, data: bytes) -> bool:
+        """
+        :return: 对方是否收到，数据流已关闭时返回False
+        """
+        if self.closed:
+            return False
+        self.acked.clear()
+        self.device._emit(b'WRTE', self.id, self.local_id, data)
+        self.acked.wait(5)
+        return not self.closed
+
+    def finish(self):
+        if not self.closed:
+            self.device._streams.pop(self.id, None)
+            self.device._emit(b'CLSE', self.id, self.local_id)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self.acked.set()
+
+
+class FakeAdbCommands:
+    # 替代 python-adb 的 AdbCommands，只使用 _handle
+    def __init__(self, handle: FakeAdbdHandle):
+        self._handle = handle
+        self.closed = False
+
+    def Close(self):
+        self.closed = True
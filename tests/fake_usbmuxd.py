@@ -0,0 +1,68 @@
+# coding=utf8
+import plistlib
+import socket
+import struct
+import threading
+
+
+class FakeUsbmuxd:
+    """
+    本地模拟的 usbmuxd(plist 协议，TCP)，用于测试 TiDevicePool
+    只支持 ListDevices，已连接的设备由 udids 指定，可在运行中修改
+    """
+
+    def __init__(self, udids=()):
+        self.udids = list(udids)
+        self.requests = []
+        self._sock = socket.socket()
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(16)
+        self._closed = False
+
+    @property
+    def address(self) -> tuple:
+        return self._sock.getsockname()
+
+    def start(self) -> 'FakeUsbmuxd':
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        self._sock.close()
+
+    def _serve(self):
+        while not self._closed:
+            try:
+                c, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(c,), daemon=True).start()
+
+    @staticmethod
+    def _read(c: socket.socket, n: int) -> bytes:
+        data = b''
+        while len(data) < n:
+            d = c.recv(n - len(data))
+            if not d:
+                raise ConnectionError('closed')
+            data += d
+        return data
+
+    def _handle(self, c: socket.socket):
+        with c:
+            try:
+                n, _, _, tag = struct.unpack('<IIII', self._read(c, 16))
+                req = plistlib.loads(self._read(c, n - 16))
+            except ConnectionError:
+                return
+            self.requests.append(req['MessageType'])
+            if req['MessageType'] == 'ListDevices':
+                rs = {'DeviceList': [
+                    {'DeviceID': i, 'MessageType': 'Attached',
+                     'Properties': {'ConnectionType': 'USB', 'DeviceID': i, 'SerialNumber': u}}
+                    for i, u in enumerate(self.udids)]}
+            else:
+                rs = {'MessageType': 'Result', 'Number': 1}
+            data = plistlib.dumps(rs)
+            c.sendall(struct.pack('<IIII', 16 + len(data), 1, 8, tag) + data)
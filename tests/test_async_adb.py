@@ -0,0 +1,100 @@
+# coding=utf8
+import asyncio
+import os
+import tempfile
+import unittest
+
+from ui_auto.async_adb import AdbServerError, AsyncAdb, AsyncAdbProxy
+
+from fake_adb_server import FakeAdbServer
+
+
+class AsyncAdbTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = FakeAdbServer(shell_outputs={
+            'echo hi': 'hi\r\n',
+            'wm size': 'Physical size: 1080x2340\n',
+            'ps -A -o PID,PPID,UID,NAME': 'PID PPID UID NAME\n'
+                                          '100 1 u0_a1 com.demo\n'
+                                          '101 1 u0_a1 com.demo:push\n'
+                                          '200 1 u0_a2 com.demo.other\n',
+            'logcat': '第一行\r\nsecond line\nno newline at end'.encode('utf-8'),
+        })
+        self.wait(self.server.start())
+        self.adb = AsyncAdb('dev1', port=self.server.port)
+        self.adb_proxy = AsyncAdbProxy(self.adb)
+
+    def tearDown(self):
+        self.wait(self.server.stop())
+        self.loop.close()
+
+    def wait(self, co):
+        return self.loop.run_until_complete(co)
+
+    def test_devices(self):
+        self.assertEqual(self.wait(AsyncAdb.devices(port=self.server.port)), [('dev1', 'device')])
+
+    def test_run_shell(self):
+        self.assertEqual(self.wait(self.adb.run_shell('echo hi')), 'hi\r\n')
+        self.assertEqual(self.wait(self.adb.run_shell('echo hi', True)), 'hi')
+
+    def test_run_shell_concurrently(self):
+        async def many():
+            return await asyncio.gather(*(self.adb.run_shell('echo hi', True) for _ in range(20)))
+
+        self.assertEqual(self.wait(many()), ['hi'] * 20)
+        self.assertEqual(len(self.server.commands), 20)
+
+    def test_unknown_device(self):
+        adb = AsyncAdb('missing', port=self.server.port)
+        with self.assertRaises(AdbServerError):
+            self.wait(adb.run_shell('echo hi'))
+
+    def test_stream_shell(self):
+        async def collect(binary):
+            return [x async for x in self.adb.stream_shell('logcat', binary=binary, read_size=5)]
+
+        # 输出按7字节分块发送，中文字符会被拆分到两个数据块中
+        self.assertEqual(self.wait(collect(False)), ['第一行', 'second line', 'no newline at end'])
+        self.assertEqual(self.wait(collect(True))[0], '第一行'.encode('utf-8'))
+
+    def test_push_and_pull(self):
+        data = os.urandom(AsyncAdb.SYNC_DATA_MAX * 2 + 123)
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, 'src.bin')
+            dst = os.path.join(d, 'dst.bin')
+            with open(src, 'wb') as f:
+                f.write(data)
+            self.wait(self.adb.push_file(src, '/sdcard/a.bin'))
+            self.assertEqual(self.server.files['/sdcard/a.bin'], data)
+            self.wait(self.adb.pull_file('/sdcard/a.bin', dst))
+            with open(dst, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_pull_missing_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            with self.assertRaises(AdbServerError):
+                self.wait(self.adb.pull_file('/sdcard/missing', os.path.join(d, 'x')))
+
+    def test_pull_failure_keeps_no_partial_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            dst = os.path.join(d, 'x')
+            with self.assertRaises(AdbServerError):
+                self.wait(self.adb.pull_file('/sdcard/missing', dst))
+            self.assertEqual(os.listdir(d), [])
+
+    def test_find_processes(self):
+        self.assertEqual(self.wait(self.adb_proxy.find_process_ids('com.demo:push')), ['101'])
+        self.assertEqual(self.wait(self.adb_proxy.find_main_process_id('com.demo')), '100')
+        # 快照有效期内不再执行 ps
+        self.assertEqual(self.server.commands.count('ps -A -o PID,PPID,UID,NAME'), 1)
+
+    def test_proxy(self):
+        proxy = AsyncAdbProxy.create('dev1', port=self.server.port)
+        self.assertEqual(self.wait(proxy.get_device_resolution()), (1080, 2340))
+
+
+if __name__ == '__main__':
+    unittest.main()
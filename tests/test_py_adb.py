@@ -0,0 +1,134 @@
+# coding=utf8
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from ui_auto import py_adb
+    from fake_adbd import FakeAdbCommands, FakeAdbdHandle
+except ImportError as e:
+    py_adb = None
+    IMPORT_ERROR = e
+
+
+@unittest.skipIf(py_adb is None, 'python-adb is not installed')
+class PyAdbMultiplexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handle = FakeAdbdHandle(shell_outputs={
+            'echo hi': 'hi\n',
+            'sleep': lambda stream: stream.read_until_closed(),
+        })
+        self.connects = 0
+        py_adb.backoff_delay = lambda retry: 0
+        test = self
+
+        class FakePyAdb(py_adb.PyAdb):
+            def open_connect(self):
+                test.connects += 1
+                if test.handle.broken:
+                    test.handle = test.handle.restart()
+                return FakeAdbCommands(test.handle)
+
+        self.adb = FakePyAdb('usb-serial', kill_server=False)
+
+    def tearDown(self):
+        self.handle.break_connection()
+        self.adb.close()
+
+    def _logcat(self, lines: list, count: int):
+        for x in self.adb.stream_shell('logcat'):
+            lines.append(x)
+            if len(lines) >= count:
+                break
+
+    def test_stream_and_run_shell_concurrently(self):
+        lines = []
+        t = threading.Thread(target=self._logcat, args=(lines, 200))
+        t.start()
+        results = []
+
+        def run(k):
+            for i in range(5):
+                results.append((f'cat {k}-{i}', self.adb.run_shell(f'cat {k}-{i}', True)))
+
+        ts = [threading.Thread(target=run, args=(k,)) for k in range(4)]
+        for x in ts:
+            x.start()
+        for x in ts:
+            x.join(10)
+        t.join(10)
+        self.assertEqual(len(results), 20)
+        for cmd, rs in results:
+            self.assertEqual(rs, f'out:{cmd}')
+        self.assertEqual(lines, [f'log line {i}' for i in range(200)])
+        self.assertEqual(self.connects, 1)
+
+    def test_push_and_pull_while_streaming(self):
+        stop = threading.Event()
+        lines = []
+
+        def logcat():
+            for x in self.adb.stream_shell('logcat'):
+                lines.append(x)
+                if stop.is_set():
+                    break
+
+        t = threading.Thread(target=logcat)
+        t.start()
+        data = os.urandom(10000)
+        try:
+            with tempfile.TemporaryDirectory() as d:
+                src = os.path.join(d, 'a.bin')
+                with open(src, 'wb') as f:
+                    f.write(data)
+                start = time.time()
+                self.adb.push_file(src, '/sdcard/a.bin')
+                self.assertEqual(self.handle.files['/sdcard/a.bin'], data)
+                dst = os.path.join(d, 'b.bin')
+                self.assertTrue(self.adb.pull_file('/sdcard/a.bin', dst))
+                with open(dst, 'rb') as f:
+                    self.assertEqual(f.read(), data)
+                # 不需要等待 logcat 结束
+                self.assertLess(time.time() - start, 5)
+        finally:
+            stop.set()
+            t.join(10)
+        self.assertTrue(lines)
+
+    def test_read_timeout(self):
+        self.adb.read_timeout = 0.3
+        with self.assertRaises(py_adb.ReadTimeoutError):
+            self.adb.run_shell('sleep')
+        # 命令可能仍在执行，不会重试
+        self.assertEqual(self.handle.commands.count('sleep'), 1)
+        self.assertEqual(self.adb.run_shell('echo hi', True), 'hi')
+
+    def test_retry_only_without_output(self):
+        state = {'n': 0}
+
+        def partial(stream):
+            stream.write(b'partial\n')
+            self.handle.break_connection()
+
+        def fail_first(stream):
+            state['n'] += 1
+            if state['n'] == 1:
+                self.handle.break_connection()
+                return None
+            return 'ok\n'
+
+        self.handle.shell_outputs['partial'] = partial
+        self.handle.shell_outputs['fail_first'] = fail_first
+        with self.assertRaises(py_adb.ReadConnectError):
+            self.adb.run_shell('partial')
+        self.assertEqual(self.handle.commands.count('partial'), 1)
+
+        self.assertEqual(self.adb.run_shell('fail_first', True), 'ok')
+        self.assertEqual(state['n'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
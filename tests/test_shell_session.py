@@ -0,0 +1,68 @@
+# coding=utf8
+import os
+import select
+import shutil
+import subprocess
+import unittest
+
+from ui_auto.my_adb import ShellChannel, ShellSession
+
+
+class LocalShellChannel(ShellChannel):
+    # 以本机 sh 代替设备端的常驻shell
+    def __init__(self, read_timeout: float = 5):
+        self.read_timeout = read_timeout
+        self._p = subprocess.Popen(['sh'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def write(self, data: bytes):
+        self._p.stdin.write(data)
+        self._p.stdin.flush()
+
+    def read(self) -> bytes:
+        if not select.select([self._p.stdout], [], [], self.read_timeout)[0]:
+            raise TimeoutError(f'No output in {self.read_timeout}s')
+        return os.read(self._p.stdout.fileno(), 4096)
+
+    def close(self):
+        self._p.kill()
+        self._p.wait()
+
+
+@unittest.skipIf(shutil.which('sh') is None, 'sh is not available')
+class ShellSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.opened = 0
+
+        def opener():
+            self.opened += 1
+            return LocalShellChannel()
+
+        self.session = ShellSession(opener)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_run_many(self):
+        rs = self.session.run_many(['echo a', 'echo b >&2; false', 'printf "no newline"'])
+        self.assertEqual(rs, [('a\n', 0), ('b\n', 1), ('no newline', 0)])
+        self.assertEqual(self.opened, 1)
+
+    def test_commands_do_not_share_state(self):
+        self.session.run_many(['cd /', 'export UI_AUTO_X=1', 'set -e'])
+        self.assertEqual(self.session.run('echo "$UI_AUTO_X"'), ('\n', 0))
+        self.assertEqual(self.session.run('false; echo next')[0], 'next\n')
+        self.assertEqual(self.session.run('exit 3'), ('', 3))
+        # exit 只结束子shell，会话仍然可用
+        self.assertEqual(self.session.run('echo ok'), ('ok\n', 0))
+        self.assertEqual(self.opened, 1)
+
+    def test_read_timeout(self):
+        self.session.opener = lambda: LocalShellChannel(read_timeout=0.2)
+        with self.assertRaises(TimeoutError):
+            self.session.run('sleep 2')
+        self.assertEqual(self.session.run('echo ok'), ('ok\n', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# coding=utf8
+import unittest
+
+try:
+    from ui_auto.my_ti_device import TiDevice, TiDevicePool
+except ImportError as e:
+    TiDevicePool = None
+    IMPORT_ERROR = e
+
+from fake_usbmuxd import FakeUsbmuxd
+
+
+@unittest.skipIf(TiDevicePool is None, 'tidevice is not installed')
+class TiDevicePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.usbmuxd = FakeUsbmuxd(['AAA', 'BBB']).start()
+
+    def tearDown(self):
+        self.usbmuxd.stop()
+
+    def test_discover_and_run(self):
+        with TiDevicePool(usbmux=self.usbmuxd.address) as pool:
+            self.assertEqual(sorted(pool.udids), ['AAA', 'BBB'])
+            rs = pool.run_all(lambda d: d, timeout=10)
+            # 任务直接使用 TiDevice，不经过代理
+            for u, d in rs.items():
+                self.assertIsInstance(d, TiDevice)
+                self.assertEqual(d.udid, u)
+
+    def test_missing_device(self):
+        with TiDevicePool(['AAA', 'ZZZ'], usbmux=self.usbmuxd.address) as pool:
+            rs = pool.run_all(lambda d: d.udid, timeout=10)
+        self.assertEqual(rs['AAA'], 'AAA')
+        self.assertIsInstance(rs['ZZZ'], ConnectionError)
+
+    def test_refresh(self):
+        with TiDevicePool(usbmux=self.usbmuxd.address) as pool:
+            self.usbmuxd.udids = ['BBB', 'CCC']
+            self.assertEqual(sorted(pool.refresh()), ['BBB', 'CCC'])
+            self.assertEqual(pool.run_all(lambda d: d.udid, timeout=10), {'BBB': 'BBB', 'CCC': 'CCC'})
+
+
+if __name__ == '__main__':
+    unittest.main()
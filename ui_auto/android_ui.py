@@ -1,17 +1,22 @@
+import copy
 import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from os import environ
-
-from airtest.core.settings import Settings
-from airtest.core.api import *
+from typing import TYPE_CHECKING
 
 from .my_adb import AdbProxy
 
+if TYPE_CHECKING:
+    from airtest.core.cv import Template
+
 LOG_DEBUG = environ.get('LOG_DEBUG', False)
 
-if LOG_DEBUG:
-    Settings.LOG_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'logs')
-else:
+if not LOG_DEBUG:
     logging.getLogger('airtest.core.android.py_adb').setLevel(logging.WARNING)
     logging.getLogger('airtest.aircv.utils').setLevel(logging.WARNING)
     logging.getLogger('airtest.core.api').setLevel(logging.INFO)
@@ -25,21 +30,199 @@ else:
 log = logging.getLogger(__name__)
 
 
+_airtest_api_lock = threading.Lock()
+
+
+def airtest_api():
+    """
+    延迟导入 airtest.core.api，导入时会同时加载 OpenCV 等，只使用ADB功能时不会加载
+    :return: airtest.core.api 模块
+    """
+    g = globals()
+    if '_airtest_api' not in g:
+        with _airtest_api_lock:
+            if '_airtest_api' not in g:
+                from airtest.core import api
+                if LOG_DEBUG:
+                    api.ST.LOG_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'logs')
+                g['_airtest_api'] = api
+    return g['_airtest_api']
+
+
+_pending_ui = None  # 最近创建、尚未连接 airtest 设备的 AndroidBaseUI (weakref)
+
+
+def device_api():
+    """
+    需要操作设备时使用，先连接最近创建的 AndroidBaseUI 的 airtest 设备(与创建时立即连接 G.DEVICE 的指向一致)
+    :return: airtest.core.api 模块
+    """
+    ui = _pending_ui and _pending_ui()
+    if ui is not None:
+        _ = ui.device
+    return airtest_api()
+
+
+MATCH_WORKERS = os.cpu_count() or 4  # 多模板并行识别的线程数
+
+
+_match_executor_lock = threading.Lock()
+
+
+def get_match_executor() -> ThreadPoolExecutor:
+    # OpenCV 识别过程会释放GIL，多个模板可在线程池中并行识别
+    g = globals()
+    if '_match_executor' not in g:
+        with _match_executor_lock:
+            if '_match_executor' not in g:
+                g['_match_executor'] = ThreadPoolExecutor(MATCH_WORKERS, thread_name_prefix='TemplateMatch')
+    return g['_match_executor']
+
+
+def get_thumbnail(screen, size: int = 64):
+    """
+    :return: 截图缩小后的灰度图，用于快速判断画面是否变化
+    """
+    import cv2
+    gray = cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY) if screen.ndim == 3 else screen
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def frame_changed(last_thumbnail, thumbnail, threshold: float = 8, min_pixels: int = 1) -> bool:
+    """
+    按发生变化的像素数判断，而不是平均灰度差，图标、Toast 等小面积的变化也能被发现
+    :param threshold: 单个像素的灰度差(0~255)超过该值即认为该像素发生了变化
+    :param min_pixels: 发生变化的像素数不少于该值即认为画面发生了变化
+    """
+    import cv2
+    if last_thumbnail is None:
+        return True
+    return int((cv2.absdiff(last_thumbnail, thumbnail) > threshold).sum()) >= min_pixels
+
+
+def device_snapshot():
+    api = device_api()
+    return api.G.DEVICE.snapshot(filename=None, quality=api.ST.SNAPSHOT_QUALITY)
+
+
+class ScreenCache:
+    """
+    短时间内的截图缓存，同一画面上的多次识别共用一次截图
+    超过 ttl 秒或执行了点击、输入、返回等操作后失效
+    """
+    _instances = weakref.WeakSet()
+
+    def __init__(self, ttl: float = 1.0, snapshot=device_snapshot):
+        """
+        :param ttl: 截图的有效秒数
+        :param snapshot: 截图方法
+        """
+        self.ttl = ttl
+        self._snapshot = snapshot
+        self._screen = None
+        self._thumbnail = None
+        self._time = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._instances.add(self)
+
+    def get(self, refresh=False):
+        """
+        :param refresh: 是否强制重新截图
+        :return: 截图(cv2格式)
+        """
+        with self._lock:
+            if not refresh and self._screen is not None and time.time() - self._time < self.ttl:
+                self.hits += 1
+                return self._screen
+            self.misses += 1
+            self._screen = self._snapshot()
+            self._time = time.time()
+            self._thumbnail = None if self._screen is None else get_thumbnail(self._screen)
+            return self._screen
+
+    def invalidate(self):
+        with self._lock:
+            self._screen = None
+
+    @classmethod
+    def invalidate_all(cls):
+        """
+        使全部截图缓存失效，用于通过 airtest 全局接口操作当前设备之后
+        """
+        for x in list(cls._instances):
+            x.invalidate()
+
+    def has_changed(self, threshold: float = 8) -> bool:
+        """
+        重新截图，并与上一次的截图比较画面是否发生了变化
+        :param threshold: 参考 frame_changed
+        """
+        last = self._thumbnail
+        if self.get(refresh=True) is None:
+            return True
+        return frame_changed(last, self._thumbnail, threshold)
+
+
+def adaptive_wait(tmpl: 'Template', timeout=120, min_interval=0.2, max_interval=5.0, factor=1.5,
+                  diff_threshold=8, snapshot=device_snapshot) -> (float, float):
+    """
+    等待模板出现，轮询间隔从 min_interval 开始按 factor 倍增长，不超过 max_interval
+    画面与上次识别时相比没有变化时跳过识别，只截屏；但距离上次识别超过 max_interval 时仍会识别一次
+    :param tmpl: 图片模板
+    :param timeout: 超时秒数
+    :param diff_threshold: 参考 frame_changed
+    :param snapshot: 截图方法，例如 ScreenCache.get
+    :return: 识别到的位置，超时则抛出 TargetNotFoundError
+    """
+    api = airtest_api()
+    api.G.LOGGING.info("Try finding: %s", tmpl)
+    deadline = time.time() + timeout
+    interval = min_interval
+    last = None
+    last_match = 0
+    while True:
+        screen = snapshot()
+        if screen is None:
+            log.warning('Screen is None, may be locked')
+        else:
+            thumbnail = get_thumbnail(screen)
+            if frame_changed(last, thumbnail, diff_threshold) or time.time() - last_match >= max_interval:
+                last = thumbnail
+                last_match = time.time()
+                match_pos = tmpl.match_in(screen)
+                if match_pos:
+                    api.try_log_screen(screen)
+                    return match_pos
+        remain = deadline - time.time()
+        if remain <= 0:
+            api.try_log_screen(screen)
+            raise api.TargetNotFoundError(f'Picture {tmpl} not found in screen')
+        time.sleep(min(interval, remain))
+        interval = min(interval * factor, max_interval)
+
+
 def init_wrapper_for_resource(*paths: str):
     def wrap_func(dir_name: str = None, ext: str = 'png', clear_resources=True):
         def tracer(func):
+            if dir_name:
+                tmp = [x for x in paths]
+                tmp.append(dir_name)
+            else:
+                tmp = paths
+            # 每个被装饰的方法只创建一个 Resource，重复调用时复用；绑定截图缓存时按对象复制一份
+            res = Resource(*tmp, file_ext=ext)
+
             @wraps(func)
             def wrapper(*args, **kv):
                 obj = args[0]
+                r = obj.bind_resource(res) if hasattr(obj, 'bind_resource') else res
                 if hasattr(obj, 'curr_resources'):
                     if clear_resources:
                         obj.curr_resources.clear()
-                    if dir_name:
-                        tmp = [x for x in paths]
-                        tmp.append(dir_name)
-                    else:
-                        tmp = paths
-                    obj.curr_resources.append(Resource(*tmp, file_ext=ext))
+                    if r not in obj.curr_resources:
+                        obj.curr_resources.append(r)
                 return func(*args, **kv)
 
             return wrapper
@@ -50,9 +233,13 @@ def init_wrapper_for_resource(*paths: str):
 
 
 class Resource:
-    def __init__(self, *paths: str, file_ext: str = 'png'):
+    def __init__(self, *paths: str, file_ext: str = 'png', screen_cache: ScreenCache = None):
+        """
+        :param screen_cache: 绑定的截图缓存，通常为 AndroidBaseUI.screen_cache，为空时每次识别都重新截图
+        """
         self.ext = file_ext
         self.paths = paths
+        self.screen_cache = screen_cache
 
     @property
     def dir_path(self):
@@ -61,45 +248,163 @@ class Resource:
             setattr(self, k, os.path.join(*self.paths))
         return getattr(self, k)
 
+    def bind(self, screen_cache: ScreenCache) -> 'Resource':
+        """
+        :return: 绑定了截图缓存的副本，不影响当前对象
+        """
+        r = copy.copy(self)
+        r.screen_cache = screen_cache
+        return r
+
     def get_img(self, file_name: str, custom_ext=False):
         return os.path.join(self.dir_path, file_name if custom_ext else f'{file_name}.{self.ext}')
 
+    def preload(self) -> int:
+        """
+        预先加载该目录下的全部模板图片到缓存
+        :return: 加载的图片数量
+        """
+        from .template_cache import TEMPLATE_CACHE
+        return TEMPLATE_CACHE.preload(self.dir_path, self.ext)
+
     def get_template(self, img_file_name: str, pos: tuple[float, float] = None, threshold=None,
-                     custom_ext=False) -> Template:
+                     custom_ext=False, region: tuple = None, margin: float = None,
+                     pyramid_scale: float = None) -> 'Template':
         """
         获取图片模板
         :param custom_ext: 是否使用文件名中的扩展名
         :param img_file_name: 图片文件名
         :param pos: AirTest 录屏时的位置
         :param threshold: 识别正确的阈值
+        :param region: 只在该区域内识别，参考 RegionTemplate，可通过 AndroidBaseUI.get_region 由像素坐标换算
+        :param margin: 只在 pos 周围该距离内识别，参考 RegionTemplate
+        :param pyramid_scale: 先在按该比例缩小的截图上粗略定位，参考 RegionTemplate
         :return:
         """
-        return Template(self.get_img(img_file_name, custom_ext), record_pos=pos or None, threshold=threshold)
+        from .template_cache import CachedTemplate, RegionTemplate
+        file_path = self.get_img(img_file_name, custom_ext)
+        if region or margin is not None or pyramid_scale:
+            return RegionTemplate(file_path, region=region, margin=margin, pyramid_scale=pyramid_scale,
+                                  record_pos=pos or None, threshold=threshold)
+        return CachedTemplate(file_path, record_pos=pos or None, threshold=threshold)
+
+    def _find(self, tmpl: 'Template', timeout: float) -> (float, float):
+        # 绑定了截图缓存时，在缓存的截图上识别，否则与 airtest 的识别方式一致
+        if self.screen_cache:
+            return adaptive_wait(tmpl, timeout, snapshot=self.screen_cache.get)
+        return device_api().loop_find(tmpl, timeout=timeout)
+
+    def _touch(self, v):
+        rs = device_api().touch(v)
+        if self.screen_cache:
+            self.screen_cache.invalidate()
+        return rs
 
     def touch(self, img_file_name: str, pos: tuple[float, float] = None, threshold=None,
-              custom_ext=False) -> (float, float):
-        return touch(self.get_template(img_file_name, pos, threshold, custom_ext=custom_ext))
-
-    def exists(self, img_file_name: str, pos: tuple[float, float] = None, threshold=None, custom_ext=False) -> bool:
-        return exists(self.get_template(img_file_name, pos, threshold, custom_ext=custom_ext))
+              custom_ext=False, **kv) -> (float, float):
+        """
+        :param kv: 识别区域等参数，参考 get_template
+        """
+        tmpl = self.get_template(img_file_name, pos, threshold, custom_ext=custom_ext, **kv)
+        if self.screen_cache:
+            return self._touch(self._find(tmpl, airtest_api().ST.FIND_TIMEOUT))
+        return device_api().touch(tmpl)
+
+    def exists(self, img_file_name: str, pos: tuple[float, float] = None, threshold=None, custom_ext=False,
+               **kv) -> bool:
+        tmpl = self.get_template(img_file_name, pos, threshold, custom_ext=custom_ext, **kv)
+        api = device_api()
+        if not self.screen_cache:
+            return api.exists(tmpl)
+        try:
+            return self._find(tmpl, api.ST.FIND_TIMEOUT_TMP)
+        except api.TargetNotFoundError:
+            return False
 
     def text(self, img_file_name: str, content: str, pos: tuple[float, float] = None, threshold=None, custom_ext=False):
         if img_file_name:
             self.touch(img_file_name, pos, threshold, custom_ext=custom_ext)
-        text(content)
+        device_api().text(content)
+        if self.screen_cache:
+            self.screen_cache.invalidate()
 
     def touch_on_exists(self, img_file_name: str, pos: tuple[float, float] = None, threshold=None,
-                        custom_ext=False) -> bool:
-        p = self.exists(img_file_name, pos, threshold, custom_ext=custom_ext)
+                        custom_ext=False, **kv) -> bool:
+        p = self.exists(img_file_name, pos, threshold, custom_ext=custom_ext, **kv)
         if p:
-            touch(p)
+            self._touch(p)
             return True
         return False
 
     def wait(self, img_file_name: str, pos: tuple[float, float] = None, threshold=None, custom_ext=False,
-             timeout_seconds=120, interval=10) -> (float, float):
-        return wait(self.get_template(img_file_name, pos, threshold, custom_ext=custom_ext), timeout=timeout_seconds,
-                    interval=interval)
+             timeout_seconds=120, interval=None, min_interval=0.2, max_interval=5.0, **kv) -> (float, float):
+        """
+        :param interval: 固定的轮询间隔秒数，为空时使用 adaptive_wait 自适应轮询
+        :param min_interval: 自适应轮询的最小间隔
+        :param max_interval: 自适应轮询的最大间隔
+        """
+        tmpl = self.get_template(img_file_name, pos, threshold, custom_ext=custom_ext, **kv)
+        if interval is not None:
+            return device_api().wait(tmpl, timeout=timeout_seconds, interval=interval)
+        return adaptive_wait(tmpl, timeout_seconds, min_interval, max_interval, snapshot=self.snapshot)
+
+    def snapshot(self):
+        if self.screen_cache:
+            return self.screen_cache.get()
+        return device_snapshot()
+
+    @staticmethod
+    def match_template(tmpl: 'Template', screen) -> tuple:
+        """
+        在指定截图中识别模板
+        :return: ((x, y), 可信度)，未识别到则返回None
+        """
+        from airtest.utils.transform import TargetPos
+        rs = tmpl._cv_match(screen)
+        if not rs:
+            return None
+        return TargetPos().getXY(rs, tmpl.target_pos), rs['confidence']
+
+    def find_all(self, img_file_names: list, threshold=None, custom_ext=False, screen=None) -> dict:
+        """
+        只截屏一次，并行识别多个模板
+        :param img_file_names: 图片文件名列表，也可以是 (图片文件名, AirTest 录屏时的位置) 的列表
+        :param threshold: 识别正确的阈值
+        :param custom_ext: 是否使用文件名中的扩展名
+        :param screen: 可选，使用指定的截图
+        :return: {图片文件名: ((x, y), 可信度) 或 None}
+        """
+        items = [x if isinstance(x, (tuple, list)) else (x, None) for x in img_file_names]
+        if screen is None:
+            screen = self.snapshot()
+        if screen is None:
+            log.warning('Screen is None, may be locked')
+            return {x[0]: None for x in items}
+        ex = get_match_executor()
+        fs = [(x[0], ex.submit(self.match_template, self.get_template(x[0], x[1], threshold, custom_ext), screen))
+              for x in items]
+        return {k: f.result() for k, f in fs}
+
+    def find_any(self, img_file_names: list, threshold=None, custom_ext=False, screen=None) -> tuple:
+        """
+        只截屏一次，识别多个模板中可信度最高的一个
+        :return: (图片文件名, (x, y), 可信度)，都未识别到则返回None
+        """
+        best = None
+        for k, v in self.find_all(img_file_names, threshold, custom_ext, screen).items():
+            if v and (best is None or v[1] > best[2]):
+                best = (k, v[0], v[1])
+        return best
+
+    def touch_on_any_exists(self, img_file_names: list, threshold=None, custom_ext=False) -> str:
+        """
+        :return: 被点击的图片文件名，都未识别到则返回None
+        """
+        rs = self.find_any(img_file_names, threshold, custom_ext)
+        if rs:
+            self._touch(rs[1])
+            return rs[0]
+        return None
 
 
 class OsPermission:
@@ -126,18 +431,125 @@ class OsPermission:
 class AndroidBaseUI(OsPermission):
 
     def __init__(self, adb: AdbProxy):
+        # airtest 设备、设备信息及分辨率在首次使用时才获取；静态方法及 Resource 通过 device_api 连接最近创建的对象的设备
+        global _pending_ui
         self.adb = adb
-        self.device_info = self.adb.get_device_info()
-        self.device = init_device('Android', self.adb.get_device_serial())
-        res = self.device.get_current_resolution()
-        self.screen_width = res[0]
-        self.screen_height = res[1]
+        _pending_ui = weakref.ref(self)
 
     def close(self):
         self.adb.close()
 
+    @property
+    def device_info(self):
+        k = '_device_info'
+        if not hasattr(self, k):
+            setattr(self, k, self.adb.get_device_info())
+        return getattr(self, k)
+
+    @device_info.setter
+    def device_info(self, v):
+        self._device_info = v
+
+    @property
+    def device(self):
+        global _pending_ui
+        k = '_device'
+        if not hasattr(self, k):
+            setattr(self, k, airtest_api().init_device('Android', self.adb.get_device_serial()))
+            if _pending_ui is not None and _pending_ui() is self:
+                _pending_ui = None
+        return getattr(self, k)
+
+    @property
+    def api(self):
+        """
+        :return: airtest.core.api，确保 airtest 设备已连接
+        """
+        _ = self.device
+        return airtest_api()
+
+    @property
+    def resolution(self) -> (int, int):
+        k = '_resolution'
+        if not hasattr(self, k):
+            setattr(self, k, tuple(self.device.get_current_resolution()))
+        return getattr(self, k)
+
+    @property
+    def screen_width(self) -> int:
+        k = '_screen_width'
+        if not hasattr(self, k):
+            setattr(self, k, self.resolution[0])
+        return getattr(self, k)
+
+    @screen_width.setter
+    def screen_width(self, v: int):
+        self._screen_width = v
+
+    @property
+    def screen_height(self) -> int:
+        k = '_screen_height'
+        if not hasattr(self, k):
+            setattr(self, k, self.resolution[1])
+        return getattr(self, k)
+
+    @screen_height.setter
+    def screen_height(self, v: int):
+        self._screen_height = v
+
+    def _snapshot(self):
+        _ = self.device
+        return device_snapshot()
+
+    @property
+    def screen_cache(self) -> ScreenCache:
+        # 被 init_wrapper_for_resource 装饰的方法所使用的 Resource 共用该缓存
+        k = '_screen_cache'
+        if not hasattr(self, k):
+            setattr(self, k, ScreenCache(snapshot=self._snapshot))
+        return getattr(self, k)
+
+    def bind_resource(self, res: Resource) -> Resource:
+        """
+        :return: 绑定了当前对象截图缓存的 Resource 副本，每个 Resource 只复制一次
+        """
+        # Resource 直接调用 airtest 的接口，需要先连接设备
+        _ = self.device
+        k = '_bound_resources'
+        if not hasattr(self, k):
+            setattr(self, k, {})
+        bound = getattr(self, k)
+        if res not in bound:
+            bound[res] = res.bind(self.screen_cache)
+        return bound[res]
+
+    def snapshot(self, refresh=False):
+        return self.screen_cache.get(refresh)
+
+    def screen_changed(self, threshold: float = 8) -> bool:
+        """
+        重新截图，判断画面与上一次截图相比是否发生了变化
+        """
+        return self.screen_cache.has_changed(threshold)
+
+    def touch(self, v):
+        rs = self.api.touch(v)
+        self.screen_cache.invalidate()
+        return rs
+
+    def text(self, content: str):
+        self.api.text(content)
+        self.screen_cache.invalidate()
+
     def go_back(self):
         self.adb.go_back()
+        self.screen_cache.invalidate()
+
+    def get_region(self, x: int, y: int, width: int, height: int) -> tuple:
+        """
+        将像素坐标的区域换算为相对屏幕宽高的比例，用于 Resource 的 region 参数
+        """
+        return x / self.screen_width, y / self.screen_height, width / self.screen_width, height / self.screen_height
 
     @property
     def device_brand(self):
@@ -147,40 +559,44 @@ class AndroidBaseUI(OsPermission):
         return getattr(self, k)
 
     @staticmethod
-    def get_location(tmpl: Template) -> (float, float):
-        return loop_find(tmpl)
+    def get_location(tmpl: 'Template') -> (float, float):
+        return device_api().loop_find(tmpl)
 
     @staticmethod
     def home():
-        home()
+        device_api().home()
+        ScreenCache.invalidate_all()
 
     @staticmethod
     def clear(pkg: str):
         """清理App所有数据，需要到开发者选项中开启’禁止权限监控‘"""
         try:
-            clear_app(pkg)
+            device_api().clear_app(pkg)
         except Exception as e:
             log.warning(f'Clear App Failed: {e}')
+        ScreenCache.invalidate_all()
 
     @staticmethod
     def launch_app(pkg: str, activity: str = None):
-        start_app(pkg, activity)
+        device_api().start_app(pkg, activity)
+        ScreenCache.invalidate_all()
 
     @staticmethod
     def kill_app(pkg: str):
-        stop_app(pkg)
+        device_api().stop_app(pkg)
+        ScreenCache.invalidate_all()
 
     @staticmethod
     def remove_app(pkg: str):
         try:
-            uninstall(pkg)
+            device_api().uninstall(pkg)
         except Exception as e:
             log.warning(f'Remove App Failed: {e}')
 
     @staticmethod
     def install_app(file_path: str):
         """直接执行安装过程，安装过程会卡住主进程，不同设备可能会有界面操作上的问题"""
-        return install(file_path)
+        return device_api().install(file_path)
 
     def exists_app(self, pkg: str) -> str:
         return self.adb.get_app_version(pkg)
@@ -0,0 +1,395 @@
+# coding=utf8
+import asyncio
+import os
+import struct
+from logging import getLogger
+
+from .my_adb import AdbBase, AppCPU, LineFramer, ProcessTable, SysCPU
+
+logging = getLogger(__name__)
+
+
+class AdbServerError(Exception):
+    pass
+
+
+class AsyncAdbInterface:
+    # 基于asyncio的基础ADB通讯接口
+    async def run_shell(self, cmd: str, clean_wrap=False) -> str:
+        """
+        执行命令
+        :param cmd: 命令内容
+        :param clean_wrap: 是否清理结果换行
+        :return:
+        """
+        raise NotImplementedError
+
+    def stream_shell(self, cmd: str, binary=False):
+        """
+        执行命令，返回输出流的异步迭代器，每次返回一行输出结果(不包含换行符)
+        :param cmd: 命令内容
+        :param binary: 是否返回 bytes，不解码
+        :return: 每行输出结果的异步迭代
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def add_app(self, apk_path):
+        raise NotImplementedError
+
+    async def remove_app(self, app_bundle: str):
+        raise NotImplementedError
+
+    async def push_file(self, local_path: str, device_path: str):
+        raise NotImplementedError
+
+    async def pull_file(self, device_path: str, local_path: str):
+        raise NotImplementedError
+
+    def get_device_serial(self) -> str:
+        raise NotImplementedError
+
+
+class AsyncAdb(AsyncAdbInterface):
+    """
+    直接通过 asyncio 与 adb server 通讯(smart socket 协议)，不占用线程，单个事件循环可驱动大量设备
+    协议参考: https://android.googlesource.com/platform/packages/modules/adb/+/refs/heads/main/SERVICES.TXT
+    """
+    SYNC_DATA_MAX = 64 * 1024
+
+    def __init__(self, serial: str, host='127.0.0.1', port=5037):
+        self.serial = serial
+        self.host = host
+        self.port = port
+
+    def get_device_serial(self) -> str:
+        return self.serial
+
+    @staticmethod
+    async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, msg: str):
+        data = msg.encode('utf-8')
+        writer.write(b'%04x' % len(data) + data)
+        await writer.drain()
+        status = await reader.readexactly(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            n = int(await reader.readexactly(4), 16)
+            raise AdbServerError((await reader.readexactly(n)).decode('utf-8', 'replace'))
+        raise AdbServerError(f'Unexpected status: {status}')
+
+    @classmethod
+    async def devices(cls, host='127.0.0.1', port=5037) -> list:
+        """
+        :return: [(设备号, 状态)]
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            await cls._request(reader, writer, 'host:devices')
+            n = int(await reader.readexactly(4), 16)
+            rs = (await reader.readexactly(n)).decode('utf-8')
+        finally:
+            writer.close()
+        return [tuple(x.split('\t')[:2]) for x in rs.split('\n') if x]
+
+    async def _open(self, service: str) -> (asyncio.StreamReader, asyncio.StreamWriter):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            await self._request(reader, writer, f'host:transport:{self.serial}')
+            await self._request(reader, writer, service)
+        except Exception:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def run_shell(self, cmd: str, clean_wrap=False) -> str:
+        logging.debug(f'adb shell(Async) {cmd}')
+        reader, writer = await self._open(f'shell:{cmd}')
+        try:
+            rs = (await reader.read()).decode('utf-8', 'replace')
+        finally:
+            writer.close()
+        if clean_wrap:
+            rs = rs.strip()
+        return rs
+
+    async def stream_shell(self, cmd: str, binary=False, read_size=4096):
+        """
+        :param read_size: 每次从连接读取的最大字节数
+        """
+        logging.debug(f'adb shell(Async Streaming) {cmd}')
+        reader, writer = await self._open(f'shell:{cmd}')
+        framer = LineFramer(binary)
+        try:
+            while True:
+                d = await reader.read(read_size)
+                if not d:
+                    break
+                for x in framer.feed(d):
+                    yield x
+            for x in framer.flush():
+                yield x
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _in_thread(func, *args):
+        # 文件读写在线程池中执行，避免阻塞事件循环
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    @staticmethod
+    async def _sync_read_fail(reader: asyncio.StreamReader, length: int):
+        msg = (await reader.readexactly(length)).decode('utf-8', 'replace')
+        raise AdbServerError(msg)
+
+    async def push_file(self, local_path: str, device_path: str, mode: int = 0o644):
+        reader, writer = await self._open('sync:')
+        try:
+            target = f'{device_path},{mode}'.encode('utf-8')
+            writer.write(b'SEND' + struct.pack('<I', len(target)) + target)
+            f = await self._in_thread(open, local_path, 'rb')
+            try:
+                while True:
+                    d = await self._in_thread(f.read, self.SYNC_DATA_MAX)
+                    if not d:
+                        break
+                    writer.write(b'DATA' + struct.pack('<I', len(d)) + d)
+                    await writer.drain()
+                mtime = await self._in_thread(os.path.getmtime, local_path)
+            finally:
+                f.close()
+            writer.write(b'DONE' + struct.pack('<I', int(mtime)))
+            await writer.drain()
+            rs, n = struct.unpack('<4sI', await reader.readexactly(8))
+            if rs == b'FAIL':
+                await self._sync_read_fail(reader, n)
+            if rs != b'OKAY':
+                raise AdbServerError(f'Unexpected sync response: {rs}')
+        finally:
+            writer.close()
+
+    async def pull_file(self, device_path: str, local_path: str):
+        reader, writer = await self._open('sync:')
+        try:
+            target = device_path.encode('utf-8')
+            writer.write(b'RECV' + struct.pack('<I', len(target)) + target)
+            await writer.drain()
+            # 先写入临时文件，成功后再替换目标文件，失败时不留下不完整的文件
+            tmp = f'{local_path}.part'
+            f = await self._in_thread(open, tmp, 'wb')
+            try:
+                try:
+                    while True:
+                        rs, n = struct.unpack('<4sI', await reader.readexactly(8))
+                        if rs == b'DATA':
+                            await self._in_thread(f.write, await reader.readexactly(n))
+                        elif rs == b'DONE':
+                            break
+                        elif rs == b'FAIL':
+                            await self._sync_read_fail(reader, n)
+                        else:
+                            raise AdbServerError(f'Unexpected sync response: {rs}')
+                finally:
+                    await self._in_thread(f.close)
+            except BaseException:
+                await self._in_thread(os.remove, tmp)
+                raise
+            await self._in_thread(os.replace, tmp, local_path)
+        finally:
+            writer.close()
+
+    async def add_app(self, apk_path):
+        tmp = f'/data/local/tmp/{os.path.basename(apk_path)}'
+        await self.push_file(apk_path, tmp)
+        try:
+            rs = await self.run_shell(f'pm install -r -g {tmp}', True)
+        finally:
+            await self.run_shell(f'rm {tmp}')
+        if rs.find('Success') == -1:
+            raise AdbServerError(f'Install failed: {rs}')
+        return rs
+
+    async def remove_app(self, app_bundle: str):
+        return await self.run_shell(f'pm uninstall {app_bundle}', True)
+
+    async def close(self):
+        # 每个命令独立连接，无需关闭
+        pass
+
+
+class AsyncAdbBase(AsyncAdbInterface):
+    # 基于ADB的常用功能扩展的异步实现，结果解析与 AdbBase 一致
+
+    async def get_device_resolution(self) -> (int, int):
+        k = '_resolution'
+        if not hasattr(self, k):
+            rs = (await self.run_shell('wm size', True)).split()[-1].split('x')
+            setattr(self, k, (int(rs[0]), int(rs[1])))
+        return getattr(self, k)
+
+    async def get_app_version(self, app_bundle: str) -> str:
+        rs = await self.run_shell(f'pm dump {app_bundle} | grep "version"', True)
+        v = AdbBase.exp_version.findall(rs)
+        return v and v[0] or None
+
+    async def get_app_user_id(self, app_bundle: str):
+        rs = await self.run_shell(f'dumpsys package {app_bundle} | grep userId=')
+        u = AdbBase.exp_user_id.findall(rs)
+        if u:
+            return u[0]
+        raise ValueError(f'Matching userId error: {rs}')
+
+    async def get_process_table(self) -> ProcessTable:
+        """
+        参考 AdbBase.process_table，快照过期时先异步刷新
+        """
+        k = '_process_table'
+        if not hasattr(self, k):
+            setattr(self, k, ProcessTable(None, AdbBase.process_table_ttl))
+        table = getattr(self, k)
+        if table.expired:
+            table.load(await self.run_shell(ProcessTable.ps_cmd))
+        return table
+
+    async def find_processes(self, app_bundle: str) -> list:
+        """
+        :return: list: [(进程ID，父进程ID，进程名)]
+        """
+        return [(p.pid, p.ppid, p.name) for p in (await self.get_process_table()).find(app_bundle)]
+
+    async def find_process_ids(self, app_bundle: str) -> list:
+        return [p[0] for p in await self.find_processes(app_bundle)]
+
+    async def find_main_process_id(self, app_bundle: str) -> str:
+        for p in await self.find_processes(app_bundle):
+            if p[-1].find(':') == -1:
+                return p[0]
+        raise ValueError('No Process Found!')
+
+    async def get_memory(self, app_bundle_or_pid: str) -> float:
+        """
+        :return: 当前内存占用 MB
+        """
+        retry_times = AdbBase.memory_retry_times
+        while True:
+            rs = await self.run_shell(f'dumpsys meminfo {app_bundle_or_pid}')
+            m = AdbBase._parse_memory(rs, app_bundle_or_pid)
+            if m is not None:
+                return m
+            if retry_times <= 0:
+                raise ValueError(f'Matching `TOTAL PSS` failed!\n{rs}')
+            retry_times -= 1
+            logging.warning('try to get MemoryInfo again!')
+            await asyncio.sleep(AdbBase.memory_retry_interval)
+
+    async def get_memory_by_pids(self, process_id_list: list, use_smaps=False) -> dict:
+        """
+        参考 AdbBase.get_memory_by_pids
+        :return: {进程ID: 内存占用 MB}，已经销毁的进程为0
+        """
+        pid_list = [str(x) for x in process_id_list]
+        if not pid_list:
+            return {}
+        cmd, parse = AdbBase._memory_by_pids_query(pid_list, use_smaps)
+        retry_times = AdbBase.memory_retry_times
+        while True:
+            try:
+                m = parse(await self.run_shell(cmd))
+                break
+            except ValueError:
+                if retry_times <= 0:
+                    raise
+                retry_times -= 1
+                logging.warning('try to get MemoryInfo again!')
+                await asyncio.sleep(AdbBase.memory_retry_interval)
+        return AdbBase._fill_missing_pids(m, pid_list)
+
+    async def get_memory_by_app_processes(self, process_id_list: list, use_smaps=False) -> float:
+        return sum((await self.get_memory_by_pids(process_id_list, use_smaps)).values())
+
+    async def get_cpu_count(self) -> int:
+        k = '_cpu_count'
+        if not hasattr(self, k):
+            setattr(self, k, int(await self.run_shell('cat /proc/cpuinfo | grep ^processor | wc -l')))
+        return getattr(self, k)
+
+    async def get_cpu_max_freq_list(self) -> list:
+        k = '_cpu_max_freq_list'
+        if not hasattr(self, k):
+            rs = await self.run_shell(AdbBase._cat_cpu_freq_cmd(await self.get_cpu_count(), 'scaling_max_freq'))
+            setattr(self, k, [AdbBase._parse_cpu_max_freq(x) for x in rs.split('\n') if x.strip()])
+        return getattr(self, k)
+
+    async def get_cpu_sample(self, pid_list: list = None) -> (SysCPU, dict):
+        """
+        参考 AdbBase.get_cpu_sample
+        :return: (SysCPU, {进程ID: AppCPU})
+        """
+        pid_list = pid_list or []
+        max_freq_list = await self.get_cpu_max_freq_list()
+        rs = await self.run_shell(AdbBase._build_cpu_sample_cmd(len(max_freq_list), pid_list))
+        return AdbBase._parse_cpu_sample(rs, pid_list, max_freq_list)
+
+    async def get_cpu_global(self) -> SysCPU:
+        return (await self.get_cpu_sample())[0]
+
+    async def _get_app_cpu(self, pid_list: list) -> dict:
+        # 只读取进程的stat，不依赖CPU频率
+        rs = await self.run_shell('; '.join(AdbBase._app_cpu_cmd_list(pid_list)))
+        return AdbBase._parse_app_cpu_sections(AdbBase._split_sections(rs), pid_list)
+
+    async def get_cpu_usage(self, pid) -> AppCPU:
+        app_cpu = await self._get_app_cpu([pid])
+        if pid not in app_cpu:
+            raise KeyError(f'No such process: {pid}')
+        return app_cpu[pid]
+
+    async def get_cpu_usage_by_app_processes(self, process_id_list: list, auto_remove_miss_process=True) -> AppCPU:
+        """
+        参考 AdbBase.get_cpu_usage_by_app_processes
+        """
+        if not process_id_list:
+            return AppCPU(0, 0)
+        app_cpu = await self._get_app_cpu(process_id_list)
+        if auto_remove_miss_process and len(app_cpu) != len(process_id_list):
+            process_id_list[:] = [x for x in process_id_list if x in app_cpu]
+        return AppCPU(sum(x.user for x in app_cpu.values()), sum(x.kernel for x in app_cpu.values()))
+
+    compute_cpu_rate = staticmethod(AdbBase.compute_cpu_rate)
+
+
+class AsyncAdbProxy(AsyncAdbBase):
+    # 异步ADB代理，用于衔接不同的异步底层实现
+
+    def __init__(self, adb_implement: AsyncAdbInterface):
+        self._impl = adb_implement
+
+    @classmethod
+    def create(cls, serial: str, host='127.0.0.1', port=5037):
+        return cls(AsyncAdb(serial, host, port))
+
+    def get_device_serial(self) -> str:
+        return self._impl.get_device_serial()
+
+    async def run_shell(self, cmd: str, clean_wrap=False) -> str:
+        return await self._impl.run_shell(cmd, clean_wrap=clean_wrap)
+
+    def stream_shell(self, cmd: str, binary=False):
+        return self._impl.stream_shell(cmd, binary=binary)
+
+    async def close(self):
+        return await self._impl.close()
+
+    async def add_app(self, apk_path):
+        return await self._impl.add_app(apk_path)
+
+    async def remove_app(self, app_bundle: str):
+        return await self._impl.remove_app(app_bundle)
+
+    async def push_file(self, local_path: str, device_path: str):
+        return await self._impl.push_file(local_path, device_path)
+
+    async def pull_file(self, device_path: str, local_path: str):
+        return await self._impl.pull_file(device_path, local_path)
@@ -0,0 +1,200 @@
+# coding=utf8
+import heapq
+import threading
+import time
+import types
+
+from .my_adb import AdbBase, AppCPU, SysCPU
+
+
+class ThreadCPU(AppCPU):
+    def __init__(self, pid: str, tid: str, name: str, user: int, kernel: int):
+        """
+        :param pid: 所属进程ID
+        :param tid: 线程ID
+        :param name: 线程名(内核中最多保留15个字符)
+        """
+        super().__init__(user, kernel)
+        self.pid = pid
+        self.tid = tid
+        self.name = name
+
+    def __str__(self):
+        return f'[Thread {self.pid}/{self.tid} {self.name}]CPU User: {self.user}, Kernel: {self.kernel}'
+
+
+class ThreadRate:
+    def __init__(self, thread: ThreadCPU, user: int, kernel: int, rate: float):
+        """
+        :param thread: 周期结束时的线程CPU时间
+        :param user: 周期内用户态时间增量
+        :param kernel: 周期内内核态时间增量
+        :param rate: 周期内(用户态+内核态)占系统总CPU时间的比例
+        """
+        self.thread = thread
+        self.user = user
+        self.kernel = kernel
+        self.rate = rate
+
+    def __str__(self):
+        t = self.thread
+        return f'{t.pid}/{t.tid} {t.name}: {self.rate * 100:.2f}% (User: {self.user}, Kernel: {self.kernel})'
+
+
+class ProfileSample:
+    def __init__(self, host_time: float, sys_cpu: SysCPU, processes: dict, threads: dict):
+        """
+        :param host_time: 采样时间戳
+        :param sys_cpu: 系统CPU时间
+        :param processes: {进程ID: AppCPU}，只包含读取成功的进程
+        :param threads: {(进程ID, 线程ID): ThreadCPU}，未开启线程采集时为空
+        """
+        self.host_time = host_time
+        self.sys_cpu = sys_cpu
+        self.processes = processes
+        self.threads = threads
+        self.pids = frozenset(processes)
+
+
+class ProfileInterval:
+    def __init__(self, start: ProfileSample, end: ProfileSample, process_rates: dict, hot_threads: list):
+        """
+        相邻两次采样之间的CPU占用
+        :param process_rates: {进程ID: 占用率}，只包含两次采样都存在的进程
+        :param hot_threads: 占用率最高的N个线程 [ThreadRate]，按占用率降序
+        """
+        self.start = start
+        self.end = end
+        self.process_rates = process_rates
+        self.hot_threads = hot_threads
+        # 进程的出现与销毁
+        self.appeared = end.pids - start.pids
+        self.disappeared = start.pids - end.pids
+
+    @property
+    def app_rate(self) -> float:
+        return sum(self.process_rates.values())
+
+    def __str__(self):
+        out = [f'App CPU: {self.app_rate * 100:.2f}%']
+        if self.appeared:
+            out.append(f'Appeared: {",".join(sorted(self.appeared))}')
+        if self.disappeared:
+            out.append(f'Disappeared: {",".join(sorted(self.disappeared))}')
+        out.extend(f'  {x}' for x in self.hot_threads)
+        return '\n'.join(out)
+
+
+class CPUProfiler:
+    """
+    应用进程及线程级的CPU采样
+    每次采样只执行一条shell命令，读取系统CPU时间、各进程的 /proc/<pid>/stat 以及 /proc/<pid>/task/*/stat
+    用于定位应用中哪个线程占用了CPU
+    """
+
+    def __init__(self, adb: AdbBase, app_bundle: str = None, pid_list: list = None, threads=True,
+                 top_n: int = 10, interval: float = 1.0):
+        """
+        :param adb: 目标设备
+        :param app_bundle: 应用包名，每次采样前通过进程表(有缓存)获取该应用的全部进程，与 pid_list 二选一
+        :param pid_list: 固定的进程ID列表
+        :param threads: 是否采集线程
+        :param top_n: 每个周期返回的最热线程数
+        :param interval: 采样间隔，秒
+        """
+        if not app_bundle and not pid_list:
+            raise ValueError('app_bundle or pid_list is required')
+        self.adb = adb
+        self.app_bundle = app_bundle
+        self.pid_list = tuple(str(x) for x in pid_list or [])
+        self.threads = threads
+        self.top_n = top_n
+        self.interval = interval
+
+    def current_pids(self) -> tuple:
+        if self.app_bundle:
+            return tuple(p.pid for p in self.adb.process_table.by_package(self.app_bundle))
+        return self.pid_list
+
+    def _build_cmd(self, pid_list: tuple) -> str:
+        a = self.adb
+        cmd = [a._echo_section('stat'), 'head -n 1 /proc/stat']
+        for pi in pid_list:
+            cmd.append(a._echo_section(f'pid:{pi}'))
+            cmd.append(f'cat /proc/{pi}/stat')
+            if self.threads:
+                cmd.append(a._echo_section(f'task:{pi}'))
+                cmd.append(f'cat /proc/{pi}/task/*/stat')
+        return '; '.join(cmd)
+
+    @staticmethod
+    def _parse_thread(pid: str, stat: str) -> ThreadCPU:
+        # 线程名可能包含空格及括号，以第一个`(`和最后一个`)`为界
+        a = stat.find('(')
+        b = stat.rfind(')')
+        c = AdbBase._parse_app_cpu(stat)
+        return ThreadCPU(pid, stat[:a].strip(), stat[a + 1:b], c.user, c.kernel)
+
+    def sample(self) -> ProfileSample:
+        a = self.adb
+        pid_list = self.current_pids()
+        rs = a.run_shell(self._build_cmd(pid_list))
+        ss = a._split_sections(rs)
+        if 'stat' not in ss:
+            raise ValueError(f'Bad cpu sample output: {rs}')
+        # 与 AdbBase.get_cpu_sample 的进程解析一致，已经销毁的进程不会出现在结果中
+        processes = a._parse_app_cpu_sections(ss, pid_list)
+        threads = {}
+        for pi in processes:
+            for x in ss.get(f'task:{pi}', '').split('\n'):
+                x = x.strip()
+                # 读取过程中销毁的线程会输出错误信息
+                if not x or x.find('(') == -1:
+                    continue
+                t = self._parse_thread(pi, x)
+                threads[(pi, t.tid)] = t
+        return ProfileSample(time.time(), a._parse_sys_cpu(ss['stat'], 1.0), processes, threads)
+
+    def compare(self, start: ProfileSample, end: ProfileSample) -> ProfileInterval:
+        total = end.sys_cpu.total - start.sys_cpu.total
+        if total <= 0:
+            return ProfileInterval(start, end, {}, [])
+        process_rates = {}
+        for pi in end.pids & start.pids:
+            s, e = start.processes[pi], end.processes[pi]
+            process_rates[pi] = (e.user - s.user + e.kernel - s.kernel) / total
+        rates = []
+        for key, e in end.threads.items():
+            s = start.threads.get(key)
+            if s is None:
+                # 周期内新建的线程只作为下个周期的基准，其累计时间可能包含周期之前的部分
+                continue
+            u = e.user - s.user
+            k = e.kernel - s.kernel
+            if u + k > 0:
+                rates.append(ThreadRate(e, u, k, (u + k) / total))
+        return ProfileInterval(start, end, process_rates, heapq.nlargest(self.top_n, rates, key=lambda x: x.rate))
+
+    def __iter__(self) -> types.GeneratorType:
+        return self.iter_intervals()
+
+    def iter_intervals(self, stop_event: threading.Event = None) -> types.GeneratorType:
+        """
+        按采样间隔持续采样，每个周期返回一个 ProfileInterval
+        :param stop_event: 可选，设置后停止
+        """
+        last = None
+        next_time = time.time()
+        while not (stop_event and stop_event.is_set()):
+            cur = self.sample()
+            if last is not None:
+                yield self.compare(last, cur)
+            last = cur
+            next_time += self.interval
+            delay = next_time - time.time()
+            if delay <= 0:
+                next_time = time.time()
+            elif stop_event:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
@@ -0,0 +1,125 @@
+# coding=utf8
+# 批量计算CPU占用率
+# 与 AdbBase.compute_cpu_rate 的算法一致，但一次处理整个采样序列：相邻两次采样构成一个周期，N 个采样得到 N-1 个周期的占用率
+import warnings
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class CPUColumns:
+    def __init__(self, sys_user, sys_kernel, sys_total, app_user, app_kernel, freq=None):
+        """
+        采样序列的列式存储，每个参数为等长的一维序列(或 numpy 数组)
+        :param sys_user: 系统用户态时间
+        :param sys_kernel: 系统内核态时间
+        :param sys_total: 系统总CPU时间
+        :param app_user: 应用用户态时间
+        :param app_kernel: 应用内核态时间
+        :param freq: 可选，CPU当前频率占最大频率比例，计算规范化占用率时需要
+        """
+        self.sys_user = np.asarray(sys_user, dtype=np.float64)
+        self.sys_kernel = np.asarray(sys_kernel, dtype=np.float64)
+        self.sys_total = np.asarray(sys_total, dtype=np.float64)
+        self.app_user = np.asarray(app_user, dtype=np.float64)
+        self.app_kernel = np.asarray(app_kernel, dtype=np.float64)
+        self.freq = None if freq is None else np.asarray(freq, dtype=np.float64)
+        n = len(self.sys_total)
+        for x in (self.sys_user, self.sys_kernel, self.app_user, self.app_kernel, self.freq):
+            if x is not None and len(x) != n:
+                raise ValueError(f'Column length mismatch: {len(x)} != {n}')
+
+    def __len__(self):
+        return len(self.sys_total)
+
+    @classmethod
+    def from_samples(cls, sys_cpu_list: list, app_cpu_list: list):
+        """
+        :param sys_cpu_list: SysCPU 序列
+        :param app_cpu_list: 与 sys_cpu_list 一一对应的 AppCPU 序列
+        """
+        if len(sys_cpu_list) != len(app_cpu_list):
+            raise ValueError(f'Sample count mismatch: {len(sys_cpu_list)} != {len(app_cpu_list)}')
+        # 一次性取出所有字段，再整体转换为数组
+        sys_cols = np.array([(x.user, x.kernel, x.total, x.freq) for x in sys_cpu_list],
+                            dtype=np.float64).reshape(-1, 4)
+        app_cols = np.array([(x.user, x.kernel) for x in app_cpu_list], dtype=np.float64).reshape(-1, 2)
+        return cls(sys_cols[:, 0], sys_cols[:, 1], sys_cols[:, 2], app_cols[:, 0], app_cols[:, 1], sys_cols[:, 3])
+
+
+def compute_cpu_rates(columns: CPUColumns, is_normalized=True) -> (np.ndarray, np.ndarray):
+    """
+    计算每个周期内App及系统的CPU占用率
+    注意：区分规范化和非规范化  https://bbs.perfdog.qq.com/detail-146.html
+    :param columns: 采样序列
+    :param is_normalized: 是否规范化(乘以周期结束时的CPU频率比例)
+    :return: (App用户态+内核态占用率数组，系统总用户态+内核态占用率数组)，长度为采样数-1；
+        系统总CPU时间没有变化的周期结果为 nan
+    """
+    total = np.diff(columns.sys_total)
+    app = np.diff(columns.app_user) + np.diff(columns.app_kernel)
+    sys_delta = np.diff(columns.sys_user) + np.diff(columns.sys_kernel)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = np.where(total > 0, total, np.nan)
+        app_rate = app / total
+        sys_rate = sys_delta / total
+    if is_normalized:
+        if columns.freq is None:
+            raise ValueError('freq is required for normalized cpu rate')
+        app_rate *= columns.freq[1:]
+        sys_rate *= columns.freq[1:]
+    return app_rate, sys_rate
+
+
+def compute_cpu_rates_from_samples(sys_cpu_list: list, app_cpu_list: list,
+                                   is_normalized=True) -> (np.ndarray, np.ndarray):
+    """
+    参考 compute_cpu_rates
+    :param sys_cpu_list: SysCPU 序列
+    :param app_cpu_list: 与 sys_cpu_list 一一对应的 AppCPU 序列
+    """
+    return compute_cpu_rates(CPUColumns.from_samples(sys_cpu_list, app_cpu_list), is_normalized)
+
+
+def cpu_rate_stats(rates, percentiles: tuple = PERCENTILES) -> dict:
+    """
+    占用率统计，忽略 nan
+    :param rates: 一维占用率序列；也可以是二维数组(每行一台设备，等长)，此时每项统计结果为每台设备一个值的数组
+    :param percentiles: 需要计算的百分位
+    :return: {mean: x, p50: x, p95: x, p99: x, max: x, count: n}
+    """
+    a = np.asarray(rates, dtype=np.float64)
+    valid = ~np.isnan(a)
+    count = valid.sum(axis=-1)
+    if not valid.any():
+        nan = np.full(a.shape[:-1], np.nan) if a.ndim > 1 else np.nan
+        rs = dict(mean=nan, max=nan, count=count)
+        rs.update({f'p{p}': nan for p in percentiles})
+        return rs
+    if valid.all():
+        # 没有 nan 时使用普通版本，比 nan* 系列函数快很多
+        pp = np.percentile(a, percentiles, axis=-1)
+        rs = dict(mean=a.mean(axis=-1), max=a.max(axis=-1), count=count)
+    else:
+        rs, pp = _nan_stats(a, percentiles, count)
+    for i, p in enumerate(percentiles):
+        rs[f'p{p}'] = pp[i]
+    return rs
+
+
+def _nan_stats(a: np.ndarray, percentiles: tuple, count) -> (dict, np.ndarray):
+    with warnings.catch_warnings():
+        # 全为 nan 的行会产生 RuntimeWarning，结果保持 nan
+        warnings.simplefilter('ignore', RuntimeWarning)
+        rs = dict(mean=np.nanmean(a, axis=-1), max=np.nanmax(a, axis=-1), count=count)
+        pp = np.nanpercentile(a, percentiles, axis=-1)
+    return rs, pp
+
+
+def summarize_cpu_rates(columns: CPUColumns, is_normalized=True, percentiles: tuple = PERCENTILES) -> dict:
+    """
+    :return: {'app': cpu_rate_stats(...), 'sys': cpu_rate_stats(...)}
+    """
+    app_rate, sys_rate = compute_cpu_rates(columns, is_normalized)
+    return dict(app=cpu_rate_stats(app_rate, percentiles), sys=cpu_rate_stats(sys_rate, percentiles))
@@ -0,0 +1,219 @@
+# coding=utf8
+import hashlib
+import os
+import posixpath
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Callable
+
+from .my_adb import AdbProxy
+
+logging = getLogger(__name__)
+
+
+class DeployResult:
+    """
+    单台设备的部署进度及结果
+    状态: pending -> checking -> (skipped | transferring -> done) 或 failed
+    """
+    PENDING = 'pending'
+    CHECKING = 'checking'
+    TRANSFERRING = 'transferring'
+    SKIPPED = 'skipped'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, serial: str, target: str, size: int):
+        """
+        :param serial: 设备号
+        :param target: 部署目标，应用包名或设备端文件路径
+        :param size: 需要传输的字节数
+        """
+        self.serial = serial
+        self.target = target
+        self.size = size
+        self.state = self.PENDING
+        self.error = None
+        self.start_time = None
+        self.transfer_start = None
+        self.end_time = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (self.SKIPPED, self.DONE, self.FAILED)
+
+    @property
+    def elapsed(self) -> float:
+        """
+        :return: 总耗时，秒(包含版本及校验检查)
+        """
+        if self.start_time is None:
+            return 0
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def throughput(self) -> float:
+        """
+        :return: 传输速度 字节/秒，未传输时为0
+        """
+        if self.transfer_start is None or self.state != self.DONE:
+            return 0
+        cost = self.end_time - self.transfer_start
+        return self.size / cost if cost > 0 else 0
+
+    def __str__(self):
+        rs = f'[{self.serial}] {self.target} {self.state} {self.elapsed:.2f}s'
+        if self.state == self.DONE:
+            rs += f' {self.throughput / 1024 / 1024:.2f}MB/s'
+        if self.error:
+            rs += f' {self.error}'
+        return rs
+
+
+class BulkDeployer:
+    """
+    多设备批量安装应用、推送文件
+    设备之间并行执行，并发数有上限；已安装相同版本的应用、设备端md5一致的文件会跳过
+    """
+    exp_md5 = re.compile(r'^([0-9a-fA-F]{32})\s')
+
+    def __init__(self, proxies, max_workers: int = 8, md5_block_size: int = 1024 * 1024,
+                 on_progress: Callable[[DeployResult], None] = None):
+        """
+        :param proxies: {设备号: AdbProxy} 或 AdbProxy 列表
+        :param max_workers: 同时部署的设备数上限
+        :param md5_block_size: 本地计算md5时每次读取的字节数，大文件不会整体读入内存(不影响传输)
+        :param on_progress: 每台设备状态变化时的回调，参数为 DeployResult，会在工作线程中调用
+        """
+        if not isinstance(proxies, dict):
+            proxies = {x.get_device_serial(): x for x in proxies}
+        self.proxies = proxies
+        self.max_workers = max_workers
+        self.md5_block_size = md5_block_size
+        self.on_progress = on_progress
+        self._md5_cache = {}
+        self._md5_lock = threading.Lock()
+
+    def file_md5(self, local_path: str) -> str:
+        """
+        分块计算本地文件md5，按 (路径, 修改时间, 大小) 缓存
+        """
+        st = os.stat(local_path)
+        key = (os.path.abspath(local_path), st.st_mtime, st.st_size)
+        with self._md5_lock:
+            if key in self._md5_cache:
+                return self._md5_cache[key]
+            m = hashlib.md5()
+            with open(local_path, 'rb') as f:
+                for d in iter(lambda: f.read(self.md5_block_size), b''):
+                    m.update(d)
+            self._md5_cache[key] = m.hexdigest()
+            return self._md5_cache[key]
+
+    def remote_md5(self, proxy: AdbProxy, device_path: str) -> str:
+        """
+        :return: 设备端文件的md5，文件不存在或设备不支持 md5sum 时返回None
+        """
+        m = self.exp_md5.findall(proxy.run_shell(f'md5sum "{device_path}" 2>/dev/null', True))
+        return m[0].lower() if m else None
+
+    def _set_state(self, rs: DeployResult, state: str):
+        rs.state = state
+        now = time.time()
+        if state == DeployResult.CHECKING:
+            rs.start_time = now
+        elif state == DeployResult.TRANSFERRING:
+            rs.transfer_start = now
+        elif rs.finished:
+            rs.end_time = now
+        logging.debug(str(rs))
+        if self.on_progress:
+            try:
+                self.on_progress(rs)
+            except Exception as e:
+                logging.warning(f'progress callback error: {e}')
+
+    def _run(self, target: str, size: int, func: Callable[[AdbProxy, DeployResult], bool]) -> dict:
+        results = {s: DeployResult(s, target, size) for s in self.proxies}
+
+        def work(serial):
+            rs = results[serial]
+            self._set_state(rs, DeployResult.CHECKING)
+            try:
+                state = DeployResult.DONE if func(self.proxies[serial], rs) else DeployResult.SKIPPED
+            except Exception as e:
+                logging.warning(f'[{serial}] deploy {target} failed: {e}')
+                rs.error = e
+                state = DeployResult.FAILED
+            self._set_state(rs, state)
+
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix='BulkDeployer') as ex:
+            list(ex.map(work, self.proxies))
+        return results
+
+    def install_app(self, apk_path: str, app_bundle: str, version: str = None, force=False) -> dict:
+        """
+        在所有设备上安装应用
+        :param apk_path: 本地安装包
+        :param app_bundle: 应用包名
+        :param version: 安装包的版本号(与 get_app_version 的结果比较)，为空时总是安装
+        :param force: 是否忽略版本检查强制安装
+        :return: {设备号: DeployResult}
+        """
+        def install(proxy: AdbProxy, rs: DeployResult) -> bool:
+            if version and not force and proxy.get_app_version(app_bundle) == version:
+                return False
+            self._set_state(rs, DeployResult.TRANSFERRING)
+            out = proxy.add_app(apk_path)
+            # python-adb 返回 `pm install` 的输出，成功时包含 `Success`；pure-python-adb 返回 bool
+            # 只有明确成功才视为安装成功，其他返回值(包括None)都视为失败
+            if not (out is True or (isinstance(out, str) and out.find('Success') != -1)):
+                raise ValueError(f'Install failed: {out.strip() if isinstance(out, str) else out}')
+            if version:
+                v = proxy.get_app_version(app_bundle)
+                if v != version:
+                    raise ValueError(f'Installed version {v} does not match {version}')
+            return True
+
+        return self._run(app_bundle, os.path.getsize(apk_path), install)
+
+    def push_file(self, local_path: str, device_path: str, force=False) -> dict:
+        """
+        推送文件到所有设备，设备端已存在md5相同的文件时跳过
+        :param local_path: 本地文件
+        :param device_path: 设备端文件路径
+        :param force: 是否忽略md5检查强制推送
+        :return: {设备号: DeployResult}
+        """
+        md5 = None if force else self.file_md5(local_path)
+
+        def push(proxy: AdbProxy, rs: DeployResult) -> bool:
+            if md5 and self.remote_md5(proxy, device_path) == md5:
+                return False
+            self._set_state(rs, DeployResult.TRANSFERRING)
+            proxy.run_shell(f'mkdir -p "{posixpath.dirname(device_path)}"')
+            proxy.push_file(local_path, device_path)
+            if md5:
+                m = self.remote_md5(proxy, device_path)
+                if m and m != md5:
+                    raise ValueError(f'md5 mismatch after push: {m} != {md5}')
+            return True
+
+        return self._run(device_path, os.path.getsize(local_path), push)
+
+    def push_dir(self, local_dir: str, device_dir: str, force=False) -> dict:
+        """
+        推送目录下的所有文件，每个文件单独检查md5
+        :return: {设备端文件路径: {设备号: DeployResult}}
+        """
+        out = {}
+        for root, _, files in os.walk(local_dir):
+            for x in sorted(files):
+                local_path = os.path.join(root, x)
+                rel = os.path.relpath(local_path, local_dir).replace(os.sep, '/')
+                device_path = posixpath.join(device_dir, rel)
+                out[device_path] = self.push_file(local_path, device_path, force)
+        return out
@@ -0,0 +1,201 @@
+# coding=utf8
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from logging import getLogger
+from typing import Callable, Optional
+
+from .my_adb import AdbInterface, AdbProxy
+
+logging = getLogger(__name__)
+
+
+def discover_serials() -> list:
+    """
+    通过 adb server 获取当前已连接(状态为device)的设备号
+    注意：不会重启 adb server，不影响本机其他连接
+    """
+    from airtest.core.android.py_adb import ADB
+    return [x[0] for x in ADB().devices() if x[1] == 'device']
+
+
+def _default_adb_factory(serial: str) -> AdbInterface:
+    from .pure_adb import PureAdb
+    return PureAdb(serial)
+
+
+class _DeviceWorker(threading.Thread):
+    _stop_job = None
+
+    def __init__(self, serial: str, adb_factory: Callable[[str], AdbInterface], proxy_class: Optional[type],
+                 queue_size: int):
+        super().__init__(name=f'DevicePool-{serial}', daemon=True)
+        self.serial = serial
+        self.adb_factory = adb_factory
+        self.proxy_class = proxy_class
+        self.jobs = queue.Queue()
+        self.proxy = None
+        # 队列中的空位，等待空位时不持有锁，停止标记入队也不需要空位
+        self._slots = threading.Semaphore(queue_size) if queue_size > 0 else None
+        # 入队与停止都在此锁内完成，保证停止标记之后不会再有任务入队
+        self._lock = threading.Lock()
+        self._closed = False
+        self._cancel_pending = False
+
+    def put(self, job, timeout: float = None):
+        if self._closed:
+            raise RuntimeError(f'Device {self.serial} has been removed')
+        if self._slots is not None and not self._slots.acquire(timeout=timeout):
+            raise queue.Full
+        with self._lock:
+            if not self._closed:
+                self.jobs.put(job)
+                return
+        self._release_slot()
+        raise RuntimeError(f'Device {self.serial} has been removed')
+
+    def _release_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def stop(self, cancel_pending=False):
+        """
+        :param cancel_pending: 是否取消队列中尚未执行的任务，否则执行完毕后再停止
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._cancel_pending = cancel_pending
+            self.jobs.put(self._stop_job)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is self._stop_job:
+                break
+            self._release_slot()
+            fu, func, args, kv = job
+            if self._cancel_pending:
+                fu.cancel()
+            if not fu.set_running_or_notify_cancel():
+                continue
+            try:
+                if self.proxy is None:
+                    # 在设备自己的线程中建立连接，多台设备并行连接；全部成功后才赋值，失败的下个任务重新连接
+                    proxy = self.adb_factory(self.serial)
+                    if self.proxy_class is not None:
+                        proxy = self.proxy_class(proxy)
+                    self.proxy = proxy
+                fu.set_result(func(self.proxy, *args, **kv))
+            except Exception as e:
+                logging.warning(f'[{self.serial}] job failed: {e}')
+                fu.set_exception(e)
+        if self.proxy is not None:
+            try:
+                self.proxy.close()
+            except Exception as e:
+                logging.warning(f'[{self.serial}] close failed: {e}')
+
+
+class DevicePool:
+    """
+    多设备调度池
+    每台设备一个工作线程及一个有界任务队列，同一设备上的任务按提交顺序串行执行，不同设备之间并行执行
+    队列已满时提交任务会阻塞(背压)，避免任务无限堆积
+    """
+
+    def __init__(self, serials: list = None, adb_factory: Callable[[str], AdbInterface] = None,
+                 proxy_class: Optional[type] = AdbProxy, queue_size: int = 16):
+        """
+        :param serials: 设备号列表，默认通过 adb server 自动发现
+        :param adb_factory: 根据设备号创建底层ADB实现，默认使用 PureAdb
+                            如使用 PyAdb，请传入 `lambda s: PyAdb(s, kill_server=False)`，以免断开其他设备的连接
+        :param proxy_class: AdbProxy 或其子类(例如 my_adb_with_tools.AdbProxy)，为None时任务直接使用 adb_factory 创建的对象
+        :param queue_size: 每台设备的任务队列长度
+        """
+        self.adb_factory = adb_factory or _default_adb_factory
+        self.proxy_class = proxy_class
+        self.queue_size = queue_size
+        self._workers = {}
+        self._lock = threading.Lock()
+        for s in serials if serials is not None else discover_serials():
+            self.add_device(s)
+
+    @property
+    def serials(self) -> list:
+        return list(self._workers.keys())
+
+    def add_device(self, serial: str):
+        with self._lock:
+            if serial in self._workers:
+                return
+            w = _DeviceWorker(serial, self.adb_factory, self.proxy_class, self.queue_size)
+            self._workers[serial] = w
+            w.start()
+
+    def remove_device(self, serial: str):
+        """
+        移除设备，已提交的任务执行完毕后关闭连接
+        """
+        with self._lock:
+            w = self._workers.pop(serial, None)
+        if w:
+            w.stop()
+
+    def submit(self, serial: str, func: Callable, *args, timeout: float = None, **kv) -> Future:
+        """
+        向指定设备提交任务
+        :param serial: 设备号
+        :param func: 任务函数，第一个参数为该设备的 AdbProxy，例如 `lambda adb: adb.get_memory(pkg)`
+                     或直接使用未绑定方法，例如 `AdbProxy.get_cpu_global`
+        :param timeout: 队列已满时的最长等待秒数，超时则抛出 queue.Full，默认一直等待
+        :return: Future
+        """
+        w = self._workers[serial]
+        fu = Future()
+        w.put((fu, func, args, kv), timeout=timeout)
+        return fu
+
+    def submit_all(self, func: Callable, *args, timeout: float = None, **kv) -> dict:
+        """
+        向所有设备提交同一个任务
+        :return: {设备号: Future}
+        """
+        return {s: self.submit(s, func, *args, timeout=timeout, **kv) for s in self.serials}
+
+    def run_all(self, func: Callable, *args, timeout: float = None, **kv) -> dict:
+        """
+        在所有设备上并行执行同一个任务并等待全部完成，单台设备失败不影响其他设备
+        :param timeout: 等待全部结果的最长秒数，超时的设备结果为 concurrent.futures.TimeoutError
+        :return: {设备号: 结果或异常}
+        """
+        out = {}
+        deadline = None if timeout is None else time.time() + timeout
+        for s, fu in self.submit_all(func, *args, **kv).items():
+            try:
+                out[s] = fu.result(None if deadline is None else max(0, deadline - time.time()))
+            except Exception as e:
+                out[s] = e
+        return out
+
+    def close(self, wait=True, cancel_pending=False):
+        """
+        :param wait: 是否等待所有工作线程退出
+        :param cancel_pending: 是否取消尚未执行的任务(其 Future 将被取消)，否则执行完毕后再关闭
+        """
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for w in workers:
+            w.stop(cancel_pending)
+        if wait:
+            for w in workers:
+                w.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
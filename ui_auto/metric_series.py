@@ -0,0 +1,197 @@
+# coding=utf8
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+
+class MetricSeries:
+    """
+    紧凑的列式性能数据存储
+    每个采样点占用4列: 时间戳(秒,array('d'))、数值(array('d'))、设备编号(array('q'))、指标编号(array('q'))
+    设备名、指标名只保存一份，列中只记录其编号，适合长时间、多设备的采集
+    """
+    _magic = b'UIMS'
+    _version = 1
+    _columns = (('timestamp', 'd'), ('value', 'd'), ('device', 'q'), ('metric', 'q'))
+    AGGREGATES = {
+        'sum': sum,
+        'max': max,
+        'min': min,
+        'count': len,
+        'mean': lambda x: sum(x) / len(x),
+        'last': lambda x: x[-1],
+    }
+
+    def __init__(self):
+        self.timestamp = array('d')
+        self.value = array('d')
+        self.device = array('q')
+        self.metric = array('q')
+        self.devices = []
+        self.metrics = []
+        self._device_ids = {}
+        self._metric_ids = {}
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @staticmethod
+    def _get_id(name: str, names: list, ids: dict) -> int:
+        i = ids.get(name)
+        if i is None:
+            i = ids[name] = len(names)
+            names.append(name)
+        return i
+
+    def device_id(self, name: str) -> int:
+        return self._get_id(name, self.devices, self._device_ids)
+
+    def metric_id(self, name: str) -> int:
+        return self._get_id(name, self.metrics, self._metric_ids)
+
+    def append(self, timestamp: float, value: float, metric: str, device: str = ''):
+        """
+        :param timestamp: 时间戳，秒
+        :param value: 数值
+        :param metric: 指标名，例如 cpu、memory、network_up
+        :param device: 设备号
+        """
+        self._materialize()
+        self.timestamp.append(timestamp)
+        self.value.append(value)
+        self.device.append(self.device_id(device))
+        self.metric.append(self.metric_id(metric))
+
+    def _materialize(self):
+        """
+        内存映射加载的各列为只读的 memoryview，写入前复制为 array
+        """
+        for k, t in self._columns:
+            c = getattr(self, k)
+            if not isinstance(c, array):
+                a = array(t)
+                a.frombytes(c.cast('B'))
+                setattr(self, k, a)
+
+    def _copy_names(self, other: 'MetricSeries'):
+        other.devices = list(self.devices)
+        other.metrics = list(self.metrics)
+        other._device_ids = dict(self._device_ids)
+        other._metric_ids = dict(self._metric_ids)
+
+    def __getitem__(self, item: slice) -> 'MetricSeries':
+        if not isinstance(item, slice):
+            raise TypeError('MetricSeries only supports slicing')
+        o = MetricSeries()
+        self._copy_names(o)
+        for k, t in self._columns:
+            setattr(o, k, array(t, getattr(self, k)[item]))
+        return o
+
+    def _indexes(self, metric: str = None, device: str = None, start: float = None, end: float = None):
+        m = None if metric is None else self._metric_ids.get(metric, -1)
+        d = None if device is None else self._device_ids.get(device, -1)
+        ts, ms, ds = self.timestamp, self.metric, self.device
+        for i in range(len(ts)):
+            if m is not None and ms[i] != m:
+                continue
+            if d is not None and ds[i] != d:
+                continue
+            if start is not None and ts[i] < start:
+                continue
+            if end is not None and ts[i] >= end:
+                continue
+            yield i
+
+    def select(self, metric: str = None, device: str = None, start: float = None, end: float = None) -> 'MetricSeries':
+        """
+        按条件筛选
+        :param metric: 指标名
+        :param device: 设备号
+        :param start: 起始时间戳(包含)
+        :param end: 结束时间戳(不包含)
+        :return: 新的 MetricSeries
+        """
+        o = MetricSeries()
+        self._copy_names(o)
+        for i in self._indexes(metric, device, start, end):
+            o.timestamp.append(self.timestamp[i])
+            o.value.append(self.value[i])
+            o.device.append(self.device[i])
+            o.metric.append(self.metric[i])
+        return o
+
+    def aggregate(self, metric: str, device: str = None, window: float = 1.0, how: str = 'sum') -> (array, array):
+        """
+        按时间窗口聚合
+        :param metric: 指标名
+        :param device: 设备号，默认不区分设备
+        :param window: 窗口秒数
+        :param how: 聚合方式，参考 AGGREGATES
+        :return: (窗口起始时间戳列, 聚合值列)，按时间升序
+        """
+        func = self.AGGREGATES[how]
+        groups = {}
+        for i in self._indexes(metric, device):
+            groups.setdefault(int(self.timestamp[i] // window), []).append(self.value[i])
+        ks = sorted(groups.keys())
+        return array('d', (k * window for k in ks)), array('d', (func(groups[k]) for k in ks))
+
+    def aggregate_by_second(self, metric: str, device: str = None, how: str = 'sum') -> (list, list):
+        """
+        按秒聚合
+        :return: ([秒级时间戳], [聚合值])
+        """
+        ts, vs = self.aggregate(metric, device, 1.0, how)
+        return [int(x) for x in ts], vs.tolist()
+
+    def save(self, file_path: str):
+        """
+        保存为二进制文件: 魔数 + 版本 + 头部长度 + JSON头部 + 按8字节对齐的4列原始数据，可通过 load(use_mmap=True) 直接映射读取
+        """
+        header = json.dumps(dict(
+            n=len(self), devices=self.devices, metrics=self.metrics, byteorder=sys.byteorder
+        )).encode('utf-8')
+        header += b' ' * (-(len(header) + 12) % 8)
+        # 可能保存到映射加载时的同一文件，需先复制出映射的数据
+        self._materialize()
+        with open(file_path, 'wb') as f:
+            f.write(self._magic + struct.pack('<II', self._version, len(header)) + header)
+            for k, _ in self._columns:
+                getattr(self, k).tofile(f)
+
+    @classmethod
+    def load(cls, file_path: str, use_mmap=False) -> 'MetricSeries':
+        """
+        :param file_path: save 保存的文件
+        :param use_mmap: 是否使用内存映射，此时各列为只读的 memoryview，不会整体读入内存；append 或 save 时才复制为 array
+        """
+        o = cls()
+        with open(file_path, 'rb') as f:
+            magic, version, size = struct.unpack('<4sII', f.read(12))
+            if magic != cls._magic or version != cls._version:
+                raise ValueError(f'Not a MetricSeries file: {file_path}')
+            header = json.loads(f.read(size).decode('utf-8'))
+            n = header['n']
+            for x in header['devices']:
+                o.device_id(x)
+            for x in header['metrics']:
+                o.metric_id(x)
+            if use_mmap:
+                if header['byteorder'] != sys.byteorder:
+                    raise ValueError('Byte order mismatch, please load without mmap')
+                mm = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                offset = 12 + size
+                for k, t in cls._columns:
+                    setattr(o, k, mm[offset:offset + n * 8].cast(t))
+                    offset += n * 8
+            else:
+                for k, t in cls._columns:
+                    a = array(t)
+                    a.fromfile(f, n)
+                    if header['byteorder'] != sys.byteorder:
+                        a.byteswap()
+                    setattr(o, k, a)
+        return o
@@ -1,7 +1,11 @@
 # coding=utf8
 import re
+import threading
+import time
 import types
+import uuid
 from logging import getLogger
+from typing import Callable, Optional
 
 logging = getLogger(__name__)
 
@@ -49,6 +53,110 @@ class SysCPU(CPUBase):
         return f'[Sys]{super().__str__()}'
 
 
+class SysMemory:
+    def __init__(self, total: float, free: float, available: float):
+        """
+        :param total: 总内存 MB
+        :param free: 空闲内存 MB
+        :param available: 可用内存 MB
+        """
+        self.total = total
+        self.free = free
+        self.available = available
+
+    def __str__(self):
+        return f'[Sys]Memory Total: {self.total:.2f}MB, Free: {self.free:.2f}MB, Available: {self.available:.2f}MB'
+
+
+class NetFlow:
+    def __init__(self, rx: int, tx: int):
+        """
+        :param rx: 累计接收(下行)字节数
+        :param tx: 累计发送(上行)字节数
+        """
+        self.rx = rx
+        self.tx = tx
+
+    def __str__(self):
+        return f'Net Down: {self.rx}B, Up: {self.tx}B'
+
+
+class ShellChannel:
+    # 交互式shell的双向字节通道
+    def write(self, data: bytes):
+        raise NotImplementedError
+
+    def read(self) -> bytes:
+        """
+        :return: 读取一段输出，通道已关闭时返回 b''；超过通道的读取时限仍无输出时报错 TimeoutError
+        """
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class LineFramer:
+    """
+    将 stream_shell 的连续输出拆分为行，供各底层实现共用
+    未结束的行以字节形式保留在可复用的 bytearray 缓冲区中，按 b'\n' 拆分后逐行解码：
+    UTF-8 的多字节字符中不会出现 b'\n'，跨数据块的字符不会解码失败，也不需要按数据块拼接字符串
+    """
+
+    def __init__(self, binary=False, encoding='utf-8'):
+        """
+        :param binary: 是否直接返回 bytes，不解码
+        :param encoding: 解码使用的编码
+        """
+        self.binary = binary
+        self.encoding = encoding
+        self._buf = bytearray()
+
+    def _convert(self, line: bytes):
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        return line if self.binary else line.decode(self.encoding, 'replace')
+
+    def feed(self, data: bytes) -> list:
+        """
+        :param data: 新读取的数据块
+        :return: 已完整的行，不包含换行符
+        """
+        i = data.rfind(b'\n')
+        if i == -1:
+            self._buf += data
+            return []
+        if self._buf:
+            self._buf += data[:i]
+            lines = bytes(self._buf).split(b'\n')
+            self._buf.clear()
+        else:
+            lines = data[:i].split(b'\n')
+        self._buf += data[i + 1:]
+        return [self._convert(x) for x in lines]
+
+    def flush(self) -> list:
+        """
+        :return: 数据流结束时剩余的未换行内容
+        """
+        if not self._buf:
+            return []
+        line = bytes(self._buf)
+        self._buf.clear()
+        return [self._convert(line)]
+
+    @classmethod
+    def iter_lines(cls, chunks, binary=False) -> types.GeneratorType:
+        """
+        :param chunks: 数据块(bytes)的迭代
+        :return: 每行内容的迭代
+        """
+        framer = cls(binary)
+        for d in chunks:
+            yield from framer.feed(d)
+        yield from framer.flush()
+
+
 class AdbInterface:
     # 基础ADB通讯接口
     def run_shell(self, cmd: str, clean_wrap=False) -> str:
@@ -60,10 +168,11 @@ class AdbInterface:
         """
         raise NotImplementedError
 
-    def stream_shell(self, cmd: str) -> types.GeneratorType:
+    def stream_shell(self, cmd: str, binary=False) -> types.GeneratorType:
         """
-        执行命令，返回输出流的迭代器，每次返回一行输出结果
+        执行命令，返回输出流的迭代器，每次返回一行输出结果(不包含换行符)，可参考 LineFramer 实现
         :param cmd: 命令内容
+        :param binary: 是否返回 bytes，不解码
         :return: 每行输出结果迭代
         """
         raise NotImplementedError
@@ -86,10 +195,140 @@ class AdbInterface:
     def get_device_serial(self) -> str:
         raise NotImplementedError
 
+    def open_shell_channel(self) -> ShellChannel:
+        """
+        打开一个常驻的shell进程通道，用于 ShellSession
+        """
+        raise NotImplementedError
+
+
+class ProcessInfo:
+    def __init__(self, pid: str, ppid: str, uid: str, name: str):
+        self.pid = pid
+        self.ppid = ppid
+        self.uid = uid
+        self.name = name
+
+    @property
+    def package(self) -> str:
+        # 应用的子进程名为 `包名:进程名`
+        return self.name.split(':', 1)[0]
+
+    def __str__(self):
+        return f'[{self.pid}] {self.name} (PPID: {self.ppid}, UID: {self.uid})'
+
+
+class ProcessTable:
+    """
+    设备进程表快照
+    通过一次 `ps` 获取全部进程，并按 进程ID、用户ID、包名 建立索引，超过有效期后在下次查询时自动刷新
+    同一个设备的多个调用方共享同一份快照
+    """
+    ps_cmd = 'ps -A -o PID,PPID,UID,NAME'
+
+    def __init__(self, adb: Optional[AdbInterface], ttl: float = 1.0):
+        """
+        :param adb: 目标设备，为None时不自动刷新，由调用方执行 ps_cmd 后通过 load 刷新(例如异步实现)
+        :param ttl: 快照有效秒数
+        """
+        self.adb = adb
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._time = 0
+        self._by_pid = {}
+        self._by_uid = {}
+        self._by_package = {}
+
+    def invalidate(self):
+        self._time = 0
+
+    @property
+    def expired(self) -> bool:
+        return time.time() - self._time > self.ttl
+
+    def refresh(self):
+        self.load(self.adb.run_shell(self.ps_cmd))
+
+    def load(self, rs: str):
+        """
+        :param rs: ps_cmd 的输出
+        """
+        by_pid, by_uid, by_package = {}, {}, {}
+        for x in rs.split('\n'):
+            d = x.split(None, 3)
+            if len(d) != 4 or not d[0].isdigit():
+                continue
+            p = ProcessInfo(*(y.strip() for y in d))
+            by_pid[p.pid] = p
+            by_uid.setdefault(p.uid, []).append(p)
+            by_package.setdefault(p.package, []).append(p)
+        self._by_pid, self._by_uid, self._by_package = by_pid, by_uid, by_package
+        self._time = time.time()
+
+    def _ensure(self):
+        if self.adb is not None and self.expired:
+            with self._lock:
+                # 等待锁期间可能已经被其他调用方刷新
+                if self.expired:
+                    self.refresh()
+
+    def all(self) -> list:
+        self._ensure()
+        return list(self._by_pid.values())
+
+    def by_pid(self, pid: str) -> ProcessInfo:
+        self._ensure()
+        return self._by_pid.get(str(pid))
+
+    def by_uid(self, uid: str) -> list:
+        self._ensure()
+        return list(self._by_uid.get(str(uid), []))
+
+    def by_package(self, app_bundle: str) -> list:
+        """
+        :return: 目标应用的全部进程(主进程及 `包名:xxx` 子进程)
+        """
+        self._ensure()
+        return list(self._by_package.get(app_bundle, []))
+
+    def find(self, keyword: str) -> list:
+        """
+        :return: 进程名包含关键字的全部进程
+        """
+        self._ensure()
+        return [p for p in self._by_pid.values() if p.name.find(keyword) != -1]
+
+    def wait_for_process(self, app_bundle: str, timeout: float = 30, interval: float = 0.1) -> list:
+        """
+        等待目标应用的进程出现
+        :param app_bundle: 包名
+        :param timeout: 超时秒数
+        :param interval: 轮询间隔秒数
+        :return: 目标应用的全部进程
+        """
+        end = time.time() + timeout
+        while True:
+            with self._lock:
+                self.refresh()
+            ps = self.by_package(app_bundle)
+            if ps:
+                return ps
+            if time.time() > end:
+                raise TimeoutError(f'Waiting for process `{app_bundle}` timeout!')
+            time.sleep(interval)
+
 
 class AdbBase(AdbInterface):
     # 基于ADB的常用功能扩展实现
     exp_version = re.compile(r'versionName=([\w\.]+)')
+    exp_user_id = re.compile(r'userId=(\d+)')
+
+    def run_shells(self, cmds: list, clean_wrap=False) -> list:
+        """
+        依次执行多条命令，启用常驻shell会话时将一次性写入
+        :return: [各命令的结果]
+        """
+        return [self.run_shell(x, clean_wrap) for x in cmds]
 
     def go_back(self):
         return self.run_shell('input keyevent BACK')
@@ -110,25 +349,65 @@ class AdbBase(AdbInterface):
     def close_http_proxy(self):
         return self.set_http_proxy(':0')
 
+    _snapshot_cache = {}  # 进程内按设备号共享 {设备号: (获取时间, {属性名: 属性值}, `wm size`的输出)}
+    snapshot_ttl = 600  # 设备属性快照的有效秒数
+    exp_prop = re.compile(r'^\[([^\]]+)\]: \[(.*?)\]\s*$', re.M | re.S)
+
+    def _get_device_snapshot(self, refresh=False) -> tuple:
+        """
+        通过一次 `getprop` + `wm size` 获取设备属性快照，按设备号缓存；设备号未知时只缓存在当前对象上
+        :param refresh: 是否忽略缓存重新获取
+        :return: (获取时间, {属性名: 属性值}, `wm size`的输出)
+        """
+        serial = self.get_device_serial()
+        c = self._snapshot_cache.get(serial) if serial else getattr(self, '_device_snapshot', None)
+        if refresh or not c or time.time() - c[0] > self.snapshot_ttl:
+            ss = self._split_sections(self.run_shell(
+                f'{self._echo_section("prop")}; getprop; {self._echo_section("wm")}; wm size'))
+            c = (time.time(), dict(self.exp_prop.findall(ss.get('prop', ''))), ss.get('wm', ''))
+            if serial:
+                self._snapshot_cache[serial] = c
+            else:
+                setattr(self, '_device_snapshot', c)
+        return c
+
+    def get_props(self, refresh=False) -> dict:
+        """
+        获取设备的全部系统属性(getprop)，结果按设备号缓存 snapshot_ttl 秒
+        :param refresh: 是否忽略缓存重新获取
+        :return: {属性名: 属性值}
+        """
+        return self._get_device_snapshot(refresh)[1]
+
+    def get_prop(self, name: str, default: str = '') -> str:
+        return self.get_props().get(name, default)
+
     def get_device_resolution(self) -> (int, int):
-        k = '_resolution'
-        if not hasattr(self, k):
-            rs = re.split(r'\s+', self.run_shell('wm size').strip())
-            rs = rs[-1].split('x')
-            setattr(self, k, (int(rs[0]), int(rs[1])))
-        return getattr(self, k)
+        out = self._get_device_snapshot()[2]
+        try:
+            rs = out.split()[-1].split('x')
+            return int(rs[0]), int(rs[1])
+        except (IndexError, ValueError):
+            raise ValueError(f'Unexpected `wm size` output: {out!r}')
+
+    def get_device_brand(self) -> str:
+        return self.get_prop('ro.product.brand')
+
+    def get_device_model(self) -> str:
+        return self.get_prop('ro.product.model')
 
     def get_device_info(self, dev: AndroidDevice = None) -> AndroidDevice:
         d = dev or AndroidDevice()
-        d.os_version = self.run_shell('getprop ro.build.version.release', True)
-        d.sdk_version = self.run_shell('getprop ro.build.version.sdk', True)
-        d.model = self.run_shell('getprop ro.product.model', True)
-        d.brand = self.run_shell('getprop ro.product.brand', True)
+        d.os_version = self.get_prop('ro.build.version.release')
+        d.sdk_version = self.get_prop('ro.build.version.sdk')
+        d.model = self.get_device_model()
+        d.brand = self.get_device_brand()
         return d
 
     def launch_app(self, app_pkg: str, app_activity: str = None):
         m = app_activity and f'am start {app_pkg}/{app_activity}' or \
             f'monkey -p {app_pkg} -c android.intent.category.LAUNCHER 1'
+        self.process_table.invalidate()
         return self.run_shell(m)
 
     def get_app_version(self, app_bundle: str) -> str:
@@ -143,25 +422,36 @@ class AdbBase(AdbInterface):
         :param app_bundle:
         :return:
         """
+        self.process_table.invalidate()
         return self.run_shell(f'pm clear {app_bundle}')
 
     def kill_app(self, app_bundle: str):
+        self.process_table.invalidate()
         return self.run_shell(f'am force-stop {app_bundle}', True)
 
+    process_table_ttl = 1.0  # 进程表快照的有效秒数
+
+    @property
+    def process_table(self) -> ProcessTable:
+        k = '_process_table'
+        if not hasattr(self, k):
+            setattr(self, k, ProcessTable(self, self.process_table_ttl))
+        return getattr(self, k)
+
     def find_processes(self, app_bundle: str) -> list:
         """
         每个app可能会有多个进程
         :param app_bundle:
         :return: list: [(进程ID，父进程ID，进程名)]
         """
-        rs = self.run_shell(f'ps -A | grep {app_bundle}')
-        ll = []
-        for x in rs.split('\n'):
-            d = re.split(r'\s+', x)
-            if not d or not d[0]:
-                continue
-            ll.append((d[1], d[2], d[-1]))
-        return ll
+        return [(p.pid, p.ppid, p.name) for p in self.process_table.find(app_bundle)]
+
+    def wait_for_process(self, app_bundle: str, timeout: float = 30, interval: float = 0.1) -> list:
+        """
+        等待目标应用的进程出现
+        :return: list: [(进程ID，父进程ID，进程名)]
+        """
+        return [(p.pid, p.ppid, p.name) for p in self.process_table.wait_for_process(app_bundle, timeout, interval)]
 
     def find_process_ids(self, app_bundle: str) -> list:
         return [p[0] for p in self.find_processes(app_bundle)]
@@ -175,14 +465,35 @@ class AdbBase(AdbInterface):
     def get_memory_details(self, app_bundle_or_pid: str):
         return self.run_shell(f'dumpsys meminfo {app_bundle_or_pid}')
 
-    def get_memory(self, app_bundle_or_pid: str) -> float:
+    memory_retry_times = 3  # 获取内存结果异常时的最大重试次数
+    memory_retry_interval = 0.01  # 重试间隔秒数
+
+    def get_memory(self, app_bundle_or_pid: str, retry_times: int = None) -> float:
         """
         :param app_bundle_or_pid:
+        :param retry_times: 结果异常时的最大重试次数，默认为 memory_retry_times
         :return: 当前内存占用 MB
         """
         logging.debug(f'Getting Memory usage on {app_bundle_or_pid} ...')
-        rs = self.get_memory_details(app_bundle_or_pid)
-        # logging.warning(f'{app_bundle_or_pid}  details:::{rs}')
+        retry_times = self.memory_retry_times if retry_times is None else retry_times
+        while True:
+            rs = self.get_memory_details(app_bundle_or_pid)
+            # logging.warning(f'{app_bundle_or_pid}  details:::{rs}')
+            m = self._parse_memory(rs, app_bundle_or_pid)
+            if m is not None:
+                return m
+            if retry_times <= 0:
+                raise ValueError(f'Matching `TOTAL PSS` failed!\n{rs}')
+            retry_times -= 1
+            logging.warning('try to get MemoryInfo again!')
+            time.sleep(self.memory_retry_interval)
+
+    @staticmethod
+    def _parse_memory(rs: str, app_bundle_or_pid: str):
+        """
+        解析 dumpsys meminfo 结果
+        :return: 内存占用 MB，如果需要重新获取，则返回None
+        """
         m = re.findall(r'TOTAL PSS:\s+(\d+)', rs)
         if m:
             return int(m[0]) / 1024.0
@@ -191,19 +502,122 @@ class AdbBase(AdbInterface):
             logging.warning(f'process miss:{app_bundle_or_pid}')
             return 0
         if rs.find('MEMINFO in pid') != -1:
-            logging.warning('try to get MemoryInfo again!')
-            return self.get_memory(app_bundle_or_pid)
+            return None
         raise ValueError(f'Matching `TOTAL PSS` failed!\n{rs}')
 
-    def get_memory_by_app_processes(self, process_id_list: list) -> float:
-        total = 0.0
-        for pi in process_id_list:
-            total += self.get_memory(pi)
-        return total
+    exp_pss_by_process = re.compile(r'^\s*([\d,]+)\s*(?:K|kB):\s+\S+\s+\(pid\s+(\d+)', re.M)
+
+    @classmethod
+    def _parse_pss_by_process(cls, rs: str) -> dict:
+        """
+        解析 `dumpsys meminfo` 汇总结果中的 `Total PSS by process` 部分
+        :return: {进程ID: 内存占用 MB}
+        """
+        i = rs.find('Total PSS by process')
+        if i == -1:
+            raise ValueError(f'Matching `Total PSS by process` failed!\n{rs}')
+        j = rs.find('\n\n', i)
+        part = rs[i:] if j == -1 else rs[i:j]
+        return {pid: int(kb.replace(',', '')) / 1024.0 for kb, pid in cls.exp_pss_by_process.findall(part)}
+
+    @classmethod
+    def _parse_smaps_rollup(cls, rs: str, pid_list: list) -> dict:
+        ss = cls._split_sections(rs)
+        out = {}
+        for pi in pid_list:
+            m = re.findall(r'^Pss:\s+(\d+)', ss.get(f'pid:{pi}', ''), re.M)
+            if m:
+                out[pi] = int(m[0]) / 1024.0
+        return out
+
+    @classmethod
+    def _parse_meminfo_by_pid(cls, rs: str, pid_list: list) -> dict:
+        ss = cls._split_sections(rs)
+        out = {}
+        for pi in pid_list:
+            x = ss.get(f'pid:{pi}', '')
+            m = cls._parse_memory(x, pi)
+            if m is None:
+                raise ValueError(f'Matching `TOTAL PSS` failed!\n{x}')
+            out[pi] = m
+        return out
+
+    memory_bulk_threshold = 8  # 进程数不少于该值时改为解析一次系统范围的 `dumpsys meminfo`
+
+    @classmethod
+    def _memory_by_pids_query(cls, pid_list: list, use_smaps=False) -> (str, Callable[[str], dict]):
+        """
+        :return: (命令, 解析函数 func(命令结果) -> {进程ID: 内存占用 MB})
+        """
+        if use_smaps:
+            cmd = '; '.join(f'{cls._echo_section(f"pid:{pi}")}; cat /proc/{pi}/smaps_rollup'
+                            for pi in pid_list)
+            return cmd, lambda rs: cls._parse_smaps_rollup(rs, pid_list)
+        if len(pid_list) >= cls.memory_bulk_threshold:
+            return 'dumpsys meminfo', cls._parse_pss_by_process
+        cmd = '; '.join(f'{cls._echo_section(f"pid:{pi}")}; dumpsys meminfo {pi}' for pi in pid_list)
+        return cmd, lambda rs: cls._parse_meminfo_by_pid(rs, pid_list)
+
+    @staticmethod
+    def _fill_missing_pids(m: dict, pid_list: list) -> dict:
+        out = {}
+        for pi in pid_list:
+            if pi not in m:
+                # 进程被销毁
+                logging.warning(f'process miss:{pi}')
+            out[pi] = m.get(pi, 0)
+        return out
+
+    def get_memory_by_pids(self, process_id_list: list, use_smaps=False, retry_times: int = None) -> dict:
+        """
+        通过一次命令获取多个进程的内存(PSS)占用
+        默认依次执行各进程的 `dumpsys meminfo <pid>`，进程数不少于 memory_bulk_threshold 时改为解析系统范围的
+        `dumpsys meminfo` 的进程汇总列表(单次耗时较长)
+        :param process_id_list: 进程ID列表
+        :param use_smaps: 是否读取 /proc/<pid>/smaps_rollup (需要内核4.14及以上，且有权限读取目标进程，速度更快)
+        :param retry_times: 结果异常时的最大重试次数，默认为 memory_retry_times
+        :return: {进程ID: 内存占用 MB}，已经销毁的进程为0
+        """
+        pid_list = [str(x) for x in process_id_list]
+        if not pid_list:
+            return {}
+        cmd, parse = self._memory_by_pids_query(pid_list, use_smaps)
+        retry_times = self.memory_retry_times if retry_times is None else retry_times
+        while True:
+            try:
+                m = parse(self.run_shell(cmd))
+                break
+            except ValueError:
+                if retry_times <= 0:
+                    raise
+                retry_times -= 1
+                logging.warning('try to get MemoryInfo again!')
+                time.sleep(self.memory_retry_interval)
+        return self._fill_missing_pids(m, pid_list)
+
+    def get_memory_by_app_processes(self, process_id_list: list, use_smaps=False) -> float:
+        """
+        获取多个进程的内存(PSS)占用之和，只执行一次命令
+        :return: 内存占用 MB
+        """
+        return sum(self.get_memory_by_pids(process_id_list, use_smaps).values())
 
     def get_cpu_count(self) -> int:
-        c = self.run_shell('cat /proc/cpuinfo | grep ^processor | wc -l')
-        return int(c)
+        k = '_cpu_count'
+        if not hasattr(self, k):
+            c = self.run_shell('cat /proc/cpuinfo | grep ^processor | wc -l')
+            setattr(self, k, int(c))
+        return getattr(self, k)
+
+    def get_page_size(self) -> int:
+        """
+        内存页大小(字节)，部分设备为16KB，按设备缓存
+        """
+        k = '_page_size'
+        if not hasattr(self, k):
+            rs = self.run_shell('getconf PAGESIZE', True).strip()
+            setattr(self, k, int(rs) if rs.isdigit() else 4096)
+        return getattr(self, k)
 
     def get_cpu_x_curr_freq(self, idx: int) -> int:
         """获取某个CPU核的当前频率
@@ -218,22 +632,60 @@ class AdbBase(AdbInterface):
         :param idx: CPU核的下标
         """
         f = self.run_shell(f'cat /sys/devices/system/cpu/cpu{idx}/cpufreq/scaling_max_freq')
+        return self._parse_cpu_max_freq(f)
+
+    @staticmethod
+    def _parse_cpu_max_freq(f: str) -> int:
         try:
             return int(f)
         except ValueError:
             raise RuntimeError(f'文件读取遇到错误: {f}\n请关闭手机的开发者模式，重启手机后再尝试重新开启开发者模式并开启USB调试后进行测试.')
 
+    @staticmethod
+    def _cat_cpu_freq_cmd(cpu_count: int, freq_file: str) -> str:
+        # 每个核输出一行，读取失败时输出的错误信息同样占一行，保证与核的下标对应
+        idx = ' '.join(str(i) for i in range(cpu_count))
+        return f'for i in {idx}; do cat /sys/devices/system/cpu/cpu$i/cpufreq/{freq_file}; done'
+
+    def get_cpu_max_freq_list(self) -> list:
+        """获取所有CPU核的最大频率，最大频率不会变化，因此按设备缓存，仅首次需要访问设备
+        :return: [各CPU核的最大频率]
+        """
+        k = '_cpu_max_freq_list'
+        if not hasattr(self, k):
+            rs = self.run_shell(self._cat_cpu_freq_cmd(self.get_cpu_count(), 'scaling_max_freq'))
+            setattr(self, k, [self._parse_cpu_max_freq(x) for x in rs.split('\n') if x.strip()])
+        return getattr(self, k)
+
+    @staticmethod
+    def _compute_cpu_freq(curr_freq_output: str, max_freq_list: list) -> float:
+        ct = 0
+        for x in curr_freq_output.split('\n'):
+            x = x.strip()
+            if x.isdigit():
+                # 已经下线的核读取不到当前频率，按0计算
+                ct += int(x)
+        return ct * 1.0 / sum(max_freq_list)
+
     def get_cpu_freq(self) -> float:
         """计算CPU当前频率占比
         :return 当前时刻所有CPU频率之和/所有CPU频率最大值之和
         """
-        c = self.get_cpu_count()
-        ct = 0
-        mt = 0
-        for i in range(c):
-            ct += self.get_cpu_x_curr_freq(i)
-            mt += self.get_cpu_x_max_freq(i)
-        return ct * 1.0 / mt
+        max_freq_list = self.get_cpu_max_freq_list()
+        rs = self.run_shell(self._cat_cpu_freq_cmd(self.get_cpu_count(), 'scaling_cur_freq'))
+        return self._compute_cpu_freq(rs, max_freq_list)
+
+    @staticmethod
+    def _parse_sys_cpu(stat_line: str, freq: float) -> SysCPU:
+        # 1: 总的用户态时间
+        # 3: 总的内核态时间
+        t = re.split(r'\s+', stat_line.strip())
+        total = 0
+        for x in t[1:8]:
+            if not x:
+                continue
+            total += int(x)
+        return SysCPU(int(t[1]), int(t[3]), total, freq)
 
     def get_cpu_global(self) -> SysCPU:
         """
@@ -242,16 +694,90 @@ class AdbBase(AdbInterface):
         # 参考 https://www.cnblogs.com/wangfengju/p/6172440.html
         :return: 返回系统启动以来(总的用户态时间，总的内核态时间)
         """
-        #
-        # 1: 总的用户态时间
-        # 3: 总的内核态时间
-        t = re.split(r'\s+', self.run_shell('cat /proc/stat|head -n 1'))
-        total = 0
-        for x in t[1:8]:
-            if not x:
+        return self.get_cpu_sample()[0]
+
+    _section_mark = '#ui_auto#'
+
+    @classmethod
+    def _echo_section(cls, name: str) -> str:
+        return f'echo "{cls._section_mark}{name}"'
+
+    @classmethod
+    def _split_sections(cls, rs: str) -> dict:
+        """
+        拆分组合命令的输出
+        :param rs: 由`_echo_section`分段的命令输出
+        :return: {段名: 段内容}
+        """
+        out = {}
+        name = None
+        lines = []
+        for x in rs.split('\n'):
+            x = x.rstrip('\r')
+            if x.startswith(cls._section_mark):
+                if name is not None:
+                    out[name] = '\n'.join(lines)
+                name = x[len(cls._section_mark):]
+                lines = []
+            elif name is not None:
+                lines.append(x)
+        if name is not None:
+            out[name] = '\n'.join(lines)
+        return out
+
+    @staticmethod
+    def _parse_app_cpu(stat: str) -> AppCPU:
+        # 进程名可能包含空格，因此从进程名结尾的`)`之后开始切分
+        # 13：utime 该进程用户态时间
+        # 14：stime 该进程内核态时间
+        m = stat[stat.rfind(')') + 1:].split()
+        return AppCPU(int(m[11]), int(m[12]))
+
+    @classmethod
+    def _app_cpu_cmd_list(cls, pid_list: list) -> list:
+        cmd = []
+        for pi in pid_list:
+            cmd.append(cls._echo_section(f'pid:{pi}'))
+            cmd.append(f'cat /proc/{pi}/stat')
+        return cmd
+
+    @classmethod
+    def _build_cpu_sample_cmd(cls, cpu_count: int, pid_list: list) -> str:
+        cmd = [cls._echo_section('stat'), 'head -n 1 /proc/stat',
+               cls._echo_section('freq'), cls._cat_cpu_freq_cmd(cpu_count, 'scaling_cur_freq')]
+        return '; '.join(cmd + cls._app_cpu_cmd_list(pid_list))
+
+    @classmethod
+    def _parse_cpu_sample(cls, rs: str, pid_list: list, max_freq_list: list) -> (SysCPU, dict):
+        ss = cls._split_sections(rs)
+        sys_cpu = cls._parse_sys_cpu(ss['stat'], cls._compute_cpu_freq(ss['freq'], max_freq_list))
+        return sys_cpu, cls._parse_app_cpu_sections(ss, pid_list)
+
+    @classmethod
+    def _parse_app_cpu_sections(cls, ss: dict, pid_list: list) -> dict:
+        app_cpu = {}
+        for pi in pid_list:
+            rs = ss.get(f'pid:{pi}', '').strip()
+            if not rs or rs.find('No such') != -1:
+                logging.warning(f'process miss:{pi}')
                 continue
-            total += int(x)
-        return SysCPU(int(t[1]), int(t[3]), total, self.get_cpu_freq())
+            # 不是 stat 格式(例如 Permission denied)时报错，而不是在解析时出现 IndexError
+            if rs.find('error') != -1 or rs.find(')') == -1:
+                raise ValueError(f'Error return: {rs}')
+            app_cpu[pi] = cls._parse_app_cpu(rs)
+        return app_cpu
+
+    def get_cpu_sample(self, pid_list: list = None) -> (SysCPU, dict):
+        """
+        通过一次ADB往返，同时采集系统CPU时间、各核当前频率以及目标进程的CPU时间
+        时间数据单位：jiffies。  1jiffies=0.01秒
+        :param pid_list: 目标进程ID列表
+        :return: (SysCPU, {进程ID: AppCPU})，已经销毁的进程不会出现在结果中
+        """
+        pid_list = pid_list or []
+        max_freq_list = self.get_cpu_max_freq_list()
+        rs = self.run_shell(self._build_cpu_sample_cmd(len(max_freq_list), pid_list))
+        return self._parse_cpu_sample(rs, pid_list, max_freq_list)
 
     def get_cpu_details(self, pid: str, for_all=False):
         """
@@ -279,36 +805,25 @@ class AdbBase(AdbInterface):
         :return: (进程用户态所占CPU时间, 系统内核态所占CPU时间)
         """
         logging.debug(f'Getting CPU usage on {pid} ...')
-        p = self.get_cpu_details(pid)
-        # 13：utime 该进程用户态时间
-        # 14：stime 该进程内核态时间
-        return AppCPU(int(p[13]), int(p[14]))
+        return self._parse_app_cpu(self.get_cpu_details(pid, for_all=True))
 
-    def get_cpu_usage_by_app_processes(self, process_id_list: list[int], auto_remove_miss_process=True) -> AppCPU:
+    def get_cpu_usage_by_app_processes(self, process_id_list: list, auto_remove_miss_process=True) -> AppCPU:
         """
         每个App可能会有多个进程
-        获取目标Apps进程id列表的最新CPU占用时间汇总
+        通过一次ADB往返获取目标Apps进程id列表的最新CPU占用时间汇总
         :param process_id_list: App的进程列表
         :param auto_remove_miss_process: 是否从process_id_list中清理不存在进程ID
-        :return: 当前总的目标AppCPU时间
+            需要跟踪进程的出现与销毁时建议使用 CPUProfiler
+        :return: 当前总的目标AppCPU时间(用户态汇总，内核态汇总)
         """
-        total_u, total_s = 0, 0
-        miss_pid_list = []
-        for pi in process_id_list:
-            try:
-                cpu_use = self.get_cpu_usage(pi)
-            except KeyError as e:
-                if str(e).find('No such') != -1:
-                    logging.warning(f'process miss:{pi}')
-                    miss_pid_list.append(pi)
-                    continue
-                raise e
-            total_u += cpu_use.user
-            total_s += cpu_use.kernel
-        if auto_remove_miss_process:
-            for xp in miss_pid_list:
-                process_id_list.remove(xp)
-        return AppCPU(total_s, total_s)
+        if not process_id_list:
+            return AppCPU(0, 0)
+        # 只读取进程的stat，不依赖CPU频率(部分设备无权限读取 scaling_max_freq)
+        rs = self.run_shell('; '.join(self._app_cpu_cmd_list(process_id_list)))
+        app_cpu = self._parse_app_cpu_sections(self._split_sections(rs), process_id_list)
+        if auto_remove_miss_process and len(app_cpu) != len(process_id_list):
+            process_id_list[:] = [x for x in process_id_list if x in app_cpu]
+        return AppCPU(sum(x.user for x in app_cpu.values()), sum(x.kernel for x in app_cpu.values()))
 
     @staticmethod
     def compute_cpu_rate(
@@ -348,7 +863,7 @@ class AdbBase(AdbInterface):
         :return:
         """
         rs = self.run_shell(f'dumpsys package {app_bundle} | grep userId=')
-        u = re.findall(r'userId=(\d+)', rs)
+        u = self.exp_user_id.findall(rs)
         if u:
             return u[0]
         raise ValueError(f'Matching userId error: {rs}')
@@ -357,19 +872,78 @@ class AdbBase(AdbInterface):
         # 状态字参考:https://users.cs.northwestern.edu/~agupta/cs340/project2/TCPIP_State_Transition_Diagram.pdf
         # https://guanjunjian.github.io/2017/11/09/study-8-proc-net-tcp-analysis/
         # https://zhuanlan.zhihu.com/p/49981590
-        rs = self.run_shell(f'cat /proc/net/{target_net_file} | grep {uid}')
+        rs = self.run_shell(self._net_sockets_cmd(uid, target_net_file))
         if rs:
-            ll = []
-            for r in rs.split('\n'):
-                if not r:
-                    continue
-                m = re.split(r'\s+', r.strip())
-                if m and m[7] == uid:
-                    ll.append(m)
-            return ll
+            return self._parse_net_sockets(rs, uid)
 
     _net_files = ['tcp', 'tcp6', 'udp', 'udp6']
 
+    @staticmethod
+    def _net_sockets_cmd(uid: str, target_net_file: str) -> str:
+        return f'cat /proc/net/{target_net_file} | grep {uid}'
+
+    @staticmethod
+    def _parse_net_sockets(rs: str, uid: str) -> list:
+        """
+        :param rs: /proc/net/tcp 等文件的内容
+        :return: 属于该用户ID的socket行，每行按空白切分，第8列为uid
+        """
+        ll = []
+        for r in rs.split('\n'):
+            if not r.strip():
+                continue
+            m = re.split(r'\s+', r.strip())
+            if len(m) > 7 and m[7] == uid:
+                ll.append(m)
+        return ll
+
+    @staticmethod
+    def _sys_memory_cmd() -> str:
+        return "grep -E '^(MemTotal|MemFree|MemAvailable):' /proc/meminfo"
+
+    @staticmethod
+    def _parse_sys_memory(rs: str) -> SysMemory:
+        m = dict(re.findall(r'(\w+):\s+(\d+)', rs))
+        return SysMemory(*(int(m.get(k, 0)) / 1024.0 for k in ('MemTotal', 'MemFree', 'MemAvailable')))
+
+    @staticmethod
+    def _net_flow_cmd(uid: str = None) -> str:
+        """
+        读取流量累计值的命令
+        :param uid: 应用用户ID，为空则读取整机(除lo外所有网卡)流量
+        """
+        if not uid:
+            return 'cat /proc/net/dev'
+        # 优先使用 xt_qtaguid (Android 9及以下)，不存在时使用旧内核的 uid_stat
+        return (f'if [ -e /proc/net/xt_qtaguid/stats ]; then grep " {uid} " /proc/net/xt_qtaguid/stats; '
+                f'else echo "uid_stat $(cat /proc/uid_stat/{uid}/tcp_rcv) $(cat /proc/uid_stat/{uid}/tcp_snd)"; fi')
+
+    @staticmethod
+    def _parse_net_flow(rs: str, uid: str = None) -> NetFlow:
+        rx, tx = 0, 0
+        for x in rs.split('\n'):
+            m = x.split()
+            if not m:
+                continue
+            if not uid:
+                # /proc/net/dev: `网卡: rx_bytes ... (8列) tx_bytes ...`
+                if m[0].find(':') == -1 or m[0].startswith('lo:'):
+                    continue
+                m = ' '.join(m).replace(':', ' ', 1).split()
+                rx += int(m[1])
+                tx += int(m[9])
+            elif m[0] == 'uid_stat':
+                if len(m) != 3 or not m[1].isdigit() or not m[2].isdigit():
+                    raise EnvironmentError(f'设备不支持按应用读取流量: {rs}')
+                rx += int(m[1])
+                tx += int(m[2])
+            elif len(m) > 7 and m[3] == uid and m[2] == '0x0':
+                # xt_qtaguid: idx iface acct_tag_hex uid_tag_int cnt_set rx_bytes rx_packets tx_bytes ...
+                # 带socket标签(acct_tag_hex不为0x0)的行是重复统计，忽略
+                rx += int(m[5])
+                tx += int(m[7])
+        return NetFlow(rx, tx)
+
     def cat_file(self, file_path):
         return self.run_shell(f'cat {file_path}')
 
@@ -386,22 +960,162 @@ class AdbBase(AdbInterface):
         return rs.rfind('1 received') != -1
 
 
+class ShellSession:
+    """
+    常驻shell会话
+    在设备上保持一个shell进程，每条命令后追加带唯一标记的结束行(包含退出码)，以此从连续输出中拆分出每条命令的结果
+    每条命令在独立的子shell中执行，命令之间不共享工作目录、环境变量等状态
+    避免每条命令都新建 shell 服务并在设备端重新创建sh进程的开销，多条命令可一次性写入(流水线)
+    """
+
+    def __init__(self, opener: Callable[[], ShellChannel], max_retries: int = 1):
+        """
+        :param opener: 打开新通道的方法，例如 AdbInterface.open_shell_channel
+        :param max_retries: 通道断开时重连的次数，已完成的命令不会重新执行
+        """
+        self.opener = opener
+        self.max_retries = max_retries
+        self._channel = None
+        self._mark = f'#ui_auto#{uuid.uuid4().hex[:8]}-'.encode('utf-8')
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _build_script(self, cmds: list) -> (bytes, list):
+        script = []
+        tokens = []
+        for cmd in cmds:
+            self._seq += 1
+            token = self._mark + str(self._seq).encode('utf-8') + b':'
+            tokens.append(token)
+            # 在子shell中执行，cd/export/exit 等不会影响会话及后续命令，与单独执行 run_shell 一致；
+            # 使用 </dev/null 避免命令读取标准输入时吞掉后续命令
+            script.append(f"( {cmd}\n) </dev/null 2>&1; printf '\\n%s%d\\n' '{token.decode('utf-8')}' $?\n")
+        return ''.join(script).encode('utf-8'), tokens
+
+    def _read_results(self, tokens: list, out: list):
+        """
+        按顺序读取命令结果并追加到 out，出错时 out 中保留已完成的命令结果
+        """
+        buf = bytearray()
+        start = 0
+        for token in tokens:
+            while True:
+                i = buf.find(b'\n' + token, start)
+                j = buf.find(b'\n', i + len(token) + 1) if i != -1 else -1
+                if j != -1:
+                    break
+                d = self._channel.read()
+                if not d:
+                    raise EOFError('Shell session closed')
+                buf += d
+            out.append((bytes(buf[start:i]).decode('utf-8', 'replace'), int(buf[i + len(token) + 1:j])))
+            start = j + 1
+
+    def run_many(self, cmds: list) -> list:
+        """
+        一次性写入多条命令并按顺序返回结果
+        通道断开时重连，从第一条未返回结束标记的命令继续执行，已完成的命令不会重复执行；
+        读取超时不会重试(命令可能仍在执行)
+        :param cmds: 命令列表
+        :return: [(输出内容, 退出码)]
+        """
+        if not cmds:
+            return []
+        with self._lock:
+            out = []
+            retries = self.max_retries
+            while True:
+                try:
+                    if self._channel is None:
+                        self._channel = self.opener()
+                    script, tokens = self._build_script(cmds[len(out):])
+                    self._channel.write(script)
+                    self._read_results(tokens, out)
+                    return out
+                except TimeoutError:
+                    self._close_channel()
+                    raise
+                except Exception as e:
+                    self._close_channel()
+                    if retries <= 0:
+                        raise
+                    retries -= 1
+                    logging.warning(f'reconnect shell session on error: {e}, '
+                                    f'resume from command {len(out) + 1}/{len(cmds)}')
+
+    def run(self, cmd: str) -> (str, int):
+        """
+        :return: (输出内容, 退出码)
+        """
+        return self.run_many([cmd])[0]
+
+    def _close_channel(self):
+        if self._channel is not None:
+            c, self._channel = self._channel, None
+            try:
+                c.close()
+            except Exception as e:
+                logging.debug(f'close shell channel error: {e}')
+
+    def close(self):
+        with self._lock:
+            self._close_channel()
+
+
 class AdbProxy(AdbBase):
-    # ADB 代理，用于衔接adb协议的不同底层实现
+    # ADB 代理，用于衔接adb协议的不同底层实现；可在多个线程中同时使用，stream_shell 与 run_shell 使用不同的数据流
 
-    def __init__(self, adb_implement: AdbInterface):
+    def __init__(self, adb_implement: AdbInterface, persistent_shell=False):
+        """
+        :param adb_implement: 底层实现
+        :param persistent_shell: 是否启用常驻shell会话执行 run_shell，参考 ShellSession
+        """
         self._impl = adb_implement
+        self._session = None
+        self._session_lock = threading.Lock()
+        if persistent_shell:
+            self.enable_persistent_shell()
+
+    def enable_persistent_shell(self, max_retries: int = 1):
+        with self._session_lock:
+            if self._session is None:
+                self._session = ShellSession(self._impl.open_shell_channel, max_retries=max_retries)
+
+    def disable_persistent_shell(self):
+        with self._session_lock:
+            s, self._session = self._session, None
+        if s is not None:
+            s.close()
 
     def get_device_serial(self) -> str:
         return self._impl.get_device_serial()
 
     def run_shell(self, cmd: str, clean_wrap=False) -> str:
-        return self._impl.run_shell(cmd, clean_wrap=clean_wrap)
+        session = self._session
+        if session is None:
+            return self._impl.run_shell(cmd, clean_wrap=clean_wrap)
+        rs = session.run(cmd)[0]
+        if clean_wrap:
+            rs = rs.strip()
+        return rs
+
+    def run_shells(self, cmds: list, clean_wrap=False) -> list:
+        session = self._session
+        if session is None:
+            return super().run_shells(cmds, clean_wrap)
+        rs = [x[0] for x in session.run_many(cmds)]
+        if clean_wrap:
+            rs = [x.strip() for x in rs]
+        return rs
+
+    def open_shell_channel(self) -> ShellChannel:
+        return self._impl.open_shell_channel()
 
-    def stream_shell(self, cmd: str) -> types.GeneratorType:
-        return self._impl.stream_shell(cmd)
+    def stream_shell(self, cmd: str, binary=False) -> types.GeneratorType:
+        return self._impl.stream_shell(cmd, binary=binary)
 
     def close(self):
+        self.disable_persistent_shell()
         return self._impl.close()
 
     def add_app(self, apk_path):
@@ -1,10 +1,15 @@
 # coding=utf8
 from logging import getLogger
+import queue
+import threading
 import time
+import types
 from urllib.parse import urlencode
 
 from .my_adb import AdbProxy as _AdbProxy
 from .app_info import AppInfo
+from .metric_series import MetricSeries
+from .net_traffic import NetTrafficSampler
 
 logging = getLogger(__name__)
 
@@ -128,15 +133,132 @@ class AdbProxy(_AdbProxy):
         except:
             pass
         self.start_tools_app()
-        while True:
-            if self.find_processes(self.TOOLS_APP.pkg):
-                break
-            time.sleep(0.1)
+        self.wait_for_process(self.TOOLS_APP.pkg)
         self.start_statistics_net_traffic(app, save2file)
 
     def read_current_net_traffic(self, save2file: str = NET_TRAFFIC_LOG_PATH) -> list:
         return self.format_net_traffic_log(self.cat_file(save2file))
 
+    def read_net_traffic_from(self, offset: int = 0, save2file: str = NET_TRAFFIC_LOG_PATH) -> (list, int):
+        """
+        从日志文件的指定字节偏移开始，只读取新增的流量记录
+        :param offset: 上次读取返回的偏移，首次为0；日志文件变小(被重新创建)时从头读取
+        :param save2file: 流量日志文件
+        :return: ([{second: x, down: n, up: n}, ...], 新的偏移)，未写完整的最后一行留到下次读取
+        """
+        return self._read_net_traffic(offset, None, save2file)[:2]
+
+    def _read_net_traffic(self, offset: int, inode: str, save2file: str) -> (list, int, str):
+        """
+        参考 read_net_traffic_from，同时比较日志文件的 inode，文件变小或 inode 变化时从头读取
+        在设备端计算新增数据中完整行的字节数，只读取完整的行，偏移不受解码、换行符转换的影响
+        :return: (记录列表, 新的偏移, 日志文件的 inode)
+        """
+        rs = self.run_shell(
+            f'f={save2file}; o={offset}; '
+            'if s=$(stat -c "%i %s" $f 2>/dev/null); then set -- $s; d=$(($2 - o)); c=0; '
+            'if [ $d -gt 0 ]; then c=$(tail -c +$((o + 1)) $f | head -c $d | tail -n 1 | wc -c); '
+            '[ "$(tail -c +$((o + 1)) $f | head -c $d | tail -c 1 | wc -l)" -eq 1 ] && c=$d || c=$((d - c)); fi; '
+            'echo "$1 $2 $c"; [ $c -gt 0 ] && tail -c +$((o + 1)) $f | head -c $c; else echo -; fi')
+        st, _, rs = rs.partition('\n')
+        st = st.split()
+        if len(st) != 3 or not st[1].isdigit() or not st[2].isdigit():
+            # 日志文件尚未创建
+            return [], offset, inode
+        if offset and ((inode is not None and st[0] != inode) or int(st[1]) < offset):
+            logging.info(f'{save2file} is recreated, read from the beginning')
+            return self._read_net_traffic(0, st[0], save2file)
+        return self._parse_net_traffic_lines(rs.split('\n')), offset + int(st[2]), st[0]
+
+    def _parse_net_traffic_lines(self, lines) -> list:
+        """
+        增量读取时逐行解析，跳过无法解析的行(例如文件被重新创建时拼接到一起的半行)
+        """
+        out = []
+        for x in lines:
+            try:
+                out.extend(self.format_net_traffic_log(x))
+            except (ValueError, IndexError):
+                logging.warning(f'Bad net traffic line: {x!r}')
+        return out
+
+    def iter_net_traffic(self, save2file: str = NET_TRAFFIC_LOG_PATH, interval: float = 1.0,
+                         stop_event: threading.Event = None, follow=False) -> types.GeneratorType:
+        """
+        增量读取流量日志，每次返回一条新的记录，每次轮询的开销只与新增数据量有关
+        日志文件被重新创建(变小或 inode 变化)时从头读取
+        :param save2file: 流量日志文件
+        :param interval: 轮询间隔，秒
+        :param stop_event: 可选，设置后读取完当前数据即停止
+        :param follow: 是否通过 stream_shell 执行 `tail -F` 实时读取，而不是轮询
+        :return: {second: x, down: n, up: n} 迭代
+        """
+        if follow:
+            yield from self._follow_net_traffic(save2file, interval, stop_event)
+            return
+        offset = 0
+        inode = None
+        while True:
+            stopped = stop_event and stop_event.is_set()
+            records, offset, inode = self._read_net_traffic(offset, inode, save2file)
+            for r in records:
+                yield r
+            if stopped:
+                break
+            time.sleep(interval)
+
+    def _follow_net_traffic(self, save2file: str, interval: float,
+                            stop_event: threading.Event = None) -> types.GeneratorType:
+        """
+        在后台线程中读取 `tail -F` 的输出，每个轮询间隔检查一次 stop_event；停止时结束设备上的 tail 进程
+        """
+        mark = '#tail_pid#'
+        lines = queue.Queue()
+        stream = self.stream_shell(f'tail -c +1 -F {save2file} 2>/dev/null & echo "{mark}$!"; wait')
+
+        def read():
+            try:
+                for x in stream:
+                    lines.put(x)
+            except Exception as e:
+                lines.put(e)
+            finally:
+                lines.put(None)
+
+        threading.Thread(target=read, name=f'NetTraffic-{self.get_device_serial()}', daemon=True).start()
+        pid = None
+        try:
+            while not (stop_event and stop_event.is_set()):
+                try:
+                    x = lines.get(timeout=interval)
+                except queue.Empty:
+                    continue
+                if x is None:
+                    break
+                if isinstance(x, Exception):
+                    raise x
+                if pid is None and x.startswith(mark):
+                    pid = x[len(mark):].strip()
+                    continue
+                # stream_shell 只返回完整的行，流结束时剩余的半行无法解析则被跳过
+                for r in self._parse_net_traffic_lines([x]):
+                    yield r
+        finally:
+            end = time.time() + interval
+            while pid is None and time.time() < end:
+                # 停止时尚未读到 tail 的进程ID
+                try:
+                    x = lines.get(timeout=max(end - time.time(), 0))
+                except queue.Empty:
+                    break
+                if x is None or isinstance(x, Exception):
+                    break
+                if x.startswith(mark):
+                    pid = x[len(mark):].strip()
+            if pid:
+                # 结束 tail 后输出流随之关闭，读取线程退出
+                self.run_shell(f'kill {pid}')
+
     def finish_statistics_net_traffic(self, save2file: str = NET_TRAFFIC_LOG_PATH) -> str:
         self.stop_statistics_net_traffic()
         time.sleep(0.1)
@@ -164,6 +286,23 @@ class AdbProxy(_AdbProxy):
             out.append(dict(second=int(info[0]), down=int(info[1]), up=int(info[2])))
         return out
 
+    @staticmethod
+    def net_traffic_log_to_series(s: str, series: MetricSeries, device: str = '', start_time: float = 0):
+        """
+        将流量日志直接写入 MetricSeries，不生成中间字典
+        :param s: 流量日志
+        :param series: 目标存储，指标名为 network_down、network_up
+        :param device: 设备号
+        :param start_time: 第0秒对应的时间戳
+        """
+        for x in s.split('\n'):
+            if not x:
+                continue
+            info = x.split('\t')
+            t = start_time + int(info[0])
+            series.append(t, int(info[1]), 'network_down', device)
+            series.append(t, int(info[2]), 'network_up', device)
+
     def _sync_net_traffic_statistics(self, app: AppInfo, wait_seconds=10) -> str:
         """
         自动完成一次目标App的流量采集，过程包括启动监测工具，目标App，关闭监测工具，关闭目标App
@@ -182,26 +321,37 @@ class AdbProxy(_AdbProxy):
         self.kill_by_app(app)
         return rs
 
-    def sync_net_traffic_statistics(self, app: AppInfo, wait_seconds=10) -> list:
+    def sample_net_traffic_statistics(self, app: AppInfo, wait_seconds=10, series: MetricSeries = None) -> list:
+        """
+        不依赖测试工具App，直接按应用用户ID读取内核流量统计，过程包括启动目标App，采样，关闭目标App
+        参考 NetTrafficSampler，Android 10 及以上系统不支持
+        :return: [{second: x, down: n, up: n}, ...]
+        """
+        sampler = NetTrafficSampler(self, app.pkg)
+        self.kill_by_app(app)
+        try:
+            return sampler.collect(wait_seconds, series, self.get_device_serial(), lambda: self.start_app(app))
+        finally:
+            self.kill_by_app(app)
+
+    def sync_net_traffic_statistics(self, app: AppInfo, wait_seconds=10, series: MetricSeries = None,
+                                    use_tools_app=True) -> list:
         """
         返回流量统计，单位：字节
         :param app: 目标监听App信息
         :param wait_seconds: 抓取时长，秒
+        :param series: 可选，结果将同时写入该存储(以开始抓取的时间为第0秒)
+        :param use_tools_app: 是否通过测试工具App统计，否则使用 sample_net_traffic_statistics
         :return: [{second: x, down: n, up: n}, ...]
         """
+        if not use_tools_app:
+            return self.sample_net_traffic_statistics(app, wait_seconds, series)
+        start_time = time.time()
         rs = self._sync_net_traffic_statistics(app, wait_seconds)
+        if series is not None:
+            self.net_traffic_log_to_series(rs, series, self.get_device_serial(), int(start_time))
         return self.format_net_traffic_log(rs)
 
-    def get_memory_by_app_processes(self, process_id_list: list) -> float:
-        try:
-            return super().get_memory_by_app_processes(process_id_list)
-        except ValueError as e:
-            if str(e).index('Matching `TOTAL PSS` failed') != -1:
-                logging.warning('Retrying to get memory by app processes!')
-                time.sleep(0.01)
-                return self.get_memory_by_app_processes(process_id_list)
-            raise e
-
     def close(self, kill_tools=True):
         if kill_tools:
             self.kill_tools_app()
@@ -1,13 +1,18 @@
 # coding=utf8
 import logging
 import time
-from typing import Optional
+import threading
+from typing import Optional, Union
 from requests.exceptions import HTTPError
 
 import tidevice
 from tidevice._proto import MODELS
 from tidevice._perf import DataType, CallbackType
 
+from .device_pool import DevicePool
+from .metric_series import MetricSeries
+from .perf_pipeline import OutlierFilter, PerfPipeline
+
 
 class IOSDevice(object):
     os_version = None
@@ -24,11 +29,24 @@ class TiDevice(object):
                        DataType.SCREENSHOT, DataType.GPU]
     PERFORMANCE_DEFAULT = [DataType.CPU, DataType.MEMORY, DataType.NETWORK]
 
-    def __init__(self):
+    def __init__(self, udid: str = None, usbmux: Union[tidevice.Usbmux, str, tuple, None] = None):
+        """
+        :param udid: 设备ID，为空时连接第一台设备
+        :param usbmux: 共享的 tidevice.Usbmux 或 usbmuxd 地址，默认为系统的 usbmuxd
+        """
         try:
-            self.device = tidevice.Device()
+            if isinstance(usbmux, tuple):
+                usbmux = tidevice.Usbmux(usbmux)
+            self.device = tidevice.Device(udid, usbmux)
+            # 在此处向 usbmuxd 确认设备已连接(不指定设备ID时确定第一台设备)，保证失败时 device 为None
+            self.device.info
         except Exception as e:
             logging.error(f'连接设备失败，可现尝试使用iTunes连接: {e}')
+            self.device = None
+
+    @property
+    def udid(self) -> str:
+        return self.device.udid if self.device else None
 
     def check_auth(self) -> bool:
         try:
@@ -86,84 +104,155 @@ and copy it into `$HOME/.tidevice/device-support`''')
         perf.start(bundle_id=bundle_id, callback=callback)
         return perf
 
-    def sync_performance(self, bundle_id: str, listen_seconds: int, *targets: PERFORMANCE_DATA) -> dict:
+    # 网络流量有一些诡异大波动, 忽略大于10M的 (流量单位KB)；流量按秒求和，替换为0时该秒仍有记录
+    NETWORK_OUTLIER_FILTER = OutlierFilter(('network_down', 'network_up'), 10 * 1024, replace_with=0)
+
+    def _perf_points(self, data_type, value) -> list:
+        """
+        将tidevice回调数据转换为 [(指标名, 时间戳秒, 值)]
+        """
+        t = value.get('timestamp', 0) / 1000
+        if data_type == self.PERFORMANCE_DATA.NETWORK:
+            return [('network_down', t, value['downFlow']), ('network_up', t, value['upFlow'])]
+        if data_type == self.PERFORMANCE_DATA.CPU:
+            return [('cpu', t, value['value']), ('cpu_sys', t, value['sys_value'])]
+        if data_type == self.PERFORMANCE_DATA.MEMORY:
+            return [('memory', t, value['value'])]
+        logging.warning(f'Unhandled dataType:{data_type}')
+        return []
+
+    def stream_performance(self, bundle_id: str, *targets: PERFORMANCE_DATA, sinks: list = None,
+                           stages: list = None, window: float = 1.0, capacity: int = 4096) -> PerfPipeline:
+        """
+        流式获取性能数据，回调线程只负责写入有界缓冲区，聚合与输出在流水线的处理线程中进行，结果可实时获取
+        多台设备可各自创建流水线，共享同一个输出(例如 SeriesSink)
+        :param bundle_id: 包名
+        :param targets: 指定获取目标性能类型
+        :param sinks: 每个聚合窗口的输出，func(PerfWindow)
+        :param stages: 处理阶段，默认为 [NETWORK_OUTLIER_FILTER]
+        :param window: 聚合窗口秒数
+        :param capacity: 缓冲区容量
+        :return: 已启动的 PerfPipeline，调用其stop方法以停止监听
+        """
+        pipeline = PerfPipeline(self.device.udid, [self.NETWORK_OUTLIER_FILTER] if stages is None else stages,
+                                sinks, window, capacity=capacity)
+
+        def callback(data_type, value):
+            for x in self._perf_points(data_type, value):
+                pipeline.push(*x)
+
+        pipeline.start()
+        try:
+            perf = self.performance(bundle_id, callback, *targets)
+        except Exception:
+            pipeline.stop()
+            raise
+        pipeline.on_stop(perf.stop)
+        return pipeline
+
+    def sync_performance(self, bundle_id: str, listen_seconds: int, *targets: PERFORMANCE_DATA,
+                         series: MetricSeries = None, sinks: list = None) -> dict:
         """
         同步获取性能数据
         :param bundle_id: 包名
         :param listen_seconds: 监听的秒数
         :param targets: 指定获取目标性能类型
+        :param series: 可选，原始采样数据将同时写入该存储(设备号为udid)，指标名与返回结果的键一致
+        :param sinks: 可选，监听过程中实时输出每秒的聚合结果，参考 stream_performance
         :return: 返回数据字典
         """
-        dm = {}
-
-        def callback(data_type, value):
-            # 将各类数据按每1秒进行聚合
-            dm.setdefault(data_type, {})
-            xd = dm.get(data_type)
-            if data_type == self.PERFORMANCE_DATA.NETWORK:
-                t = int(value['timestamp'] / 1000)
-                xd.setdefault(t, dict(downFlow=0, upFlow=0))
-                v = xd[t]
-                vt = value['downFlow']
-                if vt / 1024 < 10:  # 有一些诡异大波动, 忽略大于10M的
-                    v['downFlow'] += vt
-                vt = value['upFlow']
-                if vt / 1024 < 10:
-                    v['upFlow'] += vt
-            elif data_type == self.PERFORMANCE_DATA.CPU:
-                t = int(value['timestamp'] / 1000)
-                xd.setdefault(t, dict(value=0, sys=0))
-                v = xd[t]
-                v['value'] += value['value']
-                v['sys'] += value['sys_value']
-            elif data_type == self.PERFORMANCE_DATA.MEMORY:
-                t = int(value['timestamp'] / 1000)
-                xd.setdefault(t, 0)
-                xd[t] += value['value']
-            else:
-                logging.warning(f'Unhandled dataType:{data_type}')
-
-        perf = self.performance(bundle_id, callback, *targets)
+        pipeline = self.stream_performance(bundle_id, *targets, sinks=sinks)
         self.launch_app(bundle_id, kill_running=True)
         time.sleep(listen_seconds)
-        perf.stop()
+        pipeline.stop()
         self.kill_app(bundle_id)
+        ms = pipeline.raw
         rs = {}
-        for k, _v in dm.items():
-            if k == self.PERFORMANCE_DATA.NETWORK:
-                du = dict(timestamp=[], value=[])
-                dd = dict(timestamp=[], value=[])
-                rs['network_up'] = du
-                rs['network_down'] = dd
-                for _t, j in _v.items():
-                    du['timestamp'].append(_t)
-                    dd['timestamp'].append(_t)
-                    du['value'].append(j['upFlow'])
-                    dd['value'].append(j['downFlow'])
-            elif k == self.PERFORMANCE_DATA.CPU:
-                du = dict(timestamp=[], value=[])
-                ds = dict(timestamp=[], value=[])
-                rs['cpu'] = du
-                rs['cpu_sys'] = ds
-                for _t, j in _v.items():
-                    du['timestamp'].append(_t)
-                    ds['timestamp'].append(_t)
-                    du['value'].append(j['value'])
-                    ds['value'].append(j['sys'])
+        for k in ms.metrics:
+            # 将各类数据按每1秒进行聚合
+            ts, vs = ms.aggregate_by_second(k)
+            if k in ('cpu', 'cpu_sys'):
                 # 第一个值较异常，忽略掉
-                du['timestamp'] = du['timestamp'][1:]
-                ds['timestamp'] = ds['timestamp'][1:]
-                du['value'] = du['value'][1:]
-                ds['value'] = ds['value'][1:]
-            elif k == self.PERFORMANCE_DATA.MEMORY:
-                du = dict(timestamp=[], value=[])
-                rs['memory'] = du
-                for _t, j in _v.items():
-                    du['timestamp'].append(_t)
-                    du['value'].append(j)
-            else:
-                logging.warning(f'Unhandled Format dataType:{k}')
+                ts, vs = ts[1:], vs[1:]
+            rs[k] = dict(timestamp=ts, value=vs)
+        if series is not None:
+            for i in range(len(ms)):
+                series.append(ms.timestamp[i], ms.value[i], ms.metrics[ms.metric[i]], ms.devices[ms.device[i]])
         return rs
 
     def close(self):
         pass
+
+
+class TiDevicePool(DevicePool):
+    """
+    多台iOS设备的调度池，参考 DevicePool
+    所有设备共享同一个 Usbmux，每台设备只连接一次(在自己的工作线程中)并复用，单台设备连接或执行失败不影响其他设备
+    """
+
+    def __init__(self, udids: list = None, usbmux: Union[tidevice.Usbmux, str, tuple, None] = None,
+                 device_class: type = None, queue_size: int = 16):
+        """
+        :param udids: 设备ID列表，默认通过 usbmux 获取全部已连接的设备
+        :param usbmux: tidevice.Usbmux 或 usbmuxd 地址(unix socket 路径 或 (ip, port))，默认为系统的 usbmuxd
+        :param device_class: TiDevice 或其子类
+        :param queue_size: 每台设备的任务队列长度
+        """
+        self.usbmux = usbmux if isinstance(usbmux, tidevice.Usbmux) else tidevice.Usbmux(usbmux)
+        self.device_class = device_class or TiDevice
+        self._series_lock = threading.Lock()
+        super().__init__(udids if udids is not None else self.discover_udids(), self._open_device, None,
+                         queue_size)
+
+    @property
+    def udids(self) -> list:
+        return self.serials
+
+    def discover_udids(self) -> list:
+        return self.usbmux.device_udid_list()
+
+    def _open_device(self, udid: str) -> TiDevice:
+        d = self.device_class(udid, self.usbmux)
+        if d.device is None:
+            raise ConnectionError(f'Connect to device {udid} failed')
+        return d
+
+    def refresh(self) -> list:
+        """
+        按 usbmux 当前的设备列表添加新设备、移除已断开的设备
+        :return: 当前设备ID列表
+        """
+        attached = self.discover_udids()
+        for u in attached:
+            self.add_device(u)
+        for u in set(self.serials) - set(attached):
+            self.remove_device(u)
+        return self.serials
+
+    def sync_performance_all(self, bundle_id: str, listen_seconds: int, *targets: TiDevice.PERFORMANCE_DATA,
+                             series: MetricSeries = None, sinks: list = None) -> dict:
+        """
+        在所有设备上同时执行 TiDevice.sync_performance
+        :param series: 可选，所有设备的原始采样数据将写入该存储，设备号为udid
+        :param sinks: 可选，所有设备共享的实时输出，需要自行保证线程安全(例如 SeriesSink)
+        :return: {设备ID: sync_performance 结果或异常}
+        """
+        def job(d: TiDevice):
+            ms = None if series is None else MetricSeries()
+            rs = d.sync_performance(bundle_id, listen_seconds, *targets, series=ms, sinks=sinks)
+            if ms is not None:
+                with self._series_lock:
+                    for i in range(len(ms)):
+                        series.append(ms.timestamp[i], ms.value[i], ms.metrics[ms.metric[i]], ms.devices[ms.device[i]])
+            return rs
+
+        return self.run_all(job)
+
+    def stream_performance_all(self, bundle_id: str, *targets: TiDevice.PERFORMANCE_DATA, sinks: list = None,
+                               **kv) -> dict:
+        """
+        在所有设备上启动 TiDevice.stream_performance
+        :param kv: 参考 TiDevice.stream_performance
+        :return: {设备ID: PerfPipeline 或异常}，请对成功的 PerfPipeline 调用stop方法
+        """
+        return self.run_all(lambda d: d.stream_performance(bundle_id, *targets, sinks=sinks, **kv))
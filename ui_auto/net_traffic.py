@@ -0,0 +1,148 @@
+# coding=utf8
+import threading
+import time
+import types
+from logging import getLogger
+from typing import Callable
+
+from .my_adb import AdbBase, NetFlow
+from .metric_series import MetricSeries
+
+logging = getLogger(__name__)
+
+
+class NetTrafficSample:
+    def __init__(self, device_time: float, net: NetFlow, sockets: dict):
+        """
+        :param device_time: 设备开机至今的秒数(/proc/uptime)
+        :param net: 该应用的累计流量
+        :param sockets: {tcp|tcp6|udp|udp6: 该应用当前打开的socket数}
+        """
+        self.device_time = device_time
+        self.net = net
+        self.sockets = sockets
+
+    def __str__(self):
+        ss = ', '.join(f'{k}: {v}' for k, v in self.sockets.items())
+        return f'[{self.device_time:.2f}s] {self.net} Sockets({ss})'
+
+
+class NetTrafficSampler:
+    """
+    不依赖测试工具App的应用流量采集
+    按应用用户ID读取 /proc/net/xt_qtaguid/stats (或 /proc/uid_stat) 的累计值，以及 /proc/net/tcp 等文件中的socket，
+    每次采样只执行一条shell命令，相邻两次采样的差值即为该时间段的上下行流量
+    注意：Android 10 及以上的系统已移除 xt_qtaguid 与 uid_stat，此时采样会抛出 EnvironmentError
+    """
+
+    def __init__(self, adb: AdbBase, app_bundle: str = None, uid: str = None, interval: float = 1.0):
+        """
+        :param adb: 目标设备
+        :param app_bundle: 应用包名，与 uid 二选一
+        :param uid: 应用用户ID(参考 get_app_user_id)
+        :param interval: 采样间隔，秒
+        """
+        if not uid:
+            if not app_bundle:
+                raise ValueError('app_bundle or uid is required')
+            uid = adb.get_app_user_id(app_bundle)
+        self.adb = adb
+        self.uid = str(uid)
+        self.interval = interval
+        self._cmd = None
+
+    def _build_cmd(self) -> str:
+        a = self.adb
+        cmd = [a._echo_section('uptime'), 'cat /proc/uptime',
+               a._echo_section('net'), a._net_flow_cmd(self.uid)]
+        for f in a._net_files:
+            cmd.append(a._echo_section(f))
+            cmd.append(a._net_sockets_cmd(self.uid, f))
+        return '; '.join(cmd)
+
+    def sample(self) -> NetTrafficSample:
+        """
+        采样一次
+        """
+        if self._cmd is None:
+            self._cmd = self._build_cmd()
+        a = self.adb
+        ss = a._split_sections(a.run_shell(self._cmd))
+        return NetTrafficSample(
+            float(ss['uptime'].split()[0]),
+            a._parse_net_flow(ss['net'], self.uid),
+            {f: len(a._parse_net_sockets(ss.get(f, ''), self.uid)) for f in a._net_files}
+        )
+
+    def iter_samples(self, stop_event: threading.Event = None) -> types.GeneratorType:
+        """
+        按采样间隔持续采样，每次返回一个 NetTrafficSample
+        :param stop_event: 可选，设置后停止
+        """
+        next_time = time.time()
+        while not (stop_event and stop_event.is_set()):
+            yield self.sample()
+            next_time += self.interval
+            delay = next_time - time.time()
+            if delay > 0:
+                if stop_event:
+                    stop_event.wait(delay)
+                else:
+                    time.sleep(delay)
+            else:
+                # 采样耗时超过间隔，不追赶
+                next_time = time.time()
+
+    def __iter__(self) -> types.GeneratorType:
+        """
+        :return: {second: x, down: n, up: n} 迭代，与 AdbProxy.format_net_traffic_log 的格式一致
+        second 为距第一次采样的设备秒数，down、up 为与上一次采样之间的字节数
+        """
+        return self.iter_traffic()
+
+    def iter_traffic(self, stop_event: threading.Event = None, on_start: Callable = None) -> types.GeneratorType:
+        """
+        :param stop_event: 可选，设置后停止
+        :param on_start: 可选，第一次采样(基准值)完成后调用，例如在此启动目标App以统计其启动流量
+        """
+        first = last = None
+        for s in self.iter_samples(stop_event):
+            if first is None:
+                first = last = s
+                if on_start:
+                    on_start()
+                continue
+            yield self._delta(first, last, s)
+            last = s
+
+    @staticmethod
+    def _delta(first: NetTrafficSample, last: NetTrafficSample, cur: NetTrafficSample) -> dict:
+        down = cur.net.rx - last.net.rx
+        up = cur.net.tx - last.net.tx
+        # 计数器被重置(例如网卡重建)时，以重置后的值作为增量
+        return dict(second=int(round(cur.device_time - first.device_time)),
+                    down=down if down >= 0 else cur.net.rx,
+                    up=up if up >= 0 else cur.net.tx)
+
+    def collect(self, seconds: float, series: MetricSeries = None, device: str = '',
+                on_start: Callable = None) -> list:
+        """
+        采集指定时长的流量
+        :param seconds: 采集时长，秒
+        :param series: 可选，结果将同时写入该存储，指标名为 network_down、network_up
+        :param device: 写入 series 时的设备号
+        :param on_start: 参考 iter_traffic
+        :return: [{second: x, down: n, up: n}, ...]
+        """
+        out = []
+        start_time = time.time()
+        end_time = start_time + seconds
+        for r in self.iter_traffic(on_start=on_start):
+            out.append(r)
+            if series is not None:
+                t = int(start_time) + r['second']
+                series.append(t, r['down'], 'network_down', device)
+                series.append(t, r['up'], 'network_up', device)
+            if time.time() >= end_time:
+                break
+        return out
@@ -0,0 +1,242 @@
+# coding=utf8
+import threading
+from collections import deque
+from logging import getLogger
+from typing import Callable
+
+from .metric_series import MetricSeries
+
+logging = getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    有界环形缓冲区，写入永不阻塞，写满时丢弃最旧的数据
+    用于在采集回调线程与处理线程之间传递数据，避免处理变慢时拖住采集方
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.dropped = 0
+        self._items = deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def push(self, item):
+        with self._cond:
+            if len(self._items) == self.capacity:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def pop_all(self, timeout: float = None) -> list:
+        """
+        取出当前全部数据，缓冲区为空时最多等待 timeout 秒
+        :return: 数据列表，关闭且已取空时返回空列表
+        """
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            rs = list(self._items)
+            self._items.clear()
+            return rs
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class OutlierFilter:
+    """
+    处理阶段：超过上限的值视为异常波动，默认丢弃该点；指定 replace_with 时替换为该值
+    """
+
+    def __init__(self, metrics: tuple, max_value: float, replace_with: float = None):
+        """
+        :param metrics: 需要过滤的指标名
+        :param max_value: 上限，不包含
+        :param replace_with: 替换值，为None则丢弃该点；注意替换为0会拉低 mean 等聚合结果
+        """
+        self.metrics = frozenset(metrics)
+        self.max_value = max_value
+        self.replace_with = replace_with
+
+    def __call__(self, metric: str, timestamp: float, value: float):
+        if metric in self.metrics and value >= self.max_value:
+            return self.replace_with
+        return value
+
+
+class PerfWindow:
+    def __init__(self, start: float, size: float, device: str, values: dict):
+        """
+        :param start: 窗口起始时间戳
+        :param size: 窗口秒数
+        :param device: 设备号
+        :param values: {指标名: 窗口内的聚合值}
+        """
+        self.start = start
+        self.size = size
+        self.device = device
+        self.values = values
+
+    def __str__(self):
+        vs = ', '.join(f'{k}: {v:.2f}' for k, v in self.values.items())
+        return f'[{self.device}][{self.start:.0f}] {vs}'
+
+
+class SeriesSink:
+    """
+    将窗口聚合值写入 MetricSeries，可被多个设备的流水线共享
+    """
+
+    def __init__(self, series: MetricSeries):
+        self.series = series
+        self._lock = threading.Lock()
+
+    def __call__(self, window: PerfWindow):
+        with self._lock:
+            for k, v in window.values.items():
+                self.series.append(window.start, v, k, window.device)
+
+
+class PerfPipeline:
+    """
+    性能数据流水线: 采集回调 -> 有界缓冲区 -> 处理线程(处理阶段 -> 按窗口聚合) -> 输出
+    push 可在任意线程中调用且开销很小；处理阶段与输出(sinks)都在处理线程中执行
+    一个窗口在收到晚于其结束时间 lateness 个窗口的数据后输出，停止时输出全部剩余窗口
+    属于已输出窗口的迟到数据不再参与窗口聚合(计入 late)，但仍会写入 raw
+    """
+
+    def __init__(self, device: str = '', stages: list = None, sinks: list = None, window: float = 1.0,
+                 how: dict = None, lateness: int = 1, rolling: int = 60, capacity: int = 4096):
+        """
+        :param device: 设备号
+        :param stages: 处理阶段列表，每个阶段为 func(metric, timestamp, value) -> 新的值，返回None则丢弃该点
+        :param sinks: 输出列表，每个输出为 func(PerfWindow)；多台设备共享同一个输出时需要自行保证线程安全
+        :param window: 聚合窗口秒数
+        :param how: {指标名: 聚合方式}，参考 MetricSeries.AGGREGATES，默认为 sum
+        :param lateness: 允许乱序的窗口数
+        :param rolling: 保留最近的窗口数，参考 windows
+        :param capacity: 缓冲区容量，超出时丢弃最旧的数据
+        """
+        self.device = device
+        self.stages = list(stages or [])
+        self.sinks = list(sinks or [])
+        self.window = window
+        self.how = how or {}
+        self.lateness = lateness
+        # 经过处理阶段的原始数据，只在处理线程中写入，停止后可安全读取
+        self.raw = MetricSeries()
+        self._windows = deque(maxlen=rolling)
+        self._buffer = RingBuffer(capacity)
+        self._pending = {}
+        # 已输出的最大窗口编号，属于该窗口及之前窗口的数据不再参与聚合
+        self._emitted_upto = None
+        # 因迟到而未参与窗口聚合的数据点数量
+        self.late = 0
+        self._stop_hooks = []
+        self._thread = None
+
+    @property
+    def dropped(self) -> int:
+        return self._buffer.dropped
+
+    @property
+    def windows(self) -> list:
+        """
+        :return: 最近输出的窗口 [PerfWindow]，按时间升序
+        """
+        return list(self._windows)
+
+    def push(self, metric: str, timestamp: float, value: float):
+        self._buffer.push((metric, timestamp, value))
+
+    def on_stop(self, func: Callable[[], None]):
+        """
+        添加停止时(在清空缓冲区之前)执行的操作，例如停止采集
+        """
+        self._stop_hooks.append(func)
+
+    def start(self) -> 'PerfPipeline':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'PerfPipeline-{self.device}', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        for func in self._stop_hooks:
+            try:
+                func()
+            except Exception as e:
+                logging.warning(f'[{self.device}] stop hook error: {e}')
+        self._buffer.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.dropped:
+            logging.warning(f'[{self.device}] {self.dropped} perf samples dropped, buffer is full')
+        if self.late:
+            logging.warning(f'[{self.device}] {self.late} perf samples missed their window, kept in raw only')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _apply_stages(self, metric: str, timestamp: float, value: float):
+        for stage in self.stages:
+            value = stage(metric, timestamp, value)
+            if value is None:
+                break
+        return value
+
+    def _run(self):
+        while True:
+            items = self._buffer.pop_all(self.window)
+            for metric, timestamp, value in items:
+                try:
+                    value = self._apply_stages(metric, timestamp, value)
+                except Exception as e:
+                    logging.warning(f'[{self.device}] stage error on {metric}: {e}')
+                    continue
+                if value is None:
+                    continue
+                self.raw.append(timestamp, value, metric, self.device)
+                index = int(timestamp // self.window)
+                if self._emitted_upto is not None and index <= self._emitted_upto:
+                    self.late += 1
+                    continue
+                self._pending.setdefault(index, {}).setdefault(metric, []).append(value)
+            if self._pending:
+                self._emit_before(max(self._pending) - self.lateness)
+            if not items and self._buffer.closed:
+                break
+        self._emit_before(None)
+
+    def _emit_before(self, index):
+        """
+        输出编号小于 index 的窗口，index 为None时输出全部
+        """
+        for i in sorted(self._pending):
+            if index is not None and i >= index:
+                break
+            values = {}
+            for metric, vs in self._pending.pop(i).items():
+                values[metric] = MetricSeries.AGGREGATES[self.how.get(metric, 'sum')](vs)
+            self._emitted_upto = i
+            w = PerfWindow(i * self.window, self.window, self.device, values)
+            self._windows.append(w)
+            for sink in self.sinks:
+                try:
+                    sink(w)
+                except Exception as e:
+                    logging.warning(f'[{self.device}] sink error: {e}')
@@ -0,0 +1,135 @@
+# coding=utf8
+import time
+import types
+from logging import getLogger
+
+from .my_adb import AdbBase, SysCPU, SysMemory, NetFlow
+
+logging = getLogger(__name__)
+
+
+class PerfSample:
+    def __init__(self, device_time: float, host_time: float, sys_cpu: SysCPU, app_cpu: dict,
+                 sys_memory: SysMemory, app_rss: dict, net: NetFlow):
+        """
+        :param device_time: 设备开机至今的秒数(/proc/uptime)，同一个流中的采样时间以此为准，不受ADB传输抖动影响
+        :param host_time: 主机端解析出该采样的时间戳
+        :param sys_cpu: 系统CPU时间
+        :param app_cpu: {进程ID: AppCPU}，已经销毁的进程不会出现
+        :param sys_memory: 系统内存概况
+        :param app_rss: {进程ID: 常驻内存(RSS，来自/proc/{pid}/statm) MB}，注意与 get_memory_by_pids 的PSS不同
+        :param net: 累计流量，设备不支持按应用读取流量时为None
+        """
+        self.device_time = device_time
+        self.host_time = host_time
+        self.sys_cpu = sys_cpu
+        self.app_cpu = app_cpu
+        self.sys_memory = sys_memory
+        self.app_rss = app_rss
+        self.net = net
+
+    def __str__(self):
+        return f'[{self.device_time:.2f}s] {self.sys_cpu} {self.sys_memory} {self.net}'
+
+
+class PerfStream:
+    """
+    基于一个长连接 stream_shell 的连续性能采样
+    在设备端启动一个shell循环，按指定间隔输出带分段标记的采样帧，主机端增量解析
+    """
+    _frame_end = 'end'
+
+    def __init__(self, adb: AdbBase, pid_list: list = None, uid: str = None, interval: float = 1.0):
+        """
+        :param adb: 目标设备
+        :param pid_list: 需要采集CPU及内存的进程ID列表
+        :param uid: 应用用户ID(参考 get_app_user_id)，提供则采集该应用流量，否则采集整机流量
+        :param interval: 采样间隔，秒，支持小数
+        """
+        self.adb = adb
+        self.pid_list = [str(x) for x in pid_list or []]
+        self.uid = uid and str(uid)
+        self.interval = interval
+        # 设备不支持的指标(例如 Android 10+ 按应用读取流量)，解析失败一次后不再解析
+        self._net_supported = True
+        self._stream = None
+
+    def _build_cmd(self) -> str:
+        a = self.adb
+        cmd = [a._echo_section('uptime'), 'cat /proc/uptime',
+               a._echo_section('stat'), 'head -n 1 /proc/stat',
+               a._echo_section('freq'), a._cat_cpu_freq_cmd(a.get_cpu_count(), 'scaling_cur_freq'),
+               a._echo_section('meminfo'), a._sys_memory_cmd(),
+               a._echo_section('net'), a._net_flow_cmd(self.uid)]
+        for pi in self.pid_list:
+            cmd.append(a._echo_section(f'pid:{pi}'))
+            cmd.append(f'cat /proc/{pi}/stat')
+            cmd.append(a._echo_section(f'statm:{pi}'))
+            cmd.append(f'cat /proc/{pi}/statm')
+        cmd.append(a._echo_section(self._frame_end))
+        return f'while true; do {"; ".join(cmd)}; sleep {self.interval}; done'
+
+    def _parse_frame(self, frame: str, max_freq_list: list, page_size: int) -> PerfSample:
+        a = self.adb
+        ss = a._split_sections(frame)
+        app_cpu = {}
+        app_rss = {}
+        for pi in self.pid_list:
+            rs = ss.get(f'pid:{pi}', '').strip()
+            if not rs or rs.find('No such') != -1:
+                continue
+            app_cpu[pi] = a._parse_app_cpu(rs)
+            m = ss.get(f'statm:{pi}', '').split()
+            if len(m) > 1 and m[1].isdigit():
+                # statm 第2列为常驻内存页数
+                app_rss[pi] = int(m[1]) * page_size / 1024.0 / 1024.0
+        return PerfSample(
+            float(ss['uptime'].split()[0]),
+            time.time(),
+            a._parse_sys_cpu(ss['stat'], a._compute_cpu_freq(ss['freq'], max_freq_list)),
+            app_cpu,
+            a._parse_sys_memory(ss['meminfo']),
+            app_rss,
+            self._parse_net(ss.get('net', ''))
+        )
+
+    def _parse_net(self, rs: str):
+        if not self._net_supported:
+            return None
+        try:
+            return self.adb._parse_net_flow(rs, self.uid)
+        except EnvironmentError as e:
+            logging.warning(f'Net flow disabled: {e}')
+            self._net_supported = False
+            return None
+
+    def __iter__(self) -> types.GeneratorType:
+        """
+        启动设备端采样循环，每次返回一个 PerfSample
+        """
+        max_freq_list = self.adb.get_cpu_max_freq_list()
+        page_size = self.adb.get_page_size()
+        end_mark = f'{self.adb._section_mark}{self._frame_end}'
+        self._stream = self.adb.stream_shell(self._build_cmd())
+        frame = []
+        try:
+            for x in self._stream:
+                if x != end_mark:
+                    frame.append(x)
+                    continue
+                try:
+                    sample = self._parse_frame('\n'.join(frame), max_freq_list, page_size)
+                except (KeyError, ValueError, IndexError) as e:
+                    logging.warning(f'Bad perf frame: {e}')
+                    sample = None
+                frame = []
+                if sample:
+                    yield sample
+        finally:
+            self.close()
+
+    def close(self):
+        if self._stream is not None:
+            s, self._stream = self._stream, None
+            if hasattr(s, 'close'):
+                s.close()
@@ -1,14 +1,40 @@
+import socket
 import types
 
 from airtest.core.android.py_adb import ADB
 
-from .my_adb import AdbInterface
+from .my_adb import AdbInterface, LineFramer, ShellChannel
+
+
+class PureAdbShellChannel(ShellChannel):
+    # 基于 adb server socket 连接的常驻shell通道
+    def __init__(self, connection, read_timeout: float = None):
+        """
+        :param read_timeout: 读取的最长等待秒数，为None时一直等待
+        """
+        self._conn = connection
+        self.read_timeout = read_timeout
+
+    def write(self, data: bytes):
+        self._conn.socket.settimeout(None)
+        self._conn.socket.sendall(data)
+
+    def read(self) -> bytes:
+        self._conn.socket.settimeout(self.read_timeout)
+        try:
+            return self._conn.read(4096)
+        except socket.timeout:
+            raise TimeoutError(f'No output from adb shell in {self.read_timeout}s')
+
+    def close(self):
+        self._conn.close()
 
 
 class PureAdb(ADB, AdbInterface):
     """
     基于pure-python-adb的封装
     """
+    read_timeout = 600  # 常驻shell会话读取的最长等待秒数，为None时一直等待
 
     def __init__(self, serial=None):
         if not serial:
@@ -23,19 +49,21 @@ class PureAdb(ADB, AdbInterface):
     def get_device_serial(self) -> str:
         return self.serial
 
-    def stream_shell(self, cmd: str) -> types.GeneratorType:
+    def stream_shell(self, cmd: str, binary=False, read_size=4096) -> types.GeneratorType:
+        """
+        :param read_size: 每次从连接读取的最大字节数
+        """
         def handler(connection):
             try:
-                while True:
-                    d = connection.read(1024)
-                    if not d:
-                        break
-                    yield d.decode('utf-8')
+                yield from LineFramer.iter_lines(iter(lambda: connection.read(read_size), b''), binary)
             finally:
                 connection.close()
 
         return self.shell(cmd, handler=handler)
 
+    def open_shell_channel(self) -> ShellChannel:
+        return self.shell('sh', handler=lambda c: PureAdbShellChannel(c, self.read_timeout))
+
     def run_shell(self, cmd: str, clean_wrap=False) -> str:
         return self.shell(cmd, clean_wrap=clean_wrap)
 
@@ -1,12 +1,24 @@
 import os
+import posixpath
+import queue
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
 from logging import getLogger
 import types
+from typing import Callable
 
 from adb import adb_commands
 from adb import sign_pythonrsa
-from adb.adb_protocol import InvalidResponseError, InvalidCommandError
+from adb import usb_exceptions
+from adb.filesync_protocol import FilesyncProtocol
+from adb.adb_protocol import AdbMessage, InvalidResponseError, InvalidCommandError, InvalidChecksumError, \
+    InterleavedDataError
+import usb1
 
-from .my_adb import AdbInterface
+from .my_adb import AdbInterface, LineFramer, ShellChannel
 
 logging = getLogger(__name__)
 
@@ -15,8 +27,459 @@ class ReadConnectError(Exception):
     pass
 
 
+class ReadTimeoutError(TimeoutError):
+    # 超过读取时限仍无输出，命令可能仍在执行，不会自动重试
+    pass
+
+
+# 出现以下传输层错误时认为连接已不可用，需要关闭并重新连接；其他错误(例如本地文件不存在)直接抛出
+CONNECTION_ERRORS = (InvalidResponseError, InvalidCommandError, InvalidChecksumError, InterleavedDataError,
+                     usb_exceptions.CommonUsbError, usb1.USBError, ConnectionError, socket.timeout, socket.gaierror)
+
+
+def is_timeout_error(e: Exception) -> bool:
+    """
+    :return: 是否为读写超时(连接本身仍可用)
+    """
+    return isinstance(e, usb_exceptions.TcpTimeoutException) or isinstance(
+        getattr(e, 'usb_error', None), usb1.USBErrorTimeout)
+
+
+def backoff_delay(retry: int, base: float = 0.2, ceiling: float = 5.0) -> float:
+    """
+    带随机抖动的指数退避，避免多个设备同时重连
+    :param retry: 第几次重试，从0开始
+    :return: 等待秒数
+    """
+    return random.uniform(0, min(ceiling, base * 2 ** retry))
+
+
+def call_with_retries(func: Callable, max_retries: int, retry_if: Callable[[Exception], bool] = None):
+    """
+    执行 func()，出现连接错误时按 backoff_delay 等待后重试
+    :param max_retries: 最大重试次数，超过后报错 ReadConnectError
+    :param retry_if: 可选，func(错误) 返回False时不再重试，直接报错 ReadConnectError；读取超时(ReadTimeoutError)不会重试
+    """
+    retry = 0
+    while True:
+        try:
+            return func()
+        except ReadTimeoutError:
+            raise
+        except CONNECTION_ERRORS as e:
+            if retry >= max_retries or (retry_if is not None and not retry_if(e)):
+                raise ReadConnectError(e)
+            delay = backoff_delay(retry)
+            retry += 1
+            logging.warning(f'adb connection error: {e}, retry {retry}/{max_retries} after {delay:.2f}s')
+            time.sleep(delay)
+
+
+class AdbConnectionManager:
+    """
+    单个设备的 python-adb 连接池
+    连接出错时关闭并按退避时间重试(有次数上限)；空闲较久的连接使用前先执行 echo 检查是否可用；多余的空闲连接超时后关闭
+    USB设备只能被占用一次，只允许1个连接；网络设备(设备号为 ip:端口)可同时建立多个连接
+    """
+
+    def __init__(self, connect: Callable[[], adb_commands.AdbCommands], max_connections: int = 1,
+                 max_retries: int = 3, probe_after: float = 10, idle_timeout: float = 60, acquire_timeout: float = 60):
+        """
+        :param connect: 建立连接的方法
+        :param max_connections: 最大连接数
+        :param max_retries: 连接出错时的最大重试次数
+        :param probe_after: 连接空闲超过该秒数时，使用前先检查是否可用
+        :param idle_timeout: 多余的连接空闲超过该秒数时关闭，始终保留1个连接
+        :param acquire_timeout: 连接都被占用时，等待的最长秒数
+        """
+        self._connect = connect
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.probe_after = probe_after
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # [(连接, 开始空闲的时间)]，最近使用的在最后
+        self._count = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _close(adb: adb_commands.AdbCommands):
+        try:
+            adb.Close()
+        except Exception as e:
+            logging.debug(f'close adb connection error: {e}')
+
+    @staticmethod
+    def ping(adb: adb_commands.AdbCommands) -> bool:
+        try:
+            return adb.Shell('echo ping').strip() == 'ping'
+        except CONNECTION_ERRORS as e:
+            logging.warning(f'adb connection probe failed: {e}')
+            return False
+
+    def _evict(self):
+        now = time.time()
+        while len(self._idle) > 1 and now - self._idle[0][1] > self.idle_timeout:
+            self._close(self._idle.pop(0)[0])
+            self._count -= 1
+
+    def _take(self) -> (adb_commands.AdbCommands, float):
+        deadline = time.time() + self.acquire_timeout
+        with self._cond:
+            while True:
+                self._evict()
+                if self._idle:
+                    return self._idle.pop()
+                if self._count < self.max_connections:
+                    self._count += 1
+                    return None, 0
+                remain = deadline - time.time()
+                if remain <= 0:
+                    raise ReadConnectError('Wait for an idle adb connection timeout!')
+                self._cond.wait(remain)
+
+    def acquire(self) -> adb_commands.AdbCommands:
+        adb, idle_since = self._take()
+        try:
+            if adb is not None and time.time() - idle_since > self.probe_after and not self.ping(adb):
+                self._close(adb)
+                adb = None
+            if adb is None:
+                adb = self._connect()
+        except Exception:
+            self.discard(None)
+            raise
+        return adb
+
+    def release(self, adb: adb_commands.AdbCommands):
+        with self._cond:
+            self._idle.append((adb, time.time()))
+            self._cond.notify()
+
+    def discard(self, adb: adb_commands.AdbCommands = None):
+        """
+        关闭出错的连接
+        """
+        if adb is not None:
+            self._close(adb)
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        占用一个连接，出现连接错误或调用方中途放弃(例如未读完的流式输出)时关闭该连接，否则放回连接池
+        """
+        adb = self.acquire()
+        try:
+            yield adb
+        except CONNECTION_ERRORS + (GeneratorExit,):
+            self.discard(adb)
+            raise
+        except BaseException:
+            self.release(adb)
+            raise
+        else:
+            self.release(adb)
+
+    def run(self, func: Callable, max_retries: int = None):
+        """
+        占用一个连接执行 func(连接)，连接出错时重新连接并重试
+        :param max_retries: 最大重试次数，默认为 self.max_retries
+        """
+        def run_once():
+            with self.connection() as adb:
+                return func(adb)
+
+        return call_with_retries(run_once, self.max_retries if max_retries is None else max_retries)
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+                self._count -= 1
+
+
+class PyAdbShellChannel(ShellChannel):
+    # 基于 python-adb 连接的shell通道，默认为常驻shell
+    MAX_WRITE_SIZE = 4096  # 旧版本adbd单个数据包的最大长度
+
+    def __init__(self, adb: adb_commands.AdbCommands, connections: 'AdbConnectionManager' = None,
+                 read_timeout: float = 600, destination: bytes = b'shell:sh'):
+        """
+        :param connections: 连接所属的连接池，通道关闭后将连接归还；未读完输出就关闭时，关闭该连接
+        :param read_timeout: 读取的最长等待秒数，命令执行较慢时 python-adb 单次读取超时不视为出错，为None时一直等待
+        :param destination: 服务名
+        """
+        self._adb = adb
+        self._connections = connections
+        self.read_timeout = read_timeout
+        self._eof = False
+        self._conn = adb.protocol_handler.Open(adb._handle, destination=destination)
+        if self._conn is None:
+            raise ReadConnectError(f'Open service {destination} failed!')
+
+    def write(self, data: bytes):
+        for i in range(0, len(data), self.MAX_WRITE_SIZE):
+            self._conn.Write(data[i:i + self.MAX_WRITE_SIZE])
+
+    def read(self) -> bytes:
+        deadline = None if self.read_timeout is None else time.time() + self.read_timeout
+        while True:
+            try:
+                cmd, data = self._conn.ReadUntil(b'WRTE', b'CLSE')
+                break
+            except CONNECTION_ERRORS as e:
+                if not is_timeout_error(e):
+                    raise
+                if deadline is not None and time.time() > deadline:
+                    raise ReadTimeoutError(f'No output from adb shell in {self.read_timeout}s')
+        if cmd == b'CLSE':
+            self._eof = True
+            return b''
+        return data
+
+    def close(self):
+        if self._connections is None:
+            self._conn.Close()
+            return
+        connections, self._connections = self._connections, None
+        try:
+            self._conn.Close()
+        except CONNECTION_ERRORS:
+            connections.discard(self._adb)
+            return
+        if self._eof:
+            connections.release(self._adb)
+        else:
+            # python-adb 固定使用同一个 local-id，未读完的数据会被后续命令读到
+            connections.discard(self._adb)
+
+
+class MuxStream(ShellChannel):
+    # AdbStreamMultiplexer 上的单个数据流
+    MAX_WRITE_SIZE = PyAdbShellChannel.MAX_WRITE_SIZE
+
+    def __init__(self, mux: 'AdbStreamMultiplexer', local_id: int, read_timeout: float = None):
+        """
+        :param read_timeout: 读取的最长等待秒数，超过后报错 ReadTimeoutError，为None时一直等待
+        """
+        self.mux = mux
+        self.local_id = local_id
+        self.read_timeout = read_timeout
+        self.remote_id = None
+        self.closed = False
+        self._data = queue.Queue()  # WRTE 的数据，对方关闭时为 b''，连接出错时为异常
+        self._acks = queue.Queue()  # (命令, 对方ID)，连接出错时为异常
+
+    def _get(self, q: queue.Queue, timeout=None):
+        try:
+            rs = q.get(timeout=timeout)
+        except queue.Empty:
+            raise InvalidResponseError(f'Wait for adb stream {self.local_id} timeout!')
+        if isinstance(rs, Exception):
+            raise rs
+        return rs
+
+    def write(self, data: bytes):
+        for i in range(0, len(data), self.MAX_WRITE_SIZE):
+            self.mux.send(b'WRTE', self.local_id, self.remote_id, data[i:i + self.MAX_WRITE_SIZE])
+            cmd, _ = self._get(self._acks, self.mux.timeout_ms / 1000)
+            if cmd != b'OKAY':
+                raise InvalidResponseError(f'Expected an OKAY in response to a WRITE, got {cmd}')
+
+    def read(self) -> bytes:
+        if self.closed:
+            return b''
+        try:
+            data = self._get(self._data, self.read_timeout)
+        except InvalidResponseError:
+            raise ReadTimeoutError(f'No output from adb stream {self.local_id} in {self.read_timeout}s')
+        if not data:
+            self.closed = True
+        else:
+            # 读取后再回复OKAY，对方收到后才会发送下一个数据包，读取较慢时数据不会在本地堆积
+            self.mux.send(b'OKAY', self.local_id, self.remote_id)
+        return data
+
+    def close(self):
+        self.mux.close_stream(self)
+
+
+class MuxSyncConnection:
+    """
+    将 sync 服务的 MuxStream 适配为 python-adb FilesyncProtocol 所需的连接(Write/ReadUntil)
+    文件传输因此可以与其他数据流同时进行，不需要独占USB连接
+    """
+
+    def __init__(self, stream: MuxStream):
+        self.stream = stream
+
+    def Write(self, data: bytes):
+        self.stream.write(bytes(data))
+
+    def ReadUntil(self, *expected_cmds) -> (bytes, bytes):
+        data = self.stream.read()
+        if not data:
+            raise InvalidResponseError('adb sync stream closed')
+        return b'WRTE', data
+
+
+class AdbStreamMultiplexer:
+    """
+    在同一个USB连接上同时打开多个数据流，例如在 stream_shell 的同时执行 run_shell
+    python-adb 固定使用 local-id 1，读取时会丢弃不属于当前数据流的数据包，同一时刻只能有一个数据流；
+    这里为每个数据流分配不同的 local-id，由读线程按 local-id 分发数据包
+    有数据流打开期间会一直占用连接池中的连接
+    """
+    POLL_MS = 200  # 读线程检查是否需要退出的间隔
+
+    def __init__(self, connections: AdbConnectionManager, timeout_ms: int = 10000):
+        self.connections = connections
+        self.timeout_ms = timeout_ms
+        self._adb = None
+        self._streams = {}
+        self._next_id = 0
+        self._reader = None
+        self._stop = None
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+
+    def send(self, cmd: bytes, arg0: int, arg1: int, data: bytes = b''):
+        adb = self._adb
+        if adb is None:
+            raise ReadConnectError('Multiplexer is detached!')
+        with self._send_lock:
+            AdbMessage(cmd, arg0, arg1, data).Send(adb._handle, self.timeout_ms)
+
+    def _attach(self):
+        # 调用时需持有 self._cond
+        if self._adb is None:
+            self._adb = self.connections.acquire()
+            self._stop = threading.Event()
+            self._reader = threading.Thread(target=self._read_loop, args=(self._adb, self._stop),
+                                            name='AdbStreamReader', daemon=True)
+            self._reader.start()
+
+    def open(self, destination: bytes, read_timeout: float = None) -> MuxStream:
+        """
+        :param destination: 服务名，例如 b'shell:ls'
+        :param read_timeout: 参考 MuxStream
+        """
+        with self._cond:
+            self._attach()
+            self._next_id = self._next_id % 0x7fffffff + 1
+            stream = MuxStream(self, self._next_id, read_timeout)
+            self._streams[stream.local_id] = stream
+        try:
+            self.send(b'OPEN', stream.local_id, 0, destination + b'\0')
+            cmd, remote_id = stream._get(stream._acks, self.timeout_ms / 1000)
+        except Exception:
+            self._unregister(stream)
+            raise
+        if cmd != b'OKAY':
+            self._unregister(stream)
+            raise ReadConnectError(f'Open service {destination} failed!')
+        stream.remote_id = remote_id
+        return stream
+
+    def close_stream(self, stream: MuxStream):
+        if stream.local_id not in self._streams:
+            return
+        try:
+            if stream.remote_id is not None:
+                self.send(b'CLSE', stream.local_id, stream.remote_id)
+        except CONNECTION_ERRORS as e:
+            logging.debug(f'close adb stream error: {e}')
+        finally:
+            self._unregister(stream)
+
+    def _unregister(self, stream: MuxStream):
+        with self._cond:
+            self._streams.pop(stream.local_id, None)
+            self._cond.notify_all()
+
+    def _read_loop(self, adb: adb_commands.AdbCommands, stop: threading.Event):
+        handle = adb._handle
+        try:
+            while not stop.is_set():
+                try:
+                    header = handle.BulkRead(24, self.POLL_MS)
+                except CONNECTION_ERRORS as e:
+                    if is_timeout_error(e):
+                        continue
+                    raise
+                cmd, arg0, arg1, length, _ = AdbMessage.Unpack(bytes(header))
+                data = bytearray()
+                while len(data) < length:
+                    data += handle.BulkRead(length - len(data), self.timeout_ms)
+                self._dispatch(AdbMessage.constants.get(cmd), arg0, arg1, bytes(data))
+        except Exception as e:
+            logging.warning(f'adb stream reader stopped on error: {e}')
+            self._fail(adb, e)
+
+    def _dispatch(self, cmd: bytes, remote_id: int, local_id: int, data: bytes):
+        stream = self._streams.get(local_id)
+        if stream is None:
+            # 已关闭的数据流
+            return
+        if cmd == b'WRTE':
+            stream._data.put(data)
+        elif cmd == b'CLSE':
+            if stream.remote_id is None:
+                stream._acks.put((cmd, remote_id))
+            else:
+                stream._data.put(b'')
+        elif cmd == b'OKAY':
+            stream._acks.put((cmd, remote_id))
+        else:
+            logging.debug(f'drop unexpected adb packet: {cmd}')
+
+    def _fail(self, adb: adb_commands.AdbCommands, e: Exception):
+        # 连接出错，通知所有数据流并关闭连接，下次打开数据流时重新连接
+        with self._cond:
+            if self._adb is not adb:
+                return
+            self._adb = None
+            self._stop.set()
+            streams, self._streams = self._streams, {}
+            self._cond.notify_all()
+        for x in streams.values():
+            x._data.put(e)
+            x._acks.put(e)
+        self.connections.discard(adb)
+
+    def detach(self, timeout: float = 60):
+        """
+        等待所有数据流关闭后停止读线程，将连接归还连接池，以便直接使用 python-adb 的连接
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._streams, timeout):
+                raise ReadConnectError('Wait for adb streams closed timeout!')
+            adb, self._adb = self._adb, None
+            if adb is None:
+                return
+            self._stop.set()
+            reader = self._reader
+        reader.join()
+        self.connections.release(adb)
+
+    def close(self):
+        with self._cond:
+            streams = list(self._streams.values())
+        for x in streams:
+            x.close()
+        self.detach()
+
+
 class PyAdb(AdbInterface):
     """python-adb的封装"""
+    read_timeout = 600  # run_shell 及常驻shell等待输出的最长秒数
+    install_timeout = 1200  # 安装应用的最长秒数
 
     @staticmethod
     def my_load_rsa_key_path(file_path):
@@ -28,30 +491,67 @@ class PyAdb(AdbInterface):
         return sign_pythonrsa.PythonRSASigner(pub, pri)
 
     @classmethod
-    def connect_dev(cls, adb_key_path, serial=None) -> adb_commands.AdbCommands:
+    def connect_dev(cls, adb_key_path, serial=None, max_retries=3) -> adb_commands.AdbCommands:
         """
         连接设备，可指定连接的具体设备名
         :param adb_key_path: 与设备通讯的授权密钥
         :param serial: 可选，设备号 (可通过adb devices查看)，不提供则连接第一个
+        :param max_retries: 连接出错时的最大重试次数
         :return:
         """
-        dev = adb_commands.AdbCommands()
-        try:
-            dev.ConnectDevice(rsa_keys=[cls.my_load_rsa_key_path(os.path.expanduser(adb_key_path))], serial=serial)
-        except InvalidCommandError as e:
-            dev.Close()
-            logging.warning(f'reconnect on error: {e}')
-            return cls.connect_dev(adb_key_path, serial=serial)
-        return dev
-
-    def __init__(self, serial=None, adb_key_path='~/.android/adbkey'):
-        try:
-            os.system('adb kill-server')
-        except:
-            pass
+        retry = 0
+        while True:
+            dev = adb_commands.AdbCommands()
+            try:
+                dev.ConnectDevice(rsa_keys=[cls.my_load_rsa_key_path(os.path.expanduser(adb_key_path))], serial=serial)
+                return dev
+            except InvalidCommandError as e:
+                dev.Close()
+                if retry >= max_retries:
+                    raise
+                delay = backoff_delay(retry)
+                retry += 1
+                logging.warning(f'reconnect on error: {e}, retry {retry}/{max_retries} after {delay:.2f}s')
+                time.sleep(delay)
+
+    def __init__(self, serial=None, adb_key_path='~/.android/adbkey', kill_server=True, max_connections=None):
+        """
+        :param serial: 可选，设备号，不提供则连接第一个
+        :param adb_key_path: 与设备通讯的授权密钥
+        :param kill_server: 是否先关闭本机 adb server (USB设备被 adb server 占用时无法直接连接)
+                            注意：会断开本机所有其他 adb 连接，多设备并行时请设为False
+        :param max_connections: 最大连接数，默认网络设备为4，USB设备只能为1
+        """
+        if kill_server:
+            try:
+                os.system('adb kill-server')
+            except:
+                pass
         self.serial = serial
         self.adb_key_path = adb_key_path
-        self.adb = self.open_connect()
+        if not self.is_tcp_serial(serial):
+            max_connections = 1
+        self.connections = AdbConnectionManager(self.open_connect, max_connections=max_connections or 4)
+        # 网络设备的每个数据流使用单独的连接；USB设备只有1个连接，通过多路复用同时执行多个命令
+        self.mux = None if max_connections != 1 else AdbStreamMultiplexer(self.connections)
+        # 先建立一个连接，尽早发现设备连接问题
+        self.connections.release(self.connections.acquire())
+
+    @property
+    def adb(self) -> adb_commands.AdbCommands:
+        """
+        兼容旧版本的属性: 返回连接池中的一个连接，USB设备会先等待多路复用的数据流结束
+        直接使用该连接时不能与其他命令并发
+        """
+        if self.mux:
+            self.mux.detach(self.connections.acquire_timeout)
+        adb = self.connections.acquire()
+        self.connections.release(adb)
+        return adb
+
+    @staticmethod
+    def is_tcp_serial(serial: str) -> bool:
+        return bool(serial) and ':' in serial
 
     def get_device_serial(self) -> str:
         return self.serial
@@ -59,56 +559,132 @@ class PyAdb(AdbInterface):
     def open_connect(self) -> adb_commands.AdbCommands:
         return self.connect_dev(self.adb_key_path, serial=self.serial)
 
-    def _on_read_error(self, e, cmd, clean_wrap, reconnect_on_err):
-        if reconnect_on_err:
-            logging.warning('trying to reconnect adb!')
-            self.adb.Close()
-            self.adb = self.open_connect()
-            return self.run_shell(cmd, clean_wrap, reconnect_on_err)
-        else:
-            raise ReadConnectError(e)
-
     def run_shell(self, cmd: str, clean_wrap=False, reconnect_on_err=True) -> str:
         """
         执行命令
         :param cmd: 命令内容
         :param clean_wrap: 是否清理结果换行
-        :param reconnect_on_err: 命令执行过程中出现IO读写的错误时重新连接. 如果为False，则发生错误时将报错 ReadConnectError
+        :param reconnect_on_err: 命令执行过程中出现IO读写的错误时重新连接(重试次数参考 AdbConnectionManager.max_retries).
+                                 如果为False，则发生错误时将报错 ReadConnectError；已收到部分输出时不会重试，避免命令重复执行
         :return:
         """
         logging.debug(f'adb shell {cmd}')
-        try:
-            rs = self.adb.Shell(cmd)
-            if clean_wrap:
-                rs = rs.strip()
-            return rs
-        except InvalidResponseError as e:
-            return self._on_read_error(e, cmd, clean_wrap, reconnect_on_err)
-        except InvalidCommandError as e:
-            return self._on_read_error(e, cmd, clean_wrap, reconnect_on_err)
-        except AttributeError as e:
-            return self._on_read_error(e, cmd, clean_wrap, reconnect_on_err)
-
-    def stream_shell(self, cmd: str) -> types.GeneratorType:
+        rs = self._shell_output(cmd, self.read_timeout, self.connections.max_retries if reconnect_on_err else 0)
+        if clean_wrap:
+            rs = rs.strip()
+        return rs
+
+    def _shell_output(self, cmd: str, read_timeout: float, max_retries: int) -> str:
+        received = []
+
+        def run_once():
+            for x in self._shell_chunks(cmd, read_timeout):
+                received.append(x)
+            return b''.join(received).decode('utf-8', 'replace')
+
+        # 已收到部分输出时命令已经执行，不再重试
+        return call_with_retries(run_once, max_retries, lambda e: not received)
+
+    def stream_shell(self, cmd: str, binary=False) -> types.GeneratorType:
         """
         执行命令，返回输出流的迭代器，每次返回一行输出结果
         :param cmd: 命令内容
+        :param binary: 是否返回 bytes，不解码
         :return: 每行输出结果迭代
         """
         logging.debug(f'adb shell(Streaming) {cmd}')
-        return self.adb.StreamingShell(cmd)
+        # 流式输出可能长时间没有新内容，不设置读取时限
+        yield from LineFramer.iter_lines(self._shell_chunks(cmd), binary)
+
+    def _open_stream(self, destination: bytes, read_timeout: float = None) -> ShellChannel:
+        """
+        USB设备在多路复用的连接上打开数据流；网络设备占用连接池中的一个连接，数据流关闭后归还
+        """
+        if self.mux:
+            return self.mux.open(destination, read_timeout)
+        adb = self.connections.acquire()
+        try:
+            return PyAdbShellChannel(adb, self.connections, read_timeout, destination)
+        except Exception:
+            self.connections.discard(adb)
+            raise
+
+    def _shell_chunks(self, cmd: str, read_timeout: float = None) -> types.GeneratorType:
+        stream = self._open_stream(b'shell:' + cmd.encode('utf-8'), read_timeout)
+        try:
+            yield from iter(stream.read, b'')
+        finally:
+            stream.close()
+
+    def open_shell_channel(self) -> ShellChannel:
+        """
+        常驻shell通道会一直占用一个数据流，直到通道关闭
+        """
+        return self._open_stream(b'shell:sh', self.read_timeout)
+
+    def _run_sync(self, func: Callable):
+        """
+        执行文件传输 func(python-adb FilesyncProtocol 所需的连接)
+        USB设备在多路复用的 sync 数据流上传输，不需要等待其他数据流(例如 logcat)结束；网络设备使用连接池中的单独连接
+        """
+        if not self.mux:
+            def run_on(adb: adb_commands.AdbCommands):
+                conn = adb.protocol_handler.Open(adb._handle, destination=b'sync:')
+                if conn is None:
+                    raise ReadConnectError('Open sync service failed!')
+                try:
+                    return func(conn)
+                finally:
+                    conn.Close()
+
+            return self.connections.run(run_on)
+
+        def run_once():
+            stream = self.mux.open(b'sync:', self.read_timeout)
+            try:
+                return func(MuxSyncConnection(stream))
+            finally:
+                stream.close()
+
+        return call_with_retries(run_once, self.connections.max_retries)
 
     def add_app(self, apk_path):
-        return self.adb.Install(apk_path, grant_permissions=True, timeout_ms=1200000)
+        if not self.mux:
+            return self.connections.run(
+                lambda adb: adb.Install(apk_path, grant_permissions=True, timeout_ms=self.install_timeout * 1000))
+        # 与 python-adb 的 Install 一致: 推送到临时目录，安装后删除
+        device_path = posixpath.join('/data/local/tmp/', os.path.basename(apk_path))
+        self.push_file(apk_path, device_path)
+        try:
+            return self._shell_output(f'pm install -g -r "{device_path}"', self.install_timeout, 0)
+        finally:
+            self.run_shell(f'rm "{device_path}"')
 
     def remove_app(self, app_bundle: str):
-        return self.adb.Uninstall(app_bundle)
+        return self.run_shell(f'pm uninstall {app_bundle}')
 
     def close(self):
-        self.adb.Close()
+        if self.mux:
+            self.mux.close()
+        self.connections.close()
 
     def push_file(self, local_path: str, device_path: str):
-        return self.adb.Push(local_path, device_path)
+        if os.path.isdir(local_path):
+            self.run_shell(f'mkdir -p "{device_path}"')
+            for f in os.listdir(local_path):
+                self.push_file(os.path.join(local_path, f), f'{device_path}/{f}')
+            return
+
+        def push(conn):
+            with open(local_path, 'rb') as f:
+                FilesyncProtocol.Push(conn, f, device_path)
+
+        return self._run_sync(push)
 
     def pull_file(self, device_path: str, local_path: str):
-        return self.adb.Pull(device_path, local_path)
+        def pull(conn):
+            with open(local_path, 'wb') as f:
+                FilesyncProtocol.Pull(conn, device_path, f, None)
+            return True
+
+        return self._run_sync(pull)
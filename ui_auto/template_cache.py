@@ -0,0 +1,186 @@
+# coding=utf8
+import os
+import threading
+import types
+from collections import OrderedDict
+from logging import getLogger
+
+import cv2
+from airtest import aircv
+from airtest.aircv.template_matching import TemplateMatching
+from airtest.core.cv import Template
+from airtest.core.settings import Settings as ST
+
+logging = getLogger(__name__)
+
+
+class TemplateImageCache:
+    """
+    进程内共享的模板图片LRU缓存
+    以 (图片路径, 修改时间) 为键保存解码后的图片，图片文件被替换后自动失效；超过数量或内存上限时淘汰最久未使用的图片
+    """
+
+    def __init__(self, max_items: int = 256, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param max_items: 最多缓存的图片数量
+        :param max_bytes: 解码后图片占用内存的上限，字节
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, file_path: str):
+        """
+        :param file_path: 图片路径
+        :return: 解码后的图片(cv2格式)
+        """
+        file_path = os.path.abspath(file_path)
+        key = (file_path, os.path.getmtime(file_path))
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return img
+        img = aircv.imread(file_path)
+        with self._lock:
+            self.misses += 1
+            if key not in self._images:
+                self._images[key] = img
+                self._size += img.nbytes
+                self._evict()
+        return img
+
+    def _evict(self):
+        while self._images and (len(self._images) > self.max_items or self._size > self.max_bytes):
+            _, img = self._images.popitem(last=False)
+            self._size -= img.nbytes
+
+    def preload(self, dir_path: str, ext: str = 'png') -> int:
+        """
+        预先加载目录下的全部模板图片
+        :param dir_path: 图片目录
+        :param ext: 图片扩展名
+        :return: 加载的图片数量
+        """
+        c = 0
+        for x in sorted(os.listdir(dir_path)):
+            if x.endswith(f'.{ext}'):
+                self.get(os.path.join(dir_path, x))
+                c += 1
+        logging.debug(f'preload {c} templates from {dir_path}')
+        return c
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._size = 0
+
+
+TEMPLATE_CACHE = TemplateImageCache()
+
+
+class CachedTemplate(Template):
+    # 从 TEMPLATE_CACHE 读取图片，避免每次识别都重新读取并解码图片文件
+
+    def _imread(self):
+        return TEMPLATE_CACHE.get(self.filepath)
+
+
+class RegionTemplate(CachedTemplate):
+    """
+    只在屏幕的部分区域内识别模板
+    区域可直接指定，也可以由 record_pos 加上边距推算；设置 pyramid_scale 时先在缩小的截图上粗略定位，再在候选区域内按原图精确识别
+    模板按整个屏幕的分辨率缩放(与 Template 一致)后，在区域内使用模板匹配(tpl)识别
+    """
+    coarse_threshold_offset = 0.1  # 粗略定位时降低的阈值，减少缩放带来的漏识别
+
+    def __init__(self, filename, region: tuple = None, margin: float = None, pyramid_scale: float = None, **kv):
+        """
+        :param region: 识别区域 (x, y, 宽, 高)，均为相对屏幕宽高的比例(0~1)
+        :param margin: 未指定 region 时，以 record_pos 为中心、向四周扩展的距离，为相对屏幕宽度的比例
+        :param pyramid_scale: 粗略定位时的缩放比例，例如 0.25，为空则不进行粗略定位
+        """
+        super().__init__(filename, **kv)
+        self.region = region
+        self.margin = margin
+        self.pyramid_scale = pyramid_scale
+
+    def _scaled_image(self, screen):
+        """
+        按录制时的分辨率(resolution)与当前整个屏幕的分辨率缩放模板，缩放方式为 ST.RESIZE_METHOD
+        """
+        img = self._imread()
+        h, w = screen.shape[:2]
+        if not self.resolution or tuple(self.resolution) == (w, h) or ST.RESIZE_METHOD is None:
+            return img
+        resize_method = ST.RESIZE_METHOD
+        if isinstance(resize_method, types.MethodType):
+            resize_method = resize_method.__func__
+        th, tw = img.shape[:2]
+        w_re, h_re = resize_method(tw, th, self.resolution, (w, h))
+        return cv2.resize(img, (max(1, w_re), max(1, h_re)))
+
+    @staticmethod
+    def _crop(screen, x0, y0, x1, y1):
+        h, w = screen.shape[:2]
+        x0, y0, x1, y1 = max(0, int(x0)), max(0, int(y0)), min(w, int(x1)), min(h, int(y1))
+        return x0, y0, screen[y0:y1, x0:x1]
+
+    def _search_area(self, screen, img):
+        h, w = screen.shape[:2]
+        if self.region:
+            x, y, rw, rh = self.region
+            return self._crop(screen, x * w, y * h, (x + rw) * w, (y + rh) * h)
+        if self.record_pos and self.margin is not None:
+            # record_pos 的计算方式参考 airtest.core.cv.Predictor
+            px, py = w * (0.5 + self.record_pos[0]), h / 2 + self.record_pos[1] * w
+            th, tw = img.shape[:2]
+            m = self.margin * w + max(tw, th) / 2
+            return self._crop(screen, px - m, py - m, px + m, py + m)
+        return 0, 0, screen
+
+    def _match(self, img, area, threshold: float, rgb: bool):
+        th, tw = img.shape[:2]
+        if area.shape[0] < th or area.shape[1] < tw:
+            return None
+        try:
+            return TemplateMatching(img, area, threshold=threshold, rgb=rgb).find_best_result()
+        except aircv.BaseError as e:
+            logging.debug(repr(e))
+            return None
+
+    def _coarse_area(self, area, img):
+        s = self.pyramid_scale
+        small_area = cv2.resize(area, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+        small_img = cv2.resize(img, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+        rs = self._match(small_img, small_area, max(self.threshold - self.coarse_threshold_offset, 0), False)
+        if not rs:
+            return None
+        xs = [p[0] for p in rs['rectangle']]
+        ys = [p[1] for p in rs['rectangle']]
+        pad = int(2 / s) + 1  # 缩放造成的位置误差
+        return self._crop(area, min(xs) / s - pad, min(ys) / s - pad, max(xs) / s + pad, max(ys) / s + pad)
+
+    def _cv_match(self, screen):
+        img = self._scaled_image(screen)
+        x0, y0, area = self._search_area(screen, img)
+        if self.pyramid_scale:
+            rs = self._coarse_area(area, img)
+            if not rs:
+                return None
+            x0, y0, area = x0 + rs[0], y0 + rs[1], rs[2]
+        if not area.size:
+            return None
+        rs = self._match(img, area, self.threshold, self.rgb)
+        if rs and (x0 or y0):
+            rs['result'] = (rs['result'][0] + x0, rs['result'][1] + y0)
+            rs['rectangle'] = [(p[0] + x0, p[1] + y0) for p in rs['rectangle']]
+        return rs